@@ -3,6 +3,26 @@ ASGI config for tabletap project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The guest views (menu pages, order submission and status) and the kitchen
+board's event stream are async, so under ASGI they run on the event loop
+without holding a worker thread. Serve it with gunicorn and uvicorn workers:
+
+    gunicorn tabletap.asgi:application -k uvicorn_worker.UvicornWorker \
+        --workers 4 --bind 0.0.0.0:8000
+
+or with uvicorn alone:
+
+    uvicorn tabletap.asgi:application --workers 4 --lifespan off
+
+Django does not implement the lifespan protocol, hence --lifespan off
+(UvicornWorker sends lifespan events but carries on without them).
+
+Under ASGI the sync code of each request runs on a thread of its own, so
+persistent connections (CONN_MAX_AGE) are not shared between requests and
+Django advises against them: set DB_CONN_MAX_AGE=0, or DB_POOL=true to keep
+connections in a pool.
+The bench_asgi command compares this deployment with the WSGI one.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -5,7 +5,9 @@ Generated by 'django-admin startproject' using Django 5.1.7.
 """
 
 from pathlib import Path
+import importlib.util
 import os
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 # Load .env file
@@ -40,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so session and auth queries are counted too
+    'tabletapapp.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,14 +98,51 @@ ACCOUNT_DEFAULT_HTTP_PROTOCOL='https'
 WSGI_APPLICATION = 'tabletap.wsgi.application'
 
 # Database
+# MySQL in production; DB_ENGINE=django.db.backends.sqlite3 with DB_NAME set to
+# a file path runs locally or for benchmarks without a MySQL server.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.mysql'),
         'NAME': os.getenv('DB_NAME', 'tabletap_db'),
         'USER': os.getenv('DB_USER', 'root'),
         'PASSWORD': os.getenv('DB_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '3306'),
+        # Keep connections open between requests, checked before each reuse,
+        # instead of paying a MySQL connect (and auth round trips) per request
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
+    }
+}
+
+# Under ASGI, sync ORM work runs on short-lived per-request threads, so
+# persistent connections would pile up; DB_POOL=True takes connections from
+# a process-wide pool instead (requires django-db-connection-pool).
+DB_POOL = os.getenv('DB_POOL', 'False') == 'True'
+if DB_POOL:
+    if importlib.util.find_spec('dj_db_conn_pool') is None:
+        raise ImproperlyConfigured("DB_POOL=True requires the django-db-connection-pool package")
+    if not DATABASES['default']['ENGINE'].startswith('django.db.backends.'):
+        raise ImproperlyConfigured("DB_POOL=True needs a built-in DB_ENGINE, e.g. django.db.backends.mysql")
+    DATABASES['default']['ENGINE'] = DATABASES['default']['ENGINE'].replace(
+        'django.db.backends.', 'dj_db_conn_pool.backends.'
+    )
+    # Closing at the end of a request hands the connection back to the pool
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['POOL_OPTIONS'] = {
+        'POOL_SIZE': int(os.getenv('DB_POOL_SIZE', '10')),
+        'MAX_OVERFLOW': int(os.getenv('DB_POOL_MAX_OVERFLOW', '10')),
+        'RECYCLE': int(os.getenv('DB_POOL_RECYCLE', '3600')),
+        'PRE_PING': True,
+    }
+
+# Cache
+# Use a shared backend (e.g. django.core.cache.backends.redis.RedisCache) when
+# running several workers so published menus are invalidated everywhere.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
     }
 }
 
@@ -122,11 +163,65 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'tabletapapp', 'static')]
 STATIC_ROOT = os.getenv('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
 
+# Uploaded files (menu photos and their resized variants)
+MEDIA_URL = os.getenv('MEDIA_URL', '/media/')
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
+# Widths (in pixels) of the resized menu photos, and the threads rendering them
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '400,800,1200').split(',')]
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+# Server-side QR codes (see tabletapapp/qrcodes.py): on-disk cache and drawing threads
+QR_CACHE_DIR = os.getenv('QR_CACHE_DIR', os.path.join(BASE_DIR, 'qr_cache'))
+QR_WORKERS = int(os.getenv('QR_WORKERS', '4'))
+# Scheme and host encoded in QR codes, e.g. https://tabletap.example.com;
+# taken from the request when empty
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '')
+
+# Largest menu photo accepted by the upload endpoint
+MENU_IMAGE_MAX_BYTES = int(os.getenv('MENU_IMAGE_MAX_BYTES', str(10 * 1024 * 1024)))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CSRF_TRUSTED_ORIGINS = os.getenv('CSRF_TRUSTED_ORIGINS', '').split(',')
 
 AUTH_USER_MODEL = 'tabletapapp.CustomUser'
 
+# Backend delivering live order events to kitchen boards (see tabletapapp/events.py)
+ORDER_EVENTS_BACKEND = os.getenv('ORDER_EVENTS_BACKEND', 'tabletapapp.events.InMemoryOrderEvents')
+
+# Seconds a process reuses its own copy of a restaurant's menu before checking
+# the shared cache; also the longest other processes lag behind an edit
+TENANT_MENU_LOCAL_TTL = float(os.getenv('TENANT_MENU_LOCAL_TTL', '5'))
+# Restaurants whose menu a process keeps a copy of; the least recently used go first
+TENANT_MENU_LOCAL_SIZE = int(os.getenv('TENANT_MENU_LOCAL_SIZE', '1000'))
+# Seconds the shared cache remembers that a restaurant (or the site) has no active menu
+EMPTY_MENU_CACHE_TTL = int(os.getenv('EMPTY_MENU_CACHE_TTL', '300'))
+
+# How long a superseded menu version is kept for guests who still have it
+# open; gc_menu_versions deletes older ones unless a pending order uses them
+MENU_VERSION_GRACE_HOURS = float(os.getenv('MENU_VERSION_GRACE_HOURS', '24'))
+
+# How long browsers, proxies and CDNs may reuse a guest menu page without revalidating
+GUEST_MENU_MAX_AGE = int(os.getenv('GUEST_MENU_MAX_AGE', '60'))
+
+# Share of requests whose time and queries are measured (0 to 1), how often
+# one query shape must repeat in a request to be flagged as an N+1, and the
+# bearer token letting a Prometheus scraper read /tabletap/metrics/
+REQUEST_METRICS_SAMPLE_RATE = float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', '1'))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '5'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Tax applied on top of item prices when an order's total is computed
+ORDER_TAX_RATE = os.getenv('ORDER_TAX_RATE', '0.10')
+
 # OpenAI API Key
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+# Alternative endpoint for the completion API (e.g. a proxy or a local stub)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', '')
+
+# AI description generation (see tabletapapp/ai.py)
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', '4'))
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', '30'))
+AI_DESCRIPTION_CACHE_SIZE = int(os.getenv('AI_DESCRIPTION_CACHE_SIZE', '1000'))
+AI_DESCRIPTION_CACHE_TTL = int(os.getenv('AI_DESCRIPTION_CACHE_TTL', '86400'))
+AI_MAX_BATCH_SIZE = int(os.getenv('AI_MAX_BATCH_SIZE', '50'))
 
@@ -15,6 +15,8 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 from tabletapapp import views
@@ -28,3 +30,6 @@ urlpatterns = [
     path("tabletap/", include("tabletapapp.urls")),
     path('admin/', admin.site.urls),
 ]
+
+# Serve uploaded menu photos in development; use the web server in production
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
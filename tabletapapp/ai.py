@@ -0,0 +1,166 @@
+# tabletapapp/ai.py
+"""
+AI dish description generation.
+
+Completions run on a small thread pool with one shared OpenAI client, so
+its HTTP connection pool is reused across requests. Results are cached by
+normalized description with TTL/LRU eviction, and identical requests that
+arrive while a completion is in flight share that single upstream call.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+
+import openai
+
+MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "You are an expert in dish description"
+
+
+def normalize_description(description):
+    """Cache key for a description: case and whitespace do not matter."""
+    return ' '.join(description.split()).lower()
+
+
+class DescriptionCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class DescriptionGenerator:
+    """Cached, coalescing front end to the completion API."""
+
+    def __init__(self, max_workers, cache_size, cache_ttl):
+        self.cache = DescriptionCache(cache_size, cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-description')
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._client_lock = threading.Lock()
+        self._client = None
+        self.upstream_calls = 0
+
+    @property
+    def client(self):
+        # One client per generator; its httpx pool keeps connections alive.
+        # Pool threads ask for it concurrently, so it is built under a lock.
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = openai.OpenAI(
+                        api_key=settings.OPENAI_API_KEY,
+                        base_url=settings.OPENAI_BASE_URL or None,
+                        timeout=settings.AI_REQUEST_TIMEOUT,
+                        max_retries=1,
+                    )
+        return self._client
+
+    def submit(self, description):
+        """
+        Return a concurrent.futures.Future resolving to the generated text.
+
+        Served from the cache when possible; otherwise joins an identical
+        in-flight request or starts a new one on the pool.
+        """
+        key = normalize_description(description)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._generate, description)
+            self._inflight[key] = future
+        # Outside the lock: the callback runs at once if the call already finished
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._inflight.pop(key, None)
+        # Failures are not cached so the next click retries
+        if not future.cancelled() and future.exception() is None:
+            self.cache.set(key, future.result())
+
+    def _generate(self, description):
+        with self._lock:
+            self.upstream_calls += 1
+        response = self.client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": f"Please generate a concise description of the dish based on the following description:\n{description}"}
+            ],
+            temperature=0.7,
+            max_tokens=150
+        )
+        return response.choices[0].message.content.strip()
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_generator():
+    """The process-wide generator, created on first use."""
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = DescriptionGenerator(
+                    max_workers=settings.AI_MAX_CONCURRENCY,
+                    cache_size=settings.AI_DESCRIPTION_CACHE_SIZE,
+                    cache_ttl=settings.AI_DESCRIPTION_CACHE_TTL,
+                )
+    return _generator
+
+
+def reset_generator():
+    """Drop the process-wide generator (used when settings change, e.g. in tests)."""
+    global _generator
+    with _generator_lock:
+        if _generator is not None:
+            _generator.shutdown()
+        _generator = None
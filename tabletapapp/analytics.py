@@ -0,0 +1,180 @@
+# tabletapapp/analytics.py
+"""
+Sales analytics served from the DailySales rollup table.
+
+Each submitted order adds its lines to the rollup in the same transaction,
+and cancelling an order takes them out again, so the rollup always matches
+the committed orders. Dashboard queries only read rollup rows: one per
+(owner, day, table, item), however many orders that day had.
+rebuild_sales() recomputes the rollup from the orders themselves.
+"""
+import operator
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .exports import export_queryset
+from .models import DailySales, OrderItem
+
+SALES_GROUPINGS = ('day', 'table', 'item')
+
+# Days covered by the analytics API when no range is given
+DEFAULT_SALES_DAYS = 30
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def order_sales_deltas(order, lines):
+    """Rollup changes for a new order, from its (menu item, quantity) lines."""
+    day = timezone.localdate(order.created_at)
+    deltas = {}
+    for item, quantity in lines:
+        key = (order.table.user_id, day, order.table_id, item.id)
+        old_quantity, old_revenue = deltas.get(key, (0, Decimal('0')))
+        deltas[key] = (old_quantity + quantity, old_revenue + item.price * quantity)
+    return deltas
+
+
+def _line_aggregates(order_items):
+    """Sum OrderItem rows per rollup key in the database."""
+    return (
+        order_items
+        .filter(order__table__user__isnull=False)
+        .annotate(day=TruncDate('order__created_at'))
+        .values('order__table__user_id', 'day', 'order__table_id', 'item_id')
+        .annotate(
+            line_quantity=Sum('quantity'),
+            line_revenue=Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+        )
+        .order_by()
+    )
+
+
+def cancelled_sales_deltas(order_ids):
+    """Rollup changes that take the lines of the given orders back out."""
+    return {
+        (row['order__table__user_id'], row['day'], row['order__table_id'], row['item_id']):
+            (-row['line_quantity'], -row['line_revenue'])
+        for row in _line_aggregates(OrderItem.objects.filter(order_id__in=order_ids))
+    }
+
+
+def apply_sales_deltas(deltas):
+    """
+    Add {(user_id, date, table_id, item_id): (quantity, revenue)} to the rollup.
+
+    Missing rows are inserted empty (ignoring rows a concurrent order just
+    created), then every row is incremented with F() expressions in one
+    bulk UPDATE, so concurrent orders never overwrite each other's counts.
+    """
+    if not deltas:
+        return
+    DailySales.objects.bulk_create(
+        [DailySales(user_id=user_id, date=day, table_id=table_id, item_id=item_id)
+         for user_id, day, table_id, item_id in deltas],
+        ignore_conflicts=True,
+    )
+    rows = list(DailySales.objects.filter(reduce(operator.or_, (
+        Q(user_id=user_id, date=day, table_id=table_id, item_id=item_id)
+        for user_id, day, table_id, item_id in deltas
+    ))))
+    for row in rows:
+        quantity, revenue = deltas[(row.user_id, row.date, row.table_id, row.item_id)]
+        row.quantity = F('quantity') + quantity
+        row.revenue = F('revenue') + revenue
+    DailySales.objects.bulk_update(rows, ['quantity', 'revenue'])
+
+
+@transaction.atomic
+def rebuild_sales(start=None, end=None):
+    """
+    Recompute the rollup from the orders, for the given days or for all of them.
+
+    Returns the number of rollup rows written.
+    """
+    rollup = DailySales.objects.all()
+    order_items = OrderItem.objects.exclude(order__status='cancelled')
+    if start and end:
+        rollup = rollup.filter(date__range=(start, end))
+        order_items = order_items.filter(order__in=export_queryset(start, end))
+    rollup.delete()
+
+    written = 0
+    batch = []
+    for row in _line_aggregates(order_items).iterator(chunk_size=REBUILD_BATCH_SIZE):
+        batch.append(DailySales(
+            user_id=row['order__table__user_id'],
+            date=row['day'],
+            table_id=row['order__table_id'],
+            item_id=row['item_id'],
+            quantity=row['line_quantity'],
+            revenue=row['line_revenue'],
+        ))
+        if len(batch) == REBUILD_BATCH_SIZE:
+            DailySales.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    DailySales.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+def parse_sales_params(params):
+    """
+    Read the start/end (YYYY-MM-DD, inclusive) and group_by parameters.
+
+    The range defaults to the last DEFAULT_SALES_DAYS days. Returns
+    (start, end, group_by). Raises ValueError on malformed input.
+    """
+    end = timezone.localdate()
+    start = end - timedelta(days=DEFAULT_SALES_DAYS - 1)
+    dates = {'start': start, 'end': end}
+    for name in ('start', 'end'):
+        value = params.get(name, '')
+        if value:
+            parsed = parse_date(value)
+            if parsed is None:
+                raise ValueError(f"Invalid {name} '{value}', expected YYYY-MM-DD")
+            dates[name] = parsed
+    if dates['end'] < dates['start']:
+        raise ValueError("end must not be before start")
+
+    group_by = params.get('group_by') or 'day'
+    if group_by not in SALES_GROUPINGS:
+        raise ValueError(f"Unknown group_by '{group_by}', expected one of {', '.join(SALES_GROUPINGS)}")
+    return dates['start'], dates['end'], group_by
+
+
+def sales_summary(user, start, end, group_by='day'):
+    """Quantity and revenue of a restaurant per day, table or menu item, read from the rollup."""
+    rollup = DailySales.objects.filter(user=user, date__range=(start, end))
+    if group_by == 'day':
+        rows = rollup.values('date').order_by('date')
+    elif group_by == 'table':
+        rows = rollup.values('table_id', table_number=F('table__table_number')).order_by('table__table_number')
+    else:
+        rows = rollup.values('item_id', item_name=F('item__name')).order_by('item__name')
+    rows = rows.annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+
+    result = []
+    total_quantity, total_revenue = 0, Decimal('0')
+    for row in rows:
+        total_quantity += row['quantity']
+        total_revenue += row['revenue']
+        if 'date' in row:
+            row['date'] = row['date'].isoformat()
+        row['revenue'] = float(row['revenue'])
+        result.append(row)
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'group_by': group_by,
+        'rows': result,
+        'totals': {'quantity': total_quantity, 'revenue': float(total_revenue)},
+    }
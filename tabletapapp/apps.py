@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class TabletapappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tabletapapp'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .metrics import install_query_recorder
+
+        connection_created.connect(install_query_recorder, dispatch_uid='tabletap-request-metrics')
@@ -0,0 +1,348 @@
+# tabletapapp/benchmarks.py
+"""
+Data seeding and measurement helpers shared by the benchmark commands and tests.
+
+Everything here writes through bulk_create so that seeding tens of thousands
+of rows takes seconds, not minutes.
+
+The endpoint benchmark drives the guest and editor endpoints either
+in-process through the Django test client (which also counts queries) or
+over HTTP against a running server such as gunicorn, with a pool of
+concurrent clients. process_tree_rss reads a server's memory on Linux.
+"""
+import json
+import math
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .menu_cache import get_tenant_menu
+from .menus import editor_data, with_editor_data
+from .models import CustomUser, Menu, MenuCategory, MenuItem, Order, OrderItem, Table
+
+BATCH_SIZE = 1000
+
+
+def seed_menu(user, categories=4, items_per_category=8, name="Benchmark menu"):
+    """Create an active menu with categories and items for the given owner."""
+    menu = Menu.objects.create(user=user, name=name, active=True)
+    MenuCategory.objects.bulk_create([
+        MenuCategory(menu=menu, name=f"Category {c}", order=c, active=True)
+        for c in range(categories)
+    ])
+    category_list = list(MenuCategory.objects.filter(menu=menu).order_by('order'))
+    MenuItem.objects.bulk_create([
+        MenuItem(
+            category=category,
+            name=f"{category.name} item {i}",
+            description=f"Description of item {i}",
+            price=Decimal(5 + (i % 20)),
+            active=True,
+        )
+        for category in category_list
+        for i in range(items_per_category)
+    ], batch_size=BATCH_SIZE)
+    return menu
+
+
+def seed_order_history(count, user=None, tables=20, items_per_order=3, seed=0):
+    """
+    Add `count` orders (with line items) spread over `tables` tables.
+
+    Menu items are reused from the user's existing menus, a small menu is
+    created if there are none. Returns the owner the data was attached to.
+    """
+    rng = random.Random(seed)
+
+    if user is None:
+        user, _ = CustomUser.objects.get_or_create(
+            username='benchmark', defaults={'email': 'benchmark@example.com'}
+        )
+
+    menu_items = list(MenuItem.objects.filter(category__menu__user=user, active=True))
+    if not menu_items:
+        seed_menu(user)
+        menu_items = list(MenuItem.objects.filter(category__menu__user=user, active=True))
+
+    table_list = list(Table.objects.filter(user=user)[:tables])
+    if len(table_list) < tables:
+        existing = {t.table_number for t in table_list}
+        Table.objects.bulk_create([
+            Table(user=user, table_number=str(n), active=True)
+            for n in range(1, tables + 1)
+            if str(n) not in existing
+        ])
+        table_list = list(Table.objects.filter(user=user)[:tables])
+
+    statuses = ['pending', 'completed', 'completed', 'completed', 'cancelled']
+    for start in range(0, count, BATCH_SIZE):
+        size = min(BATCH_SIZE, count - start)
+        lines = [
+            [(rng.choice(menu_items), rng.randint(1, 4)) for _ in range(items_per_order)]
+            for _ in range(size)
+        ]
+        orders = []
+        for order_lines in lines:
+            table = rng.choice(table_list)
+            orders.append(Order(
+                table=table,
+                owner_id=table.user_id,
+                total_amount=sum(item.price * quantity for item, quantity in order_lines),
+                status=rng.choice(statuses),
+            ))
+        orders = Order.objects.bulk_create(orders)
+        # Backends without RETURNING (MySQL) leave pk unset on bulk_create
+        if orders and orders[0].pk is None:
+            orders = list(Order.objects.order_by('-id')[:size])[::-1]
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, item=item, quantity=quantity, price=item.price)
+            for order, order_lines in zip(orders, lines)
+            for item, quantity in order_lines
+        ], batch_size=BATCH_SIZE)
+
+    return user
+
+
+def count_queries(func, *args, **kwargs):
+    """Call func and return (result, number of SQL queries it executed)."""
+    with CaptureQueriesContext(connection) as ctx:
+        result = func(*args, **kwargs)
+    return result, len(ctx.captured_queries)
+
+
+# Endpoints driven by the benchmark, in the order they are reported
+ENDPOINTS = ('table_view', 'submit_order', 'get_order_details', 'get_menus', 'save_menu_data', 'order')
+
+TENANT_PREFIX = 'bench-tenant-'
+
+
+def seed_tenants(tenants, menus=2, categories=4, items_per_category=8, orders=1000, tables=20, seed=0):
+    """
+    Make sure `tenants` restaurants exist with menus, tables and order history.
+
+    Restaurants are named bench-tenant-<n> and reused when already seeded,
+    so a benchmark database can be seeded once and measured many times.
+    Each gets one active menu plus `menus - 1` inactive ones. Returns the
+    owners.
+    """
+    owners = []
+    for n in range(tenants):
+        user, _ = CustomUser.objects.get_or_create(
+            username=f'{TENANT_PREFIX}{n}', defaults={'email': f'{TENANT_PREFIX}{n}@example.com'}
+        )
+        existing_menus = Menu.objects.filter(user=user).count()
+        for index in range(existing_menus, menus):
+            menu = seed_menu(user, categories, items_per_category, name=f"Menu {index}")
+            if index > 0:
+                Menu.objects.filter(id=menu.id).update(active=False)
+        existing_orders = Order.objects.filter(table__user=user).count()
+        if existing_orders < orders:
+            seed_order_history(orders - existing_orders, user=user, tables=tables, seed=seed + n)
+        owners.append(user)
+    return owners
+
+
+def tenant_fixture(user):
+    """What the benchmark needs to build requests for one restaurant."""
+    menu = with_editor_data(Menu.objects.filter(user=user, active=True, archived=False)).first()
+    data = editor_data(menu)
+    return {
+        'user': user,
+        'menu_id': menu.id,
+        # Submitted with orders, as the guest page does
+        'menu_version_id': get_tenant_menu(user.id)['menu']['version_id'],
+        'menu_data': data,
+        'item_ids': [item['id'] for items in data.values() for item in items],
+        'tables': list(Table.objects.filter(user=user).order_by('id').values_list('table_number', flat=True)),
+        # Polled by guests waiting for their order
+        'order_ids': list(Order.objects.filter(table__user=user).order_by('-id').values_list('id', flat=True)[:50]),
+    }
+
+
+def endpoint_request(name, fixture, n):
+    """
+    Return (method, path, JSON body or None) for the n-th request to an endpoint.
+
+    Orders rotate over the tenant's tables and items; menu saves toggle one
+    price so that every save has something to write.
+    """
+    user = fixture['user']
+    table = fixture['tables'][n % len(fixture['tables'])]
+    if name == 'table_view':
+        return 'GET', reverse('restaurant_table_view', args=[user.id, table]), None
+    if name == 'submit_order':
+        item_ids = fixture['item_ids']
+        items = [{'id': item_ids[(n + offset) % len(item_ids)], 'quantity': 1 + offset} for offset in range(2)]
+        body = {'table': table, 'menu_version': fixture['menu_version_id'], 'items': items}
+        return 'POST', reverse('submit_order'), body
+    if name == 'get_order_details':
+        return 'GET', reverse('get_order_details', args=[fixture['order_ids'][n % len(fixture['order_ids'])]]), None
+    if name == 'get_menus':
+        return 'GET', reverse('menu_list'), None
+    if name == 'save_menu_data':
+        data = json.loads(json.dumps(fixture['menu_data']))
+        first = next(items for items in data.values() if items)[0]
+        first['price'] = round(first['price'] + (n % 2) * 0.5, 2)
+        return 'POST', reverse('save_menu_data', args=[fixture['menu_id']]), {'data': data}
+    if name == 'order':
+        return 'GET', reverse('order'), None
+    raise ValueError(f"Unknown endpoint '{name}'")
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, wall_time, errors=0, queries=None):
+    """Latency percentiles (ms), throughput and query counts of one endpoint's run."""
+    ordered = sorted(latencies)
+    summary = {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput_rps': round(len(ordered) / wall_time, 1) if wall_time else None,
+        'mean_ms': round(sum(ordered) / len(ordered), 2) if ordered else None,
+        'p50_ms': percentile(ordered, 0.50),
+        'p95_ms': percentile(ordered, 0.95),
+        'p99_ms': percentile(ordered, 0.99),
+        'max_ms': ordered[-1] if ordered else None,
+    }
+    for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+        if summary[key] is not None:
+            summary[key] = round(summary[key], 2)
+    if queries is not None:
+        summary['queries_mean'] = round(sum(queries) / len(queries), 2) if queries else None
+        summary['queries_max'] = max(queries, default=None)
+    return summary
+
+
+def run_in_process(name, fixtures, requests, warmup=0):
+    """
+    Drive one endpoint through the Django test client, one request at a time.
+
+    Requests rotate over the tenants, each with its own logged-in client.
+    Latencies include the client's request building but no network.
+    """
+    clients = []
+    for fixture in fixtures:
+        client = Client()
+        client.force_login(fixture['user'])
+        clients.append(client)
+
+    latencies, queries, errors = [], [], 0
+    started = None
+    for n in range(warmup + requests):
+        if n == warmup:
+            started = time.perf_counter()
+        fixture = fixtures[n % len(fixtures)]
+        method, path, body = endpoint_request(name, fixture, n)
+        client = clients[n % len(fixtures)]
+        with CaptureQueriesContext(connection) as ctx:
+            request_started = time.perf_counter()
+            if body is None:
+                response = client.generic(method, path)
+            else:
+                response = client.generic(method, path, json.dumps(body), content_type='application/json')
+            elapsed = (time.perf_counter() - request_started) * 1000
+        if n < warmup:
+            continue
+        latencies.append(elapsed)
+        queries.append(len(ctx.captured_queries))
+        errors += response.status_code >= 400
+    return summarize(latencies, time.perf_counter() - started, errors, queries)
+
+
+def session_cookies(fixtures):
+    """Session cookie value per tenant, stored in the session backend a server shares with us."""
+    cookies = []
+    for fixture in fixtures:
+        client = Client()
+        client.force_login(fixture['user'])
+        cookies.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+    return cookies
+
+
+def run_http(base_url, name, fixtures, requests, concurrency=10, warmup=0, timeout=30):
+    """
+    Drive one endpoint over HTTP with `concurrency` clients in parallel.
+
+    The server (gunicorn, runserver, uvicorn...) must use the same database
+    so that the seeded tenants and their sessions exist there.
+    """
+    cookies = session_cookies(fixtures)
+    base_url = base_url.rstrip('/')
+
+    def send(n):
+        fixture = fixtures[n % len(fixtures)]
+        method, path, body = endpoint_request(name, fixture, n)
+        headers = {
+            'Cookie': f"{settings.SESSION_COOKIE_NAME}={cookies[n % len(fixtures)]}",
+            'Accept': 'application/json',
+        }
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+        request_started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except OSError:
+            status = 599
+        return (time.perf_counter() - request_started) * 1000, status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(warmup)))
+        started = time.perf_counter()
+        results = list(pool.map(send, range(warmup, warmup + requests)))
+        wall_time = time.perf_counter() - started
+    return summarize(
+        [elapsed for elapsed, _ in results], wall_time,
+        errors=sum(1 for _, status in results if status >= 400),
+    )
+
+
+def _children(pid):
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return children
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants (Linux /proc)."""
+    total, pending = 0, [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+        pending += _children(pid)
+    return total
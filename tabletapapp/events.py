@@ -0,0 +1,124 @@
+# tabletapapp/events.py
+"""
+Order events pushed to connected kitchen boards.
+
+Views publish small, already-serialized order payloads; the streaming
+endpoint subscribes and forwards them as Server-Sent Events. Subscribers
+never query the database, so idle dashboards cost one queue each.
+
+The backend is pluggable through the ORDER_EVENTS_BACKEND setting (a dotted
+path to an OrderEventBackend subclass). The default in-process backend only
+reaches dashboards connected to the same process as the view that published
+the event; deployments with several processes need a backend built on a
+shared broker.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class OrderEventBackend:
+    """Interface for order event backends."""
+
+    def publish(self, event):
+        """Deliver an event (a JSON-serializable dict) to every subscriber."""
+        raise NotImplementedError
+
+    async def subscribe(self, heartbeat=15):
+        """
+        Async generator yielding events for one subscriber.
+
+        Yields None every `heartbeat` seconds without events so the caller can
+        keep the connection alive.
+        """
+        raise NotImplementedError
+        yield
+
+
+class InMemoryOrderEvents(OrderEventBackend):
+    """Fan-out to asyncio queues of subscribers living in this process."""
+
+    # Events kept for a slow subscriber before the oldest ones are dropped
+    max_queue_size = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def publish(self, event):
+        # publish() may run in a sync worker thread; each queue belongs to an
+        # event loop, so hand the event over to that loop.
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # The subscriber's loop has been closed
+                with self._lock:
+                    self._subscribers.discard((loop, queue))
+
+    @staticmethod
+    def _deliver(queue, event):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    async def subscribe(self, heartbeat=15):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=self.max_queue_size))
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The configured backend, created on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.ORDER_EVENTS_BACKEND)()
+    return _backend
+
+
+def order_event(event_type, order, total_items):
+    """Payload for one order, in the shape the kitchen board renders."""
+    return {
+        'type': event_type,
+        # The restaurant whose boards may see the event
+        'owner_id': order.table.user_id,
+        'order': {
+            'id': order.id,
+            'table_number': order.table.table_number,
+            'status': order.status,
+            'updated_at': order.updated_at.isoformat(),
+            'date': order.updated_at.strftime('%Y-%m-%d'),
+            'time': order.updated_at.strftime('%I:%M %p'),
+            'total_items': total_items,
+            'total_price': float(order.total_amount),
+        },
+    }
+
+
+def publish_on_commit(event):
+    """Publish once the current transaction commits, so boards never see rolled-back orders."""
+    transaction.on_commit(lambda: get_backend().publish(event))
@@ -0,0 +1,201 @@
+# tabletapapp/exports.py
+"""
+Streaming order exports for end-of-day reporting.
+
+Orders are read in fixed-size chunks walking the (created_at, id) index,
+each chunk with one prefetch query for its line items, so memory use stays
+flat however long the date range is. This is done by hand rather than with
+QuerySet.iterator() because the MySQL client library buffers a whole
+result set in memory.
+
+Under ASGI, Django collects a sync iterator into a list before sending the
+first byte, so ASGI responses stream aiter_export instead.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Prefetch, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order, OrderItem
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+CSV_COLUMNS = [
+    'record', 'date', 'order_id', 'created_at', 'table_number', 'status',
+    'item_id', 'item_name', 'quantity', 'price', 'subtotal', 'order_total', 'order_count',
+]
+
+
+def parse_export_params(params):
+    """
+    Read the start/end (YYYY-MM-DD, inclusive) and format parameters.
+
+    Returns (start, end, format). Raises ValueError with a readable message
+    on malformed input.
+    """
+    dates = []
+    for name in ('start', 'end'):
+        value = params.get(name) or ''
+        parsed = parse_date(value) if value else None
+        if parsed is None:
+            raise ValueError(f"Invalid or missing {name} '{value}', expected YYYY-MM-DD")
+        dates.append(parsed)
+    start, end = dates
+    if end < start:
+        raise ValueError("end must not be before start")
+
+    export_format = params.get('format') or 'csv'
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format '{export_format}', expected one of {', '.join(EXPORT_FORMATS)}")
+    return start, end, export_format
+
+
+def export_queryset(start, end, owner=None):
+    """
+    Orders created from the start of `start` up to the end of `end` (both
+    dates inclusive), limited to the orders of `owner` when given.
+    """
+    orders = Order.objects.filter(
+        created_at__gte=timezone.make_aware(datetime.combine(start, time.min)),
+        created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+    )
+    if owner is not None:
+        orders = orders.filter(owner=owner)
+    return orders
+
+
+def iter_orders(start, end, owner=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield orders in the range with their table and line items, oldest first."""
+    orders = (
+        export_queryset(start, end, owner)
+        .select_related('table')
+        .prefetch_related(
+            Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('item').order_by('id'))
+        )
+        .order_by('created_at', 'id')
+    )
+    position = None
+    while True:
+        chunk = orders
+        if position:
+            chunk = chunk.filter(
+                Q(created_at__gt=position[0]) | Q(created_at=position[0], id__gt=position[1])
+            )
+        chunk = list(chunk[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        position = (chunk[-1].created_at, chunk[-1].id)
+
+
+def daily_totals(start, end, owner=None):
+    """
+    Orders, items sold and revenue per day, aggregated in the database.
+
+    Cancelled orders are left out of the totals.
+    """
+    counted = export_queryset(start, end, owner).exclude(status='cancelled')
+    orders = (
+        counted
+        .annotate(day=TruncDate('created_at'))
+        .values('day')
+        .annotate(orders=Count('id'), revenue=Sum('total_amount'))
+        .order_by('day')
+    )
+    items = dict(
+        OrderItem.objects
+        .filter(order__in=counted)
+        .annotate(day=TruncDate('order__created_at'))
+        .values('day')
+        .annotate(items=Sum('quantity'))
+        .values_list('day', 'items')
+    )
+    return [
+        {'date': row['day'], 'orders': row['orders'], 'items': items.get(row['day'], 0), 'revenue': row['revenue']}
+        for row in orders
+    ]
+
+
+class _Echo:
+    """File-like object whose write() hands the row back, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(start, end, owner=None):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order in iter_orders(start, end, owner):
+        for line in order.orderitem_set.all():
+            yield writer.writerow([
+                'line', order.created_at.date().isoformat(), order.id, order.created_at.isoformat(),
+                order.table.table_number, order.status, line.item_id, line.item.name, line.quantity,
+                line.price, line.price * line.quantity, order.total_amount, '',
+            ])
+    for day in daily_totals(start, end, owner):
+        yield writer.writerow([
+            'day_total', day['date'].isoformat(), '', '', '', '', '', '', day['items'],
+            '', '', day['revenue'], day['orders'],
+        ])
+
+
+def iter_jsonl(start, end, owner=None):
+    for order in iter_orders(start, end, owner):
+        yield json.dumps({
+            'type': 'order',
+            'id': order.id,
+            'created_at': order.created_at.isoformat(),
+            'table_number': order.table.table_number,
+            'status': order.status,
+            'total_amount': str(order.total_amount),
+            'items': [
+                {
+                    'item_id': line.item_id,
+                    'item_name': line.item.name,
+                    'quantity': line.quantity,
+                    'price': str(line.price),
+                }
+                for line in order.orderitem_set.all()
+            ],
+        }) + '\n'
+    for day in daily_totals(start, end, owner):
+        yield json.dumps({
+            'type': 'day_total',
+            'date': day['date'].isoformat(),
+            'orders': day['orders'],
+            'items': day['items'],
+            'revenue': str(day['revenue']),
+        }) + '\n'
+
+
+def iter_export(start, end, export_format, owner=None):
+    """Lines of an export in the given format ('csv' or 'jsonl')."""
+    if export_format == 'csv':
+        return iter_csv(start, end, owner)
+    if export_format == 'jsonl':
+        return iter_jsonl(start, end, owner)
+    raise ValueError(f"Unknown export format '{export_format}'")
+
+
+async def aiter_export(start, end, export_format, owner=None, batch_size=EXPORT_CHUNK_SIZE):
+    """
+    iter_export for ASGI responses: lines are produced in batches of
+    batch_size on a worker thread, one sync_to_async call per batch, and
+    each batch is sent as one piece.
+    """
+    lines = iter_export(start, end, export_format, owner)
+    next_batch = sync_to_async(lambda: list(islice(lines, batch_size)))
+    while True:
+        batch = await next_batch()
+        if batch:
+            yield ''.join(batch)
+        if len(batch) < batch_size:
+            return
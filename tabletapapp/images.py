@@ -0,0 +1,197 @@
+# tabletapapp/images.py
+"""
+Menu photo storage and resized variants.
+
+Uploaded photos are stored once per content hash, so re-uploading the same
+picture reuses the stored file. After the upload commits, a small thread
+pool renders WebP and JPEG copies at the widths in IMAGE_VARIANT_WIDTHS;
+the guest page offers them through srcset and phones download the smallest
+one that fills the slot instead of the original.
+"""
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db import IntegrityError, close_old_connections, transaction
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Menu, MenuImage, MenuItem
+
+ORIGINALS_DIR = 'menu_images/originals'
+VARIANTS_DIR = 'menu_images/variants'
+
+# Format name in MenuImage.variants -> (Pillow format, file extension, save options)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Rendered width of a menu item photo in the guest page's grid
+IMAGE_SIZES = "(min-width: 992px) 33vw, (min-width: 768px) 50vw, 100vw"
+
+_PILLOW_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# Room for the multipart boundaries and headers around an upload's file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadSizeLimitHandler(FileUploadHandler):
+    """
+    First upload handler of a request: stops reading the body as soon as
+    a file grows past max_bytes, so an oversized upload (even one sent
+    without a Content-Length) is never spooled to disk. Check `exceeded`.
+    """
+
+    def __init__(self, max_bytes, request=None):
+        super().__init__(request)
+        self.max_bytes = max_bytes
+        self.exceeded = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_bytes:
+            self.exceeded = True
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def store_image(file):
+    """
+    Return the MenuImage for a file's content, storing the file only if it is new.
+
+    `file` is a Django File (an upload, a ContentFile, a storage file). It
+    is read in chunks, so large uploads spooled to disk are never loaded
+    into memory at once. Raises ValueError if it is not an image Pillow can
+    read. Variants of a new image are scheduled once the transaction commits.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in file.chunks():
+        sha256.update(chunk)
+        size += len(chunk)
+    sha256 = sha256.hexdigest()
+
+    existing = MenuImage.objects.filter(sha256=sha256).first()
+    if existing:
+        return existing
+
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            image.verify()
+        file.seek(0)
+        with Image.open(file) as image:
+            pillow_format = image.format
+            width, height = ImageOps.exif_transpose(image).size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError):
+        raise ValueError("Uploaded file is not a valid image")
+
+    name = f"{ORIGINALS_DIR}/{sha256}.{_PILLOW_EXTENSIONS.get(pillow_format, 'img')}"
+    if not default_storage.exists(name):
+        file.seek(0)
+        name = default_storage.save(name, file)
+
+    try:
+        with transaction.atomic():
+            image = MenuImage.objects.create(
+                sha256=sha256, original=name, width=width, height=height, size=size
+            )
+    except IntegrityError:
+        # Another request stored the same photo first
+        return MenuImage.objects.get(sha256=sha256)
+
+    transaction.on_commit(lambda: schedule_variants(image.id))
+    return image
+
+
+def render_variants(image):
+    """Write the resized copies of a MenuImage and record them on the row."""
+    with default_storage.open(image.original.name, 'rb') as original:
+        source = ImageOps.exif_transpose(Image.open(original))
+        source.load()
+
+    widths = sorted({min(width, source.width) for width in settings.IMAGE_VARIANT_WIDTHS})
+    variants = {name: {} for name in VARIANT_FORMATS}
+    for width in widths:
+        height = round(source.height * width / source.width)
+        resized = source.resize((width, height), Image.Resampling.LANCZOS) if width != source.width else source
+        for name, (pillow_format, extension, options) in VARIANT_FORMATS.items():
+            frame = resized
+            if pillow_format == 'JPEG' and frame.mode != 'RGB':
+                frame = frame.convert('RGB')
+            buffer = io.BytesIO()
+            frame.save(buffer, pillow_format, **options)
+            path = f"{VARIANTS_DIR}/{image.sha256}-{width}.{extension}"
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            variants[name][str(width)] = {
+                'path': default_storage.save(path, ContentFile(buffer.getvalue())),
+                'size': buffer.tell(),
+            }
+
+    MenuImage.objects.filter(id=image.id).update(variants=variants)
+    image.variants = variants
+    return variants
+
+
+def generate_variants(image_id):
+    """Render the variants of one image, then refresh the guest menu that shows it."""
+    from .menu_cache import publish_menu_on_commit
+
+    # Pool threads outlive requests, so manage their connections by hand
+    close_old_connections()
+    try:
+        image = MenuImage.objects.filter(id=image_id).first()
+        if image is None or image.variants:
+            return
+        render_variants(image)
+        publish_menu_on_commit(menus_showing(image))
+    finally:
+        close_old_connections()
+
+
+def menus_showing(image):
+    """Menus with an item using this image, whose pages change when its variants do."""
+    return Menu.objects.filter(id__in=MenuItem.objects.filter(menu_image=image).values('category__menu_id'))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def schedule_variants(image_id):
+    """Queue variant rendering on the worker pool, off the request thread."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_WORKERS, thread_name_prefix='menu-image'
+                )
+    return _executor.submit(generate_variants, image_id)
+
+
+def image_sources(image):
+    """
+    Return (src, {'webp': srcset, 'jpeg': srcset}) for a MenuImage.
+
+    Until the variants exist, src is the original and there is no srcset.
+    """
+    if not image.variants:
+        return image.original.url, {}
+    srcsets = {}
+    for name, variants in image.variants.items():
+        srcsets[name] = ', '.join(
+            f"{default_storage.url(variant['path'])} {width}w"
+            for width, variant in sorted(variants.items(), key=lambda pair: int(pair[0]))
+        )
+    smallest = min(image.variants['jpeg'], key=int)
+    return default_storage.url(image.variants['jpeg'][smallest]['path']), srcsets
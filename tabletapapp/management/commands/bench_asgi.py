@@ -0,0 +1,155 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tabletapapp.benchmarks import ENDPOINTS, process_tree_rss, run_http, seed_tenants, tenant_fixture
+
+GUEST_ENDPOINTS = ('table_view', 'get_order_details', 'submit_order')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class MemorySampler(threading.Thread):
+    """Track the peak resident memory of a server's process tree while a run lasts."""
+
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the app under gunicorn twice, once as WSGI with threaded workers "
+        "and once as ASGI with uvicorn workers, and drive the guest endpoints "
+        "at increasing concurrency. Reports req/s, latency and the server's "
+        "memory per concurrent connection (Linux only). Seeded data is kept, so "
+        "use a benchmark database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Worker processes of both servers (default: 2)")
+        parser.add_argument('--threads', type=int, default=8, help="Threads per WSGI worker (default: 8)")
+        parser.add_argument(
+            '--concurrency', default='10,50,200',
+            help="Comma-separated numbers of parallel clients (default: 10,50,200)",
+        )
+        parser.add_argument('--requests', type=int, default=1000, help="Measured requests per run (default: 1000)")
+        parser.add_argument('--warmup', type=int, default=50, help="Unmeasured requests per run first (default: 50)")
+        parser.add_argument(
+            '--endpoints', default=','.join(GUEST_ENDPOINTS),
+            help=f"Comma-separated endpoints to drive (default: {','.join(GUEST_ENDPOINTS)})",
+        )
+        parser.add_argument('--tenants', type=int, default=5, help="Restaurants to seed and rotate over (default: 5)")
+        parser.add_argument('--only', choices=['wsgi', 'asgi'], help="Benchmark one of the two servers")
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/status'):
+            raise CommandError("Memory is read from /proc, so this command needs Linux")
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma-separated list of integers")
+        if min(levels) < 1 or options['workers'] < 1 or options['threads'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency, --workers, --threads and --requests must be at least 1")
+
+        owners = seed_tenants(options['tenants'], orders=200)
+        fixtures = [tenant_fixture(owner) for owner in owners]
+
+        servers = [
+            ('wsgi', f"gunicorn gthread, {options['workers']}x{options['threads']} threads", [
+                '-m', 'gunicorn', 'tabletap.wsgi:application',
+                '--worker-class', 'gthread', '--threads', str(options['threads']),
+            ]),
+            ('asgi', f"gunicorn uvicorn, {options['workers']} workers", [
+                '-m', 'gunicorn', 'tabletap.asgi:application', '--worker-class', 'uvicorn_worker.UvicornWorker',
+            ]),
+        ]
+        self.stdout.write(
+            f"{'server':<30} {'endpoint':<18} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'errors':>7} {'idle MB':>8} {'peak MB':>8} {'KB/conn':>8}"
+        )
+        for name, title, command in servers:
+            if options['only'] and options['only'] != name:
+                continue
+            port = _free_port()
+            process = self._start(name, command + [
+                '--workers', str(options['workers']), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+            ], port)
+            try:
+                base_url = f'http://127.0.0.1:{port}'
+                for endpoint in endpoints:
+                    for level in levels:
+                        # Warm up first so that idle memory includes imports, caches and connections
+                        run_http(base_url, endpoint, fixtures, options['warmup'], concurrency=level)
+                        idle = process_tree_rss(process.pid)
+                        sampler = MemorySampler(process.pid)
+                        sampler.start()
+                        try:
+                            stats = run_http(base_url, endpoint, fixtures, options['requests'], concurrency=level)
+                        finally:
+                            peak = max(sampler.stop(), idle)
+                        self.stdout.write(
+                            f"{title:<30} {endpoint:<18} {level:>7} {stats['throughput_rps']:>8} "
+                            f"{stats['p50_ms']:>8} {stats['p99_ms']:>8} {stats['errors']:>7} "
+                            f"{idle / 2**20:>8.1f} {peak / 2**20:>8.1f} {(peak - idle) / 1024 / level:>8.1f}"
+                        )
+            finally:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    @staticmethod
+    def _start(name, args, port, timeout=30):
+        """Start a server on the same settings and database as this command and wait until it answers."""
+        env = dict(os.environ)
+        env['DJANGO_SETTINGS_MODULE'] = settings.SETTINGS_MODULE
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+        if name == 'asgi' and not settings.DATABASES['default'].get('POOL_OPTIONS'):
+            # Persistent connections are not reused under ASGI (see tabletap/asgi.py)
+            env['DB_CONN_MAX_AGE'] = '0'
+        process = subprocess.Popen([sys.executable] + args, env=env, cwd=settings.BASE_DIR)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"The {name} server exited with status {process.returncode}")
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).close()
+                return process
+            except urllib.error.HTTPError:
+                return process
+            except OSError:
+                time.sleep(0.2)
+        process.kill()
+        raise CommandError(f"The {name} server did not answer within {timeout}s")
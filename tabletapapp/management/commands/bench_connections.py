@@ -0,0 +1,116 @@
+import threading
+import time
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+
+from tabletapapp.benchmarks import percentile, seed_tenants, tenant_fixture
+from tabletapapp.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate concurrent guests, each a thread making requests through the "
+        "WSGI handler as a threaded server would, once opening a database "
+        "connection per request and once with persistent, health-checked "
+        "connections. Reports connections opened, latency and throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--guests', type=int, default=200, help="Concurrent guests (default: 200)")
+        parser.add_argument('--requests', type=int, default=10, help="Requests per guest (default: 10)")
+        parser.add_argument(
+            '--max-age', type=int, default=None,
+            help="CONN_MAX_AGE of the persistent pass (default: the configured value, or 60 if that is 0)",
+        )
+
+    def handle(self, *args, **options):
+        if options['guests'] < 1 or options['requests'] < 1:
+            raise CommandError("--guests and --requests must be at least 1")
+        if settings.DATABASES['default'].get('POOL_OPTIONS'):
+            self.stdout.write(self.style.WARNING("DB_POOL is on: connections come from the pool in both passes"))
+
+        owner = seed_tenants(1, orders=200)[0]
+        fixture = tenant_fixture(owner)
+        order_ids = list(Order.objects.filter(table__user=owner).order_by('-id').values_list('id', flat=True)[:50])
+        # The guest page loop: poll an order's status between (cached) menu views
+        paths = [reverse('restaurant_table_view', args=[owner.id, table]) for table in fixture['tables']]
+        paths += [reverse('get_order_details', args=[order_id]) for order_id in order_ids]
+
+        db = settings.DATABASES['default']
+        configured = (db['CONN_MAX_AGE'], db['CONN_HEALTH_CHECKS'])
+        max_age = options['max_age'] if options['max_age'] is not None else (configured[0] or 60)
+        self.stdout.write(
+            f"{connection.vendor}, {options['guests']} guests x {options['requests']} requests\n"
+            f"{'connections':<28} {'opened':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+        )
+        connections.close_all()
+        try:
+            for label, conn_max_age, health_checks in (
+                ('new per request', 0, False),
+                (f'persistent ({max_age}s, checked)', max_age, True),
+            ):
+                db['CONN_MAX_AGE'], db['CONN_HEALTH_CHECKS'] = conn_max_age, health_checks
+                opened, latencies, wall_time, errors = self._run(paths, options['guests'], options['requests'])
+                self.stdout.write(
+                    f"{label:<28} {opened:>7} {len(latencies) / wall_time:>8.1f} "
+                    f"{percentile(latencies, 0.50):>8.2f} {percentile(latencies, 0.95):>8.2f} "
+                    f"{percentile(latencies, 0.99):>8.2f} {errors:>7}"
+                )
+        finally:
+            db['CONN_MAX_AGE'], db['CONN_HEALTH_CHECKS'] = configured
+
+    @staticmethod
+    def _run(paths, guests, requests):
+        """Run every guest on its own thread; returns (connections opened, sorted latencies ms, seconds, errors)."""
+        handler = WSGIHandler()
+        lock = threading.Lock()
+        opened = [0]
+        latencies, errors = [], [0]
+        start = threading.Barrier(guests + 1)
+
+        def count_connection(sender, **kwargs):
+            with lock:
+                opened[0] += 1
+
+        def guest(number):
+            own = []
+            failed = 0
+            start.wait()
+            try:
+                for n in range(requests):
+                    environ = {'PATH_INFO': paths[(number * requests + n) % len(paths)], 'wsgi.input': BytesIO()}
+                    setup_testing_defaults(environ)
+                    statuses = []
+                    started = time.perf_counter()
+                    response = handler(environ, lambda status, headers: statuses.append(status))
+                    b''.join(response)
+                    # Sends request_finished, which closes or keeps the connection like a server does
+                    response.close()
+                    own.append((time.perf_counter() - started) * 1000)
+                    failed += not statuses[0].startswith(('2', '3'))
+            finally:
+                connections.close_all()
+            with lock:
+                latencies.extend(own)
+                errors[0] += failed
+
+        connection_created.connect(count_connection)
+        try:
+            threads = [threading.Thread(target=guest, args=(number,)) for number in range(guests)]
+            for thread in threads:
+                thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            wall_time = time.perf_counter() - started
+        finally:
+            connection_created.disconnect(count_connection)
+        return opened[0], sorted(latencies), wall_time, errors[0]
@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from tabletapapp.benchmarks import ENDPOINTS, run_http, run_in_process, seed_tenants, tenant_fixture
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed benchmark restaurants and measure the guest and editor endpoints: "
+        "p50/p95/p99 latency, throughput and queries per request, in-process and, "
+        "with --url, over HTTP against a running server. Seeded data is kept, so "
+        "point this at a benchmark database (DB_ENGINE/DB_NAME), not production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=5, help="Restaurants to seed and rotate over (default: 5)")
+        parser.add_argument('--menus', type=int, default=2, help="Menus per restaurant, one active (default: 2)")
+        parser.add_argument('--categories', type=int, default=6, help="Categories per menu (default: 6)")
+        parser.add_argument('--items', type=int, default=10, help="Items per category (default: 10)")
+        parser.add_argument('--orders', type=int, default=2000, help="Historical orders per restaurant (default: 2000)")
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per endpoint (default: 200)")
+        parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per endpoint first (default: 10)")
+        parser.add_argument(
+            '--endpoints', default=','.join(ENDPOINTS),
+            help=f"Comma-separated endpoints to drive (default: {','.join(ENDPOINTS)})",
+        )
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000, to also drive over HTTP")
+        parser.add_argument('--concurrency', type=int, default=20, help="Parallel HTTP clients (default: 20)")
+        parser.add_argument('--label', help="Name of this run in the results (default: current git commit)")
+        parser.add_argument('--output', help="JSON file to write the results to (default: bench-<label>.json)")
+        parser.add_argument('--compare', help="Earlier results file to compare this run against")
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+        if options['tenants'] < 1 or options['requests'] < 1:
+            raise CommandError("--tenants and --requests must be at least 1")
+
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        started = time.perf_counter()
+        owners = seed_tenants(
+            options['tenants'], menus=options['menus'], categories=options['categories'],
+            items_per_category=options['items'], orders=options['orders'],
+        )
+        fixtures = [tenant_fixture(owner) for owner in owners]
+        self.stdout.write(f"Seeded {len(owners)} restaurants in {time.perf_counter() - started:.1f}s")
+
+        commit = _git_commit()
+        label = options['label'] or commit or time.strftime('%Y%m%d-%H%M%S')
+        results = {
+            'label': label,
+            'commit': commit,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'database': connection.vendor,
+            'config': {
+                key: options[key]
+                for key in ('tenants', 'menus', 'categories', 'items', 'orders', 'requests', 'warmup', 'concurrency', 'url')
+            },
+            'in_process': {},
+            'http': {},
+        }
+
+        for name in endpoints:
+            results['in_process'][name] = run_in_process(name, fixtures, options['requests'], options['warmup'])
+        self._report('in-process', results['in_process'], previous and previous.get('in_process'))
+
+        if options['url']:
+            for name in endpoints:
+                results['http'][name] = run_http(
+                    options['url'], name, fixtures, options['requests'],
+                    concurrency=options['concurrency'], warmup=options['warmup'],
+                )
+            self._report(
+                f"HTTP, {options['concurrency']} clients", results['http'], previous and previous.get('http')
+            )
+
+        output = options['output'] or f"bench-{label}.json"
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {os.path.abspath(output)}"))
+
+    def _report(self, title, endpoints, previous=None):
+        self.stdout.write(f"\n{title}")
+        self.stdout.write(
+            f"{'endpoint':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>7}"
+        )
+        for name, stats in endpoints.items():
+            queries = stats.get('queries_mean')
+            line = (
+                f"{name:<18} {stats['throughput_rps']:>8} {stats['p50_ms']:>8} {stats['p95_ms']:>8} "
+                f"{stats['p99_ms']:>8} {'-' if queries is None else queries:>8} {stats['errors']:>7}"
+            )
+            before = (previous or {}).get(name)
+            if before and before.get('p95_ms'):
+                change = 100 * (stats['p95_ms'] / before['p95_ms'] - 1)
+                line += f"   p95 {change:+.0f}% vs {before['p95_ms']}"
+            self.stdout.write(line)
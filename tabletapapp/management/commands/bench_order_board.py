@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from tabletapapp.benchmarks import count_queries, seed_order_history
+from tabletapapp.orders import decode_cursor, get_order_page, serialize_board_order
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a growing order history and show that the kitchen board's query "
+        "count stays flat. All seeded data is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000,50000',
+            help="Comma-separated history sizes to measure at (default: 1000,10000,50000)",
+        )
+        parser.add_argument('--pages', type=int, default=3, help="Pages to walk at each size")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError("--sizes must be a comma-separated list of integers")
+
+        try:
+            with transaction.atomic():
+                self._run(sizes, options['pages'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _run(self, sizes, pages):
+        self.stdout.write(f"{'orders':>8} {'page':>5} {'queries':>8} {'ms':>9}")
+        seeded = 0
+        user = None
+        for size in sizes:
+            user = seed_order_history(size - seeded, user=user)
+            seeded = size
+
+            before = None
+            for page in range(1, pages + 1):
+                started = time.perf_counter()
+                (orders, next_cursor), queries = count_queries(self._render_page, before)
+                elapsed = (time.perf_counter() - started) * 1000
+                self.stdout.write(f"{size:>8} {page:>5} {queries:>8} {elapsed:>9.1f}")
+                if not next_cursor:
+                    break
+                before = decode_cursor(next_cursor)
+
+    @staticmethod
+    def _render_page(before):
+        orders, next_cursor = get_order_page(before=before)
+        # Serialize as the view does so lazy lookups would show up in the count
+        [serialize_board_order(order) for order in orders]
+        return orders, next_cursor
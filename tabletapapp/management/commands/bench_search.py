@@ -0,0 +1,84 @@
+import itertools
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from tabletapapp.benchmarks import BATCH_SIZE
+from tabletapapp.models import CustomUser, Menu, MenuCategory, MenuItem
+from tabletapapp.search import search_items, search_terms
+
+# 1728 made-up words, so that any one word is on roughly 0.2% of the items
+SYLLABLES = ('ba', 'ko', 'ri', 'ten', 'sa', 'mu', 'lo', 'pe', 'zi', 'da', 'ni', 'chu')
+WORDS = [''.join(parts) for parts in itertools.product(SYLLABLES, repeat=3)]
+ITEMS_PER_CATEGORY = 500
+
+
+def seed_items(user, count, seed=0):
+    """Add `count` items with three-word names and descriptions, in menus of 50 categories."""
+    rng = random.Random(seed)
+    for start in range(0, count, ITEMS_PER_CATEGORY * 50):
+        menu = Menu.objects.create(user=user, name=f"Search menu {start}", active=False)
+        size = min(ITEMS_PER_CATEGORY * 50, count - start)
+        MenuCategory.objects.bulk_create([
+            MenuCategory(menu=menu, name=' '.join(rng.sample(WORDS, 2)).title(), order=order)
+            for order in range((size + ITEMS_PER_CATEGORY - 1) // ITEMS_PER_CATEGORY)
+        ])
+        categories = list(MenuCategory.objects.filter(menu=menu).order_by('order'))
+        MenuItem.objects.bulk_create([
+            MenuItem(
+                category=categories[index // ITEMS_PER_CATEGORY],
+                name=' '.join(rng.sample(WORDS, 2)).capitalize(),
+                description=' '.join(rng.sample(WORDS, 3)),
+                price=Decimal(rng.randint(4, 40)),
+            )
+            for index in range(size)
+        ], batch_size=BATCH_SIZE)
+
+
+class Command(BaseCommand):
+    help = (
+        "Grow the menu items to --items (kept for later runs) and time item "
+        "searches through the full-text index against icontains lookups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=200000, help="Menu items to search over (default: 200000)")
+        parser.add_argument(
+            '--queries', default='bakori,bako,bakori tensa,mupe,zzz',
+            help="Comma-separated queries to time (default: 'bakori,bako,bakori tensa,mupe,zzz')",
+        )
+        parser.add_argument('--repeat', type=int, default=20, help="Runs per query (default: 20)")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+        missing = options['items'] - MenuItem.objects.count()
+        if missing > 0:
+            user, _ = CustomUser.objects.get_or_create(
+                username='bench-search', defaults={'email': 'bench-search@example.com'}
+            )
+            started = time.perf_counter()
+            seed_items(user, missing)
+            self.stdout.write(f"Seeded {missing} items in {time.perf_counter() - started:.1f}s")
+
+        self.stdout.write(f"{connection.vendor}, {MenuItem.objects.count()} items")
+        self.stdout.write(f"{'query':<20} {'results':>8} {'full-text ms':>13} {'icontains ms':>13}")
+        for query in options['queries'].split(','):
+            terms = search_terms(query)
+            if not terms:
+                continue
+            timings = {}
+            for full_text in (True, False):
+                best = None
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    results = search_items(terms, active='all', full_text=full_text)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[full_text] = (best, len(results))
+            self.stdout.write(
+                f"{query:<20} {timings[True][1]:>8} {timings[True][0]:>13.2f} {timings[False][0]:>13.2f}"
+            )
@@ -0,0 +1,96 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from tabletapapp.models import Menu, MenuCategory, MenuItem, Table
+from tabletapapp.orders import CHANGES_PAGE_SIZE, ORDER_PAGE_SIZE, changed_orders_queryset, order_page_queryset
+
+
+def hot_queries():
+    """The lookups on the guest, editor and kitchen paths, as (name, queryset) pairs."""
+    menu = Menu.objects.order_by('id').first()
+    category = MenuCategory.objects.order_by('id').first()
+    table = Table.objects.order_by('id').first()
+    menu_id = menu.id if menu else 0
+    user_id = menu.user_id if menu else 0
+    category_id = category.id if category else 0
+    table_number = table.table_number if table else '1'
+
+    return [
+        ('active menu of a restaurant',
+         Menu.objects.filter(user_id=user_id, active=True, archived=False).order_by('-updated_at')[:1]),
+        ('menus of a user', Menu.objects.filter(user_id=user_id, archived=False).order_by('-updated_at')),
+        ('active categories of a menu', MenuCategory.objects.filter(menu_id=menu_id, active=True).order_by('order')),
+        ('active items of a category', MenuItem.objects.filter(category_id=category_id, active=True)),
+        # As the views run them for a restaurant; superusers see the unscoped ones
+        ('kitchen board page', order_page_queryset(owner=user_id)[:ORDER_PAGE_SIZE + 1]),
+        ('kitchen board page by status',
+         order_page_queryset(status='pending', owner=user_id)[:ORDER_PAGE_SIZE + 1]),
+        ('kitchen board older page',
+         order_page_queryset(before=(timezone.now(), 0), owner=user_id)[:ORDER_PAGE_SIZE + 1]),
+        ('kitchen board page of every restaurant', order_page_queryset()[:ORDER_PAGE_SIZE + 1]),
+        ('order changes',
+         changed_orders_queryset(since=(timezone.now(), 0), owner=user_id)[:CHANGES_PAGE_SIZE + 1]),
+        ('table by number', Table.objects.filter(user_id=user_id, table_number=table_number)),
+    ]
+
+
+def _mysql_full_scans(plan):
+    found = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get('access_type') == 'ALL':
+                found.append(node.get('table_name', '?'))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(json.loads(plan))
+    return found
+
+
+def full_scans(queryset):
+    """Return (plan text, tables read with a full scan) for a queryset on the current backend."""
+    vendor = connection.vendor
+    if vendor == 'mysql':
+        plan = queryset.explain(format='json')
+        return plan, _mysql_full_scans(plan)
+
+    plan = queryset.explain()
+    if vendor == 'sqlite':
+        # "SCAN t" is a table scan; "SCAN t USING INDEX i" walks an index.
+        # Django renders boolean filters as bare column tests on SQLite, which
+        # it cannot match to an index, so boolean-only lookups show up here
+        # even though MySQL (active = 1) uses the composite index.
+        return plan, re.findall(r'\bSCAN (\w+)\s*$', plan, re.MULTILINE)
+    if vendor == 'postgresql':
+        return plan, re.findall(r'Seq Scan on (\w+)', plan)
+    raise CommandError(f"Query plan checks are not supported on {vendor}")
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot lookup queries and fail if any of them reads a whole table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help="Print the full plan of every query")
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, queryset in hot_queries():
+            plan, scans = full_scans(queryset)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {name}: {', '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok         {name}"))
+            if options['verbose_plans'] or scans:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot quer{'y' if len(failures) == 1 else 'ies'} fell back to a full scan")
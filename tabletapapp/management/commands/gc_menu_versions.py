@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tabletapapp.menu_cache import collect_menu_versions
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete published menu versions superseded longer ago than the grace "
+        "period, keeping each menu's newest version and any version a pending "
+        "order refers to. Safe to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float, default=settings.MENU_VERSION_GRACE_HOURS,
+            help=f"Grace period in hours (default: MENU_VERSION_GRACE_HOURS, {settings.MENU_VERSION_GRACE_HOURS:g})",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Only count the versions that would be deleted")
+
+    def handle(self, *args, **options):
+        if options['hours'] < 0:
+            raise CommandError("--hours cannot be negative")
+        count = collect_menu_versions(timedelta(hours=options['hours']), dry_run=options['dry_run'])
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {count} menu versions"))
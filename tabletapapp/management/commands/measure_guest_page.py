@@ -0,0 +1,77 @@
+from asgiref.sync import async_to_sync
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from tabletapapp import views
+from tabletapapp.menu_cache import get_active_menu
+from tabletapapp.models import MenuItem
+
+# Share of the viewport taken by one photo, per Bootstrap breakpoint of the
+# grid in table_view.html (mirrors images.IMAGE_SIZES)
+SLOT_WIDTHS = ((992, 1 / 3), (768, 1 / 2), (0, 1))
+
+
+def _size(name):
+    try:
+        return default_storage.size(name)
+    except (OSError, NotImplementedError):
+        return 0
+
+
+def pick_variant(variants, needed_width):
+    """The candidate a browser takes from a srcset: the smallest that is wide enough."""
+    widths = sorted(int(width) for width in variants)
+    chosen = next((width for width in widths if width >= needed_width), widths[-1])
+    return variants[str(chosen)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the bytes a guest downloads for the menu page: HTML plus one "
+        "photo per item, as originals versus the srcset variant a phone picks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', default='1', help="Table number to render the page for")
+        parser.add_argument('--viewport', type=int, default=390, help="Viewport width in CSS pixels (default: 390)")
+        parser.add_argument('--dpr', type=float, default=3, help="Device pixel ratio (default: 3)")
+
+    def handle(self, *args, **options):
+        menu = get_active_menu()
+        if menu is None:
+            raise CommandError("No active menu")
+
+        request = RequestFactory().get(f"/tabletap/table/{options['table']}/")
+        response = async_to_sync(views.table_view)(request, options['table'])
+        html = len(response.content)
+        if response.status_code != 200:
+            raise CommandError(f"Guest page answered {response.status_code}")
+        if b'srcset=' not in response.content:
+            self.stdout.write(self.style.WARNING("The page has no srcset yet; run render_menu_images"))
+
+        slot = next(share for breakpoint, share in SLOT_WIDTHS if options['viewport'] >= breakpoint)
+        needed = options['viewport'] * slot * options['dpr']
+
+        before = after_webp = after_jpeg = photos = 0
+        items = MenuItem.objects.filter(
+            category__menu=menu, category__active=True, active=True
+        ).exclude(image='').exclude(image__isnull=True).select_related('menu_image')
+        for item in items:
+            photos += 1
+            original = item.menu_image.size if item.menu_image else _size(item.image.name)
+            before += original
+            variants = item.menu_image.variants if item.menu_image else {}
+            after_webp += pick_variant(variants['webp'], needed)['size'] if variants else original
+            after_jpeg += pick_variant(variants['jpeg'], needed)['size'] if variants else original
+
+        self.stdout.write(f"Viewport {options['viewport']}px at {options['dpr']}x, photos rendered {needed:.0f}px wide")
+        self.stdout.write(f"HTML:                         {html:>12,} bytes")
+        self.stdout.write(f"{photos} photos, originals:        {before:>12,} bytes")
+        self.stdout.write(f"{photos} photos, srcset (WebP):    {after_webp:>12,} bytes")
+        self.stdout.write(f"{photos} photos, srcset (JPEG):    {after_jpeg:>12,} bytes")
+        total_before, total_after = html + before, html + after_webp
+        saved = 100 * (1 - total_after / total_before) if total_before else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Guest page: {total_before:,} -> {total_after:,} bytes ({saved:.0f}% less)"
+        ))
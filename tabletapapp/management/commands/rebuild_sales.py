@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from tabletapapp.analytics import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily sales rollup from the orders, for a date range or "
+        "for the whole history. Run after importing orders or to repair drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild, YYYY-MM-DD")
+        parser.add_argument('--end', help="Last day to rebuild (inclusive), YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        if bool(options['start']) != bool(options['end']):
+            raise CommandError("Pass both --start and --end, or neither to rebuild everything")
+
+        start = end = None
+        if options['start']:
+            start, end = parse_date(options['start']), parse_date(options['end'])
+            if start is None or end is None:
+                raise CommandError("Dates must be given as YYYY-MM-DD")
+
+        written = rebuild_sales(start, end)
+        scope = f"{start} to {end}" if start else "all days"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup rows for {scope}"))
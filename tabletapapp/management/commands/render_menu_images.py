@@ -0,0 +1,42 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from tabletapapp.images import menus_showing, render_variants, store_image
+from tabletapapp.menu_cache import publish_menu_on_commit
+from tabletapapp.models import MenuImage, MenuItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the resized variants of menu photos that do not have them yet, "
+        "e.g. after a restart dropped queued work. With --import-legacy, photos "
+        "uploaded before deduplication are hashed and attached first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--import-legacy', action='store_true', help="Deduplicate photos stored before MenuImage existed")
+
+    def handle(self, *args, **options):
+        if options['import_legacy']:
+            imported = 0
+            legacy = MenuItem.objects.filter(menu_image__isnull=True).exclude(image='').exclude(image__isnull=True)
+            for item in legacy.iterator():
+                if not default_storage.exists(item.image.name):
+                    self.stderr.write(f"Item {item.id}: {item.image.name} is missing, skipped")
+                    continue
+                with default_storage.open(item.image.name, 'rb') as file:
+                    try:
+                        image = store_image(file)
+                    except ValueError as e:
+                        self.stderr.write(f"Item {item.id}: {e}")
+                        continue
+                MenuItem.objects.filter(id=item.id).update(menu_image=image, image=image.original.name)
+                imported += 1
+            self.stdout.write(f"Attached {imported} legacy photos")
+
+        rendered = 0
+        for image in MenuImage.objects.filter(variants={}).iterator():
+            render_variants(image)
+            publish_menu_on_commit(menus_showing(image))
+            rendered += 1
+        self.stdout.write(self.style.SUCCESS(f"Rendered variants of {rendered} photos"))
@@ -0,0 +1,442 @@
+# tabletapapp/menu_cache.py
+"""
+Published guest menus: immutable versions, pre-built and kept in Django's cache.
+
+Publishing a menu freezes its active categories and items, already ordered
+and converted to plain dicts, into a numbered MenuVersion row. Guests only
+ever read these rows, never the live categories and items the editor is
+changing, so they always see a whole menu, and orders record the version
+they were placed from. A version never changes, so it is cached by id
+without expiry.
+
+Which version a restaurant currently shows is kept per restaurant (owner)
+in the shared cache and, for TENANT_MENU_LOCAL_TTL seconds, in this
+process, so a QR scan usually costs no database query and no cache
+round-trip. It moves on when a menu is edited. Versions no pending order
+refers to are collected by the gc_menu_versions command.
+
+The single global snapshot (get_published_menu) backs the original
+table/<number>/ route, which predates per-restaurant routing.
+
+The a-prefixed readers serve the async guest views. A snapshot held in this
+process is returned without leaving the event loop; anything else goes
+through the cache's and the ORM's async APIs, and rebuilds run as one sync
+call.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch
+from django.utils import timezone
+
+from .images import image_sources
+from .models import Menu, MenuCategory, MenuItem, MenuVersion
+
+# Bump the suffix when the snapshot's shape changes
+PUBLISHED_MENU_KEY = 'tabletap:published-menu:v3'
+TENANT_MENU_KEY = 'tabletap:tenant-menu:v2:{owner_id}'
+MENU_VERSION_KEY = 'tabletap:menu-version:v1:{version_id}'
+
+EMPTY_SNAPSHOT = {'menu': None, 'categories': []}
+
+_stats_lock = threading.Lock()
+_stats = {'local_hits': 0, 'hits': 0, 'misses': 0, 'rebuilds': 0, 'invalidations': 0}
+
+# owner id -> (expiry on time.monotonic(), snapshot), least recently used first
+_local_lock = threading.Lock()
+_local_menus = OrderedDict()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """Hit/miss counters of this process since it started."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['local_hits'] + stats['hits'] + stats['misses']
+    stats['hit_ratio'] = (stats['local_hits'] + stats['hits']) / lookups if lookups else None
+    return stats
+
+
+def _serialize_item(item):
+    if item.menu_image:
+        image, srcsets = image_sources(item.menu_image)
+    else:
+        image, srcsets = (item.image.url if item.image else ''), {}
+    return {
+        'id': item.id,
+        'name': item.name,
+        'description': item.description or '',
+        'price': str(item.price),
+        'image': image,
+        'image_srcset': srcsets,
+    }
+
+
+def build_menu_snapshot(menu):
+    """
+    Serialize a menu with its active categories and items (two queries), as stored in a MenuVersion.
+
+    Inactive and archived menus are frozen without categories, so nothing
+    can be ordered from the version published when one is switched off.
+    """
+
+    categories = MenuCategory.objects.filter(menu=menu, active=True)
+    if not menu.active or menu.archived:
+        categories = categories.none()
+    categories = (
+        categories
+        .order_by('order', 'id')
+        .prefetch_related(
+            Prefetch(
+                'menuitem_set',
+                queryset=MenuItem.objects.filter(active=True).select_related('menu_image').order_by('id'),
+                to_attr='active_items',
+            )
+        )
+    )
+
+    return {
+        'menu': {
+            'id': menu.id,
+            'name': menu.name,
+            'description': menu.description or '',
+            'owner_id': menu.user_id,
+        },
+        'categories': [
+            {
+                'id': category.id,
+                'name': category.name,
+                'items': [
+                    _serialize_item(item)
+                    for item in category.active_items
+                ],
+            }
+            for category in categories
+        ],
+    }
+
+
+def version_snapshot(version):
+    """What guests are served for a MenuVersion: its stored menu plus the version's number, id and date."""
+    return {
+        'menu': {
+            **version.snapshot['menu'],
+            'version': version.number,
+            'version_id': version.id,
+            'updated_at': version.created_at,
+        },
+        'categories': version.snapshot['categories'],
+    }
+
+
+def publish_menu_version(menu):
+    """
+    Freeze the menu's current state as the MenuVersion numbered menu.version.
+
+    If that version already exists (another request published it first),
+    the existing row is returned.
+    """
+    try:
+        with transaction.atomic():
+            version = MenuVersion.objects.create(menu=menu, number=menu.version, snapshot=build_menu_snapshot(menu))
+    except IntegrityError:
+        return MenuVersion.objects.get(menu=menu, number=menu.version)
+    return version
+
+
+def current_version(menu):
+    """The menu's newest version, published now for menus that have none yet."""
+    version = MenuVersion.objects.filter(menu=menu).order_by('-number').first()
+    return version if version is not None else publish_menu_version(menu)
+
+
+def get_menu_version(version_id):
+    """
+    Return the guest snapshot of a version by id, or None if there is no such version.
+
+    Versions never change, so they are cached without expiry and only
+    dropped when collected.
+    """
+    key = MENU_VERSION_KEY.format(version_id=version_id)
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        return snapshot
+    version = MenuVersion.objects.filter(id=version_id).first()
+    if version is None:
+        return None
+    snapshot = version_snapshot(version)
+    cache.set(key, snapshot, timeout=None)
+    return snapshot
+
+
+async def aget_menu_version(version_id):
+    """Async get_menu_version."""
+    key = MENU_VERSION_KEY.format(version_id=version_id)
+    snapshot = await cache.aget(key)
+    if snapshot is not None:
+        return snapshot
+    version = await MenuVersion.objects.filter(id=version_id).afirst()
+    if version is None:
+        return None
+    snapshot = version_snapshot(version)
+    await cache.aset(key, snapshot, timeout=None)
+    return snapshot
+
+
+def _newer_versions(version_id):
+    return (
+        MenuVersion.objects
+        .filter(menu__versions__id=version_id, number__gt=F('menu__versions__number'))
+        .order_by('number')
+        .values_list('created_at', flat=True)
+    )
+
+
+def version_superseded_at(version_id):
+    """When the next version of the same menu was published, or None if this is its menu's newest."""
+    return _newer_versions(version_id).first()
+
+
+async def aversion_superseded_at(version_id):
+    """Async version_superseded_at."""
+    return await _newer_versions(version_id).afirst()
+
+
+def collect_menu_versions(older_than, dry_run=False):
+    """
+    Delete versions that were superseded more than `older_than` (a timedelta) ago.
+
+    A menu's newest version and any version a pending order refers to are
+    kept; the grace period lets guests who still have an older page open
+    finish their order. Finished orders keep their lines and prices but
+    lose the reference. Returns the number of versions deleted (or that
+    would be, with dry_run).
+    """
+    newer = MenuVersion.objects.filter(
+        menu=OuterRef('menu'), number__gt=OuterRef('number'), created_at__lt=timezone.now() - older_than
+    )
+    ids = list(
+        MenuVersion.objects
+        .filter(Exists(newer))
+        .exclude(order__status='pending')
+        .values_list('id', flat=True)
+    )
+    if dry_run:
+        return len(ids)
+    for start in range(0, len(ids), 1000):
+        chunk = ids[start:start + 1000]
+        MenuVersion.objects.filter(id__in=chunk).delete()
+        cache.delete_many([MENU_VERSION_KEY.format(version_id=version_id) for version_id in chunk])
+    return len(ids)
+
+
+def _menu_snapshot(menu):
+    return version_snapshot(current_version(menu)) if menu is not None else EMPTY_SNAPSHOT
+
+
+def get_active_menu():
+    return Menu.objects.filter(active=True, archived=False).first()
+
+
+def _store(key, snapshot, replace):
+    """
+    Store a rebuilt snapshot and return the one now cached.
+
+    Rebuilds after a miss only add: one that read the database before a
+    menu edit committed must not overwrite what the edit's on_commit
+    rebuild stored, which would leave the old menu cached until the next
+    edit. If another snapshot got there first, that one is returned.
+    Snapshots without a menu expire after EMPTY_MENU_CACHE_TTL seconds, so
+    requests for owner ids that have no menu cannot fill the cache.
+    """
+    timeout = None if snapshot['menu'] is not None else settings.EMPTY_MENU_CACHE_TTL
+    if replace:
+        cache.set(key, snapshot, timeout=timeout)
+        return snapshot
+    if cache.add(key, snapshot, timeout=timeout):
+        return snapshot
+    return cache.get(key, snapshot)
+
+
+def rebuild_published_menu(replace=False):
+    """
+    Look up the current version and store its snapshot, replacing a cached
+    one only if `replace` (after an edit).
+    """
+    snapshot = _store(PUBLISHED_MENU_KEY, _menu_snapshot(get_active_menu()), replace)
+    _count('rebuilds')
+    return snapshot
+
+
+def get_published_menu():
+    """Return the guest menu snapshot, building it on a cache miss."""
+    snapshot = cache.get(PUBLISHED_MENU_KEY)
+    if snapshot is not None:
+        _count('hits')
+        return snapshot
+    _count('misses')
+    return rebuild_published_menu()
+
+
+async def aget_published_menu():
+    """Async get_published_menu."""
+    snapshot = await cache.aget(PUBLISHED_MENU_KEY)
+    if snapshot is not None:
+        _count('hits')
+        return snapshot
+    _count('misses')
+    return await sync_to_async(rebuild_published_menu)()
+
+
+def invalidate_published_menu():
+    """Drop the cached snapshot so the next guest request rebuilds it."""
+    cache.delete(PUBLISHED_MENU_KEY)
+    _count('invalidations')
+
+
+def get_owner_menu(owner_id):
+    """The restaurant's active menu (the most recently edited one if several are active)."""
+    return (
+        Menu.objects
+        .filter(user_id=owner_id, active=True, archived=False)
+        .order_by('-updated_at')
+        .first()
+    )
+
+
+def _local_menu(owner_id):
+    """This process's unexpired copy of a restaurant's snapshot, or None."""
+    with _local_lock:
+        entry = _local_menus.get(owner_id)
+        if entry is not None:
+            _local_menus.move_to_end(owner_id)
+    if entry is not None and entry[0] > time.monotonic():
+        _count('local_hits')
+        return entry[1]
+    return None
+
+
+def _remember(owner_id, snapshot):
+    """
+    Keep a restaurant's snapshot in this process for TENANT_MENU_LOCAL_TTL seconds.
+
+    At most TENANT_MENU_LOCAL_SIZE restaurants are held: when full, expired
+    copies are dropped first, then the least recently used ones.
+    """
+    now = time.monotonic()
+    with _local_lock:
+        _local_menus[owner_id] = (now + settings.TENANT_MENU_LOCAL_TTL, snapshot)
+        _local_menus.move_to_end(owner_id)
+        if len(_local_menus) > settings.TENANT_MENU_LOCAL_SIZE:
+            for expired in [key for key, (expiry, _) in _local_menus.items() if expiry <= now]:
+                del _local_menus[expired]
+            while len(_local_menus) > settings.TENANT_MENU_LOCAL_SIZE:
+                _local_menus.popitem(last=False)
+
+
+def rebuild_tenant_menu(owner_id, replace=False):
+    """
+    Look up a restaurant's current version and store its snapshot,
+    replacing a cached one only if `replace` (after an edit).
+    """
+    snapshot = _menu_snapshot(get_owner_menu(owner_id))
+    snapshot = _store(TENANT_MENU_KEY.format(owner_id=owner_id), snapshot, replace)
+    _remember(owner_id, snapshot)
+    _count('rebuilds')
+    return snapshot
+
+
+def get_tenant_menu(owner_id):
+    """
+    Return a restaurant's guest menu snapshot.
+
+    Looked up in this process first, then in the shared cache, and only
+    read from the database when neither has it. Restaurants without an
+    active menu are cached too, as {'menu': None, ...}, for
+    EMPTY_MENU_CACHE_TTL seconds.
+    """
+    snapshot = _local_menu(owner_id)
+    if snapshot is not None:
+        return snapshot
+
+    snapshot = cache.get(TENANT_MENU_KEY.format(owner_id=owner_id))
+    if snapshot is None:
+        _count('misses')
+        return rebuild_tenant_menu(owner_id)
+    _count('hits')
+    _remember(owner_id, snapshot)
+    return snapshot
+
+
+async def aget_tenant_menu(owner_id):
+    """Async get_tenant_menu; a snapshot held in this process is returned without any await."""
+    snapshot = _local_menu(owner_id)
+    if snapshot is not None:
+        return snapshot
+
+    snapshot = await cache.aget(TENANT_MENU_KEY.format(owner_id=owner_id))
+    if snapshot is None:
+        _count('misses')
+        return await sync_to_async(rebuild_tenant_menu)(owner_id)
+    _count('hits')
+    _remember(owner_id, snapshot)
+    return snapshot
+
+
+def invalidate_tenant_menu(owner_id):
+    """
+    Drop a restaurant's snapshot from the shared cache and this process.
+
+    Other processes keep serving their local copy for at most
+    TENANT_MENU_LOCAL_TTL seconds.
+    """
+    cache.delete(TENANT_MENU_KEY.format(owner_id=owner_id))
+    with _local_lock:
+        _local_menus.pop(owner_id, None)
+    _count('invalidations')
+
+
+def clear_local_menus():
+    """Forget every snapshot held in this process (used by tests)."""
+    with _local_lock:
+        _local_menus.clear()
+
+
+def publish_menu_on_commit(menus=None):
+    """
+    Publish new versions of the changed menus and rebuild the snapshots once
+    the current transaction commits.
+
+    Called by every view that changes a menu, with the changed menus (a
+    queryset): their version number moves on, a MenuVersion freezes their
+    current state, the ETags handed out for them go stale and their
+    restaurants' snapshots are rebuilt. Old snapshots are dropped right
+    away so a failed rebuild can never leave a stale menu behind.
+    """
+    owner_ids = set()
+    if menus is not None:
+        with transaction.atomic():
+            menus.update(version=F('version') + 1, updated_at=timezone.now())
+            for menu in menus.all():
+                publish_menu_version(menu)
+                owner_ids.add(menu.user_id)
+
+    invalidate_published_menu()
+    for owner_id in owner_ids:
+        invalidate_tenant_menu(owner_id)
+
+    def rebuild():
+        rebuild_published_menu(replace=True)
+        for owner_id in owner_ids:
+            rebuild_tenant_menu(owner_id, replace=True)
+
+    transaction.on_commit(rebuild)
@@ -0,0 +1,217 @@
+# tabletapapp/menus.py
+import base64
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .images import store_image
+from .models import Menu, MenuCategory, MenuImage, MenuItem
+
+
+def decode_data_url_image(data_url):
+    """Turn a 'data:image/...;base64,...' string into a named ContentFile."""
+    header, imgstr = data_url.split(';base64,')
+    ext = header.split('/')[-1]
+    return ContentFile(base64.b64decode(imgstr), name=f"{uuid.uuid4()}.{ext}")
+
+
+def _attach_image(item, image):
+    # The item points at the shared, deduplicated file rather than a copy
+    item.menu_image = image
+    item.image = image.original.name
+
+
+def _parse_price(value):
+    try:
+        price = Decimal(str(value if value not in (None, '') else 0)).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"Invalid price '{value}'")
+    if not price.is_finite():
+        raise ValueError(f"Invalid price '{value}'")
+    return price
+
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@transaction.atomic
+def apply_menu_data(menu, menu_data):
+    """
+    Make the menu's active categories and items match the editor payload.
+
+    menu_data maps category names (in display order) to lists of items. The
+    current menu is loaded once and compared in memory; only rows that
+    actually differ are written, with bulk_create/bulk_update, inside one
+    transaction. Categories and items missing from the payload are
+    deactivated rather than deleted because orders still reference them.
+    Items reference photos uploaded beforehand by image_id; inline data URLs
+    are still accepted and go through the same deduplicating store_image.
+
+    Returns a dict with the number of inserted, updated and deactivated rows.
+    Raises ValueError on malformed item data or images.
+    """
+    now = timezone.now()
+
+    # Current state of the menu, two queries
+    categories = {}
+    for category in MenuCategory.objects.filter(menu=menu).order_by('id'):
+        categories.setdefault(category.name, category)
+    items = {item.id: item for item in MenuItem.objects.filter(category__menu=menu)}
+
+    # Categories
+    new_categories = []
+    changed_categories = []
+    for order, category_name in enumerate(menu_data):
+        category = categories.get(category_name)
+        if category is None:
+            new_categories.append(MenuCategory(menu=menu, name=category_name, order=order, active=True))
+        elif not category.active or category.order != order:
+            category.active = True
+            category.order = order
+            category.updated_at = now
+            changed_categories.append(category)
+
+    if new_categories:
+        MenuCategory.objects.bulk_create(new_categories)
+        # Backends without RETURNING (MySQL) do not set the new primary keys
+        created = MenuCategory.objects.filter(menu=menu, name__in=[c.name for c in new_categories])
+        for category in created:
+            categories[category.name] = category
+    if changed_categories:
+        MenuCategory.objects.bulk_update(changed_categories, ['active', 'order', 'updated_at'])
+
+    kept_category_ids = {categories[name].id for name in menu_data}
+    removed_categories = [
+        c.id for c in categories.values() if c.active and c.id not in kept_category_ids
+    ]
+    if removed_categories:
+        MenuCategory.objects.filter(id__in=removed_categories).update(active=False, updated_at=now)
+
+    # Photos uploaded beforehand through upload_menu_image, one query
+    images = MenuImage.objects.in_bulk({
+        image_id
+        for category_items in menu_data.values()
+        for item_data in category_items
+        if (image_id := _parse_id(item_data.get('image_id'))) is not None
+    })
+
+    # Items
+    new_items = []
+    changed_items = []
+    kept_item_ids = set()
+    for category_name, category_items in menu_data.items():
+        category = categories[category_name]
+        for item_data in category_items:
+            name = (item_data.get('name') or '').strip()
+            if not name:
+                continue
+            price = _parse_price(item_data.get('price', 0))
+            description = (item_data.get('description') or '').strip()
+            image_id = _parse_id(item_data.get('image_id'))
+            image = item_data.get('image') or ''
+            if image_id is not None:
+                if image_id not in images:
+                    raise ValueError(f"Unknown image id {image_id}")
+                new_image = images[image_id]
+            elif image.startswith('data:image'):
+                # Inline base64 photos from older editors
+                new_image = store_image(decode_data_url_image(image))
+            else:
+                new_image = None
+
+            item = items.get(_parse_id(item_data.get('id')))
+            if item is None or item.id in kept_item_ids:
+                item = MenuItem(category=category, name=name, price=price,
+                                description=description, active=True)
+                if new_image:
+                    _attach_image(item, new_image)
+                new_items.append(item)
+                continue
+
+            kept_item_ids.add(item.id)
+            if new_image and new_image.id == item.menu_image_id:
+                new_image = None
+            if (item.name, item.price, item.description or '', item.active, item.category_id) == \
+                    (name, price, description, True, category.id) and not new_image:
+                continue
+            item.name = name
+            item.price = price
+            item.description = description
+            item.active = True
+            item.category = category
+            item.updated_at = now
+            if new_image:
+                _attach_image(item, new_image)
+            changed_items.append(item)
+
+    if new_items:
+        MenuItem.objects.bulk_create(new_items)
+    if changed_items:
+        MenuItem.objects.bulk_update(
+            changed_items, ['name', 'price', 'description', 'active', 'category', 'image', 'menu_image', 'updated_at']
+        )
+
+    removed_items = [
+        item.id for item in items.values() if item.active and item.id not in kept_item_ids
+    ]
+    if removed_items:
+        MenuItem.objects.filter(id__in=removed_items).update(active=False, updated_at=now)
+
+    return {
+        'inserted': len(new_categories) + len(new_items),
+        'updated': len(changed_categories) + len(changed_items),
+        'deactivated': len(removed_categories) + len(removed_items),
+    }
+
+
+def with_editor_data(menus):
+    """
+    Prefetch the active categories (in order) and their active items of a menu queryset.
+
+    Three queries in total however many menus, categories and items there
+    are: the menus, then one query per level.
+    """
+    return menus.prefetch_related(
+        Prefetch(
+            'menucategory_set',
+            queryset=MenuCategory.objects.filter(active=True).order_by('order', 'id').prefetch_related(
+                Prefetch(
+                    'menuitem_set',
+                    queryset=MenuItem.objects.filter(active=True).order_by('id'),
+                    to_attr='active_items',
+                )
+            ),
+            to_attr='active_categories',
+        )
+    )
+
+
+def editor_data(menu):
+    """Active categories mapped to their active items, from a menu fetched through with_editor_data."""
+    return {
+        category.name: [
+            {
+                'id': item.id,
+                'name': item.name,
+                'description': item.description or '',
+                'price': float(item.price),
+                'image': item.image.url if item.image else '',
+                'image_id': item.menu_image_id,
+            }
+            for item in category.active_items
+        ]
+        for category in menu.active_categories
+    }
+
+
+def serialize_menu_data(menu):
+    """Active categories (in order) mapped to their active items, as the editor expects."""
+    return editor_data(with_editor_data(Menu.objects.filter(pk=menu.pk)).get())
@@ -0,0 +1,294 @@
+# tabletapapp/metrics.py
+"""
+Per-view request metrics: wall time, number of queries and time spent in the
+database.
+
+RequestMetricsMiddleware measures a sample of requests
+(REQUEST_METRICS_SAMPLE_RATE). Every database connection carries one
+execute wrapper, installed when it is opened, that hands each query to the
+recorder of the request being measured, found in a context variable. The
+recorder times the query and records its shape, the SQL with IN lists and
+VALUES rows collapsed. A shape that runs N_PLUS_ONE_THRESHOLD
+times or more in one request is reported as a likely N+1. Aggregates live in
+this process, in fixed-bucket histograms, and are exposed as JSON and in the
+Prometheus text format; scrape every worker.
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Upper bounds in seconds for request and database time, and in queries per request
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Repeated shapes kept per view, so an endless variety of SQL cannot grow memory
+MAX_SHAPES_PER_VIEW = 20
+
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_REPEATED_ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def sql_shape(sql):
+    """SQL with placeholder lists collapsed, so the same query with 3 or 30 ids matches."""
+    shape = _IN_LIST.sub('(...)', sql)
+    shape = _REPEATED_ROWS.sub('(...)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense, plus sum and count."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile; None past the last bucket."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        for bound, count in zip(self.bounds, self.counts):
+            if count >= rank:
+                return bound
+        return None
+
+
+class QueryRecorder:
+    """Execute wrapper counting and timing the queries of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            self.shapes[sql] += 1
+
+    def repeated_shapes(self):
+        """{shape: executions} of the shapes run at least N_PLUS_ONE_THRESHOLD times."""
+        shapes = Counter()
+        for sql, executions in self.shapes.items():
+            shapes[sql_shape(sql)] += executions
+        return {
+            shape: executions for shape, executions in shapes.items()
+            if executions >= settings.N_PLUS_ONE_THRESHOLD
+        }
+
+
+# The recorder of the request being measured, if any. Context variables are
+# copied into sync_to_async threads, so queries an async view runs on a
+# worker thread still reach it.
+_recorder = ContextVar('request_metrics_recorder', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver putting the metrics execute wrapper on a connection once."""
+    if _record_query not in connection.execute_wrappers:
+        # First, so that connection.execute_wrapper() blocks, which pop the
+        # last wrapper when they exit, never remove it
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+_lock = threading.Lock()
+_views = {}
+
+
+def _new_view():
+    return {
+        'duration': Histogram(TIME_BUCKETS),
+        'db_time': Histogram(TIME_BUCKETS),
+        'queries': Histogram(QUERY_BUCKETS),
+        'errors': 0,
+        # shape -> {'requests': flagged requests, 'max_executions': worst single request}
+        'n_plus_one': {},
+    }
+
+
+def record(view, status_code, duration, recorder):
+    """Add one measured request to the aggregates of its view."""
+    repeated = recorder.repeated_shapes()
+    with _lock:
+        stats = _views.get(view)
+        if stats is None:
+            stats = _views[view] = _new_view()
+        stats['duration'].observe(duration)
+        stats['db_time'].observe(recorder.time)
+        stats['queries'].observe(recorder.count)
+        stats['errors'] += status_code >= 500
+        for shape, executions in repeated.items():
+            entry = stats['n_plus_one'].get(shape)
+            if entry is None:
+                if len(stats['n_plus_one']) >= MAX_SHAPES_PER_VIEW:
+                    continue
+                entry = stats['n_plus_one'][shape] = {'requests': 0, 'max_executions': 0}
+            entry['requests'] += 1
+            entry['max_executions'] = max(entry['max_executions'], executions)
+
+
+def reset_metrics():
+    """Forget everything recorded so far in this process."""
+    with _lock:
+        _views.clear()
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def metrics_summary():
+    """Per-view aggregates of this process, slowest views first."""
+    with _lock:
+        views = {}
+        for view, stats in _views.items():
+            duration, db_time, queries = stats['duration'], stats['db_time'], stats['queries']
+            views[view] = {
+                'requests': duration.count,
+                'errors': stats['errors'],
+                'mean_ms': _ms(duration.sum / duration.count),
+                # Upper bounds of the histogram buckets the quantiles fall in
+                'p50_ms_le': _ms(duration.quantile(0.50)),
+                'p95_ms_le': _ms(duration.quantile(0.95)),
+                'p99_ms_le': _ms(duration.quantile(0.99)),
+                'mean_db_ms': _ms(db_time.sum / db_time.count),
+                'db_share': round(db_time.sum / duration.sum, 3) if duration.sum else None,
+                'mean_queries': round(queries.sum / queries.count, 2),
+                'p95_queries_le': queries.quantile(0.95),
+                'n_plus_one': [
+                    {'sql': shape, **entry}
+                    for shape, entry in sorted(
+                        stats['n_plus_one'].items(), key=lambda pair: -pair[1]['requests']
+                    )
+                ],
+            }
+    return dict(sorted(views.items(), key=lambda pair: -pair[1]['mean_ms'] * pair[1]['requests']))
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name, view, histogram):
+    labels = f'view="{_label(view)}"'
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+    yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+    yield f'{name}_sum{{{labels}}} {histogram.sum}'
+    yield f'{name}_count{{{labels}}} {histogram.count}'
+
+
+def prometheus_text():
+    """The aggregates in the Prometheus text exposition format."""
+    families = (
+        ('duration', 'tabletap_request_duration_seconds', 'Wall time of sampled requests.'),
+        ('db_time', 'tabletap_request_db_seconds', 'Time sampled requests spent in database queries.'),
+        ('queries', 'tabletap_request_queries', 'Database queries per sampled request.'),
+    )
+    lines = []
+    with _lock:
+        for key, name, help_text in families:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for view, stats in _views.items():
+                lines.extend(_histogram_lines(name, view, stats[key]))
+        lines += [
+            '# HELP tabletap_request_errors_total Sampled requests answered with a 5xx status.',
+            '# TYPE tabletap_request_errors_total counter',
+        ]
+        lines += [f'tabletap_request_errors_total{{view="{_label(view)}"}} {stats["errors"]}' for view, stats in _views.items()]
+        lines += [
+            '# HELP tabletap_request_n_plus_one_total Sampled requests repeating one query shape N_PLUS_ONE_THRESHOLD times or more.',
+            '# TYPE tabletap_request_n_plus_one_total counter',
+        ]
+        lines += [
+            f'tabletap_request_n_plus_one_total{{view="{_label(view)}"}} '
+            f'{sum(entry["requests"] for entry in stats["n_plus_one"].values())}'
+            for view, stats in _views.items()
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name or match._func_path) if match else 'unresolved'
+
+
+class RequestMetricsMiddleware:
+    """
+    Time a sample of requests and the queries they run, aggregated per view.
+
+    Streaming responses are timed until their headers are ready. Works in
+    both sync and async stacks; either way it only sets the context
+    variable the connections' wrapper records into, so an async request
+    never waits for a thread on its account.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _sampled():
+        rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        return rate >= 1 or random.random() < rate
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        record(_view_name(request), response.status_code, time.perf_counter() - started, recorder)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        record(_view_name(request), response.status_code, time.perf_counter() - started, recorder)
+        return response
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:15
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_tables(apps, schema_editor):
+    """Point orders at the oldest of each set of duplicate tables and drop the rest."""
+    Table = apps.get_model('tabletapapp', 'Table')
+    Order = apps.get_model('tabletapapp', 'Order')
+    duplicates = (
+        Table.objects.values('user', 'table_number')
+        .annotate(count=Count('id'), keep=Min('id'))
+        .filter(count__gt=1)
+    )
+    for group in duplicates:
+        others = Table.objects.filter(
+            user=group['user'], table_number=group['table_number']
+        ).exclude(id=group['keep'])
+        Order.objects.filter(table__in=others).update(table_id=group['keep'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabletapapp', '0003_order_special_instructions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='menu',
+            index=models.Index(fields=['active', 'archived'], name='menu_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menu',
+            index=models.Index(fields=['user', 'archived', '-updated_at'], name='menu_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menucategory',
+            index=models.Index(fields=['menu', 'active', 'order'], name='category_menu_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(fields=['category', 'active'], name='item_category_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-updated_at', '-id'], name='order_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-updated_at', '-id'], name='order_status_updated_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_tables, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='table',
+            constraint=models.UniqueConstraint(fields=('user', 'table_number'), name='unique_table_number_per_user'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabletapapp', '0005_order_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tabletapapp.menuitem')),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tabletapapp.table')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'date', 'table', 'item'), name='unique_daily_sales')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabletapapp', '0007_menu_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabletapapp', '0008_menu_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('snapshot', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('menu', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='tabletapapp.menu')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='menu_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='tabletapapp.menuversion'),
+        ),
+        migrations.AddConstraint(
+            model_name='menuversion',
+            constraint=models.UniqueConstraint(fields=('menu', 'number'), name='unique_menu_version'),
+        ),
+    ]
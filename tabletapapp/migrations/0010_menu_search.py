@@ -0,0 +1,78 @@
+"""
+Full-text indexes behind the menu item search (see tabletapapp/search.py).
+
+MySQL gets InnoDB FULLTEXT indexes, which the database keeps up to date
+itself. SQLite gets an FTS5 table kept in sync by triggers; note that
+Django rebuilds SQLite tables for many schema changes, which drops their
+triggers, so a later migration altering menu items or categories must
+re-create them. Other databases search with icontains.
+"""
+from django.db import migrations
+
+FTS_TABLE = 'tabletapapp_menuitem_fts'
+
+SQLITE_FORWARD = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        name, description, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER menuitem_fts_insert AFTER INSERT ON tabletapapp_menuitem BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        VALUES (new.id, new.name, coalesce(new.description, ''),
+                (SELECT name FROM tabletapapp_menucategory WHERE id = new.category_id));
+    END""",
+    f"""CREATE TRIGGER menuitem_fts_update AFTER UPDATE OF name, description, category_id ON tabletapapp_menuitem BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        VALUES (new.id, new.name, coalesce(new.description, ''),
+                (SELECT name FROM tabletapapp_menucategory WHERE id = new.category_id));
+    END""",
+    f"""CREATE TRIGGER menuitem_fts_delete AFTER DELETE ON tabletapapp_menuitem BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER menucategory_fts_update AFTER UPDATE OF name ON tabletapapp_menucategory BEGIN
+        UPDATE {FTS_TABLE} SET category = new.name
+        WHERE rowid IN (SELECT id FROM tabletapapp_menuitem WHERE category_id = new.id);
+    END""",
+    f"""INSERT INTO {FTS_TABLE}(rowid, name, description, category)
+        SELECT item.id, item.name, coalesce(item.description, ''), category.name
+        FROM tabletapapp_menuitem item JOIN tabletapapp_menucategory category ON category.id = item.category_id""",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS menucategory_fts_update",
+    "DROP TRIGGER IF EXISTS menuitem_fts_delete",
+    "DROP TRIGGER IF EXISTS menuitem_fts_update",
+    "DROP TRIGGER IF EXISTS menuitem_fts_insert",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+MYSQL_FORWARD = [
+    "ALTER TABLE tabletapapp_menuitem ADD FULLTEXT INDEX menuitem_search_ft (name, description)",
+    "ALTER TABLE tabletapapp_menucategory ADD FULLTEXT INDEX category_search_ft (name)",
+]
+
+MYSQL_BACKWARD = [
+    "ALTER TABLE tabletapapp_menucategory DROP INDEX category_search_ft",
+    "ALTER TABLE tabletapapp_menuitem DROP INDEX menuitem_search_ft",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabletapapp', '0009_menu_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'mysql': MYSQL_FORWARD}),
+            _run({'sqlite': SQLITE_BACKWARD, 'mysql': MYSQL_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:05
+
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 1000
+
+
+def assign_table_owners(apps, schema_editor):
+    """
+    Give tables created for anonymous guests (user NULL) the restaurant their orders were placed with.
+
+    An order belongs to the owner of the menu its first line was ordered
+    from. A table whose orders went to several restaurants is split: the
+    first owner keeps the row, the others get a table of the same number
+    (or their existing one) and their orders are moved to it. Tables
+    without any order lines keep no owner. Legacy orders only enter the
+    sales rollup once it is rebuilt (manage.py rebuild_sales).
+    """
+    Table = apps.get_model('tabletapapp', 'Table')
+    Order = apps.get_model('tabletapapp', 'Order')
+    OrderItem = apps.get_model('tabletapapp', 'OrderItem')
+
+    first_line_owner = Subquery(
+        OrderItem.objects
+        .filter(order=OuterRef('pk'))
+        .order_by('id')
+        .values('item__category__menu__user')[:1]
+    )
+    orders = defaultdict(lambda: defaultdict(list))
+    rows = (
+        Order.objects
+        .filter(table__user__isnull=True)
+        .annotate(line_owner=first_line_owner)
+        .filter(line_owner__isnull=False)
+        .values_list('id', 'table_id', 'line_owner')
+        .order_by('id')
+    )
+    for order_id, table_id, owner_id in rows.iterator(chunk_size=BATCH_SIZE):
+        orders[table_id][owner_id].append(order_id)
+
+    for table in Table.objects.filter(id__in=list(orders)).order_by('id'):
+        for owner_id, order_ids in sorted(orders[table.id].items()):
+            target = Table.objects.filter(user_id=owner_id, table_number=table.table_number).first()
+            if target is None and table.user_id is None:
+                table.user_id = owner_id
+                table.save(update_fields=['user'])
+                continue
+            if target is None:
+                target = Table.objects.create(
+                    user_id=owner_id, table_number=table.table_number, active=table.active,
+                )
+            for start in range(0, len(order_ids), BATCH_SIZE):
+                Order.objects.filter(id__in=order_ids[start:start + BATCH_SIZE]).update(table_id=target.id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabletapapp', '0011_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_table_owners, migrations.RunPython.noop),
+    ]
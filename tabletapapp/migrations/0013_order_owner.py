@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_table_owners(apps, schema_editor):
+    """Set each order's owner to its table's restaurant."""
+    Table = apps.get_model('tabletapapp', 'Table')
+    Order = apps.get_model('tabletapapp', 'Order')
+    Order.objects.filter(owner__isnull=True).update(
+        owner_id=Subquery(Table.objects.filter(id=OuterRef('table_id')).values('user_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tabletapapp', '0012_assign_table_owners'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='restaurant_orders', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_table_owners, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['owner', '-updated_at', '-id'], name='order_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['owner', 'status', '-updated_at', '-id'], name='order_owner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='order_owner_created_idx'),
+        ),
+    ]
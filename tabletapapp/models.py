@@ -39,12 +39,43 @@ class Menu(models.Model):
     description = models.TextField(blank=True, null=True)
     active = models.BooleanField(default=True)
     archived = models.BooleanField(default=False)  
+    # Bumped on every change to the menu or its items; used for ETags
+    version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Guest lookup of the active menu
+            models.Index(fields=['active', 'archived'], name='menu_active_idx'),
+            # Editor's menu list
+            models.Index(fields=['user', 'archived', '-updated_at'], name='menu_user_updated_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+class MenuVersion(models.Model):
+    """
+    A published menu, frozen: the categories, items and prices guests saw.
+
+    Rows are never updated. The menu's `version` counter numbers them, and
+    orders keep a reference to the version they were placed from.
+    """
+    menu = models.ForeignKey(Menu, on_delete=models.CASCADE, related_name='versions')
+    number = models.PositiveIntegerField()
+    # {"menu": {"id", "name", "description", "owner_id"}, "categories": [{"id", "name", "items": [...]}]}
+    snapshot = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['menu', 'number'], name='unique_menu_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.menu_id} v{self.number}"
+
 class MenuCategory(models.Model):
     menu = models.ForeignKey(Menu, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
@@ -54,19 +85,45 @@ class MenuCategory(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['menu', 'active', 'order'], name='category_menu_active_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+class MenuImage(models.Model):
+    """A menu photo, stored once per distinct content, with its resized variants."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    original = models.ImageField(upload_to='menu_images/originals/')
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    # {"webp": {"400": {"path": ..., "size": ...}, ...}, "jpeg": {...}}; empty until rendered
+    variants = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Image {self.sha256[:12]}"
+
+
 class MenuItem(models.Model):
     category = models.ForeignKey(MenuCategory, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='menu_images/', blank=True, null=True) 
+    menu_image = models.ForeignKey(MenuImage, on_delete=models.SET_NULL, blank=True, null=True)
     active = models.BooleanField(default=True)  
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'active'], name='item_category_active_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -83,12 +140,27 @@ class Table(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # Lets Table.objects.get_or_create(user=..., table_number=...) fall
+            # back to a lookup instead of creating a duplicate under a race
+            models.UniqueConstraint(fields=['user', 'table_number'], name='unique_table_number_per_user'),
+        ]
+
     def __str__(self):
         return f"Table {self.table_number}"
 
 
 class Order(models.Model):
     table = models.ForeignKey(Table, on_delete=models.CASCADE)
+    # The restaurant, i.e. table.user, copied so per-restaurant lists read one index
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='restaurant_orders',
+    )
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -104,6 +176,23 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     special_instructions = models.TextField(blank=True, null=True)
+    # The published menu the guest ordered from; cleared if that version is collected
+    menu_version = models.ForeignKey(MenuVersion, on_delete=models.SET_NULL, blank=True, null=True)
+    # Sent by the client so that a retried submission returns this order instead of placing another
+    idempotency_key = models.CharField(max_length=64, unique=True, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Kitchen board and change feed, keyset-paginated on (updated_at, id)
+            models.Index(fields=['-updated_at', '-id'], name='order_updated_idx'),
+            models.Index(fields=['status', '-updated_at', '-id'], name='order_status_updated_idx'),
+            # The same for one restaurant
+            models.Index(fields=['owner', '-updated_at', '-id'], name='order_owner_updated_idx'),
+            models.Index(fields=['owner', 'status', '-updated_at', '-id'], name='order_owner_status_idx'),
+            # Date-range exports and daily totals, walked on (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+            models.Index(fields=['owner', 'created_at', 'id'], name='order_owner_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} - {self.status}"
@@ -119,3 +208,26 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.quantity} x {self.item.name} in Order {self.order.id}"
 
+
+class DailySales(models.Model):
+    """
+    Sales of one menu item at one table on one day, kept up to date as orders
+    come in so the analytics API never has to scan orders. Revenue is the
+    pre-tax line subtotal; cancelled orders are not counted.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    date = models.DateField()
+    table = models.ForeignKey(Table, on_delete=models.CASCADE)
+    item = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index behind the analytics queries, which filter on (user, date)
+            models.UniqueConstraint(fields=['user', 'date', 'table', 'item'], name='unique_daily_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} table {self.table_id} item {self.item_id}: {self.quantity}"
+
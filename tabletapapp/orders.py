@@ -0,0 +1,582 @@
+# tabletapapp/orders.py
+import base64
+import json
+import re
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, IntegerField, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .analytics import apply_sales_deltas, cancelled_sales_deltas, order_sales_deltas
+from .events import order_event, publish_on_commit
+from .menu_cache import (
+    aget_menu_version, aget_tenant_menu, aversion_superseded_at, get_menu_version, get_tenant_menu,
+    version_superseded_at,
+)
+from .models import MenuItem, Order, OrderItem, Table
+from .qrcodes import check_table_number
+
+# Number of orders shown per page on the kitchen board
+ORDER_PAGE_SIZE = 50
+
+# Default and maximum number of orders returned by one changes request
+CHANGES_PAGE_SIZE = 100
+CHANGES_MAX_PAGE_SIZE = 500
+
+# Orders touched in the last moments are held back from the changes feed so
+# that a transaction which started earlier but commits later cannot slip in
+# behind a cursor the client has already moved past.
+CHANGES_SETTLE_SECONDS = 1
+
+ORDER_STATUSES = ('pending', 'completed', 'cancelled')
+
+# Idempotency keys are opaque client tokens (the guest page sends a UUID)
+IDEMPOTENCY_KEY = re.compile(r'[!-~]{1,64}')
+
+# Most of one item a guest can order at once
+MAX_ITEM_QUANTITY = 100
+
+# Largest total Order.total_amount can hold
+_total_field = Order._meta.get_field('total_amount')
+MAX_ORDER_TOTAL = Decimal(10) ** (_total_field.max_digits - _total_field.decimal_places) - Decimal('0.01')
+
+# Allowed status changes, keyed by the current status
+ORDER_TRANSITIONS = {
+    'pending': ('completed', 'cancelled'),
+}
+
+
+def encode_cursor(updated_at, order_id):
+    """Encode an (updated_at, id) position as an opaque URL-safe token."""
+    raw = f"{updated_at.isoformat()},{order_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    """Decode a cursor produced by encode_cursor. Raises ValueError if invalid."""
+    try:
+        raw = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+        updated_at_str, order_id = raw.rsplit(',', 1)
+        updated_at = parse_datetime(updated_at_str)
+        order_id = int(order_id)
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if updated_at is None:
+        raise ValueError("Invalid cursor")
+    return updated_at, order_id
+
+
+def order_summary_queryset():
+    """Orders with their table joined and total_items summed in the database."""
+    total_items = (
+        OrderItem.objects
+        .filter(order=OuterRef('pk'))
+        .order_by()
+        .values('order')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    return (
+        Order.objects
+        .select_related('table')
+        .annotate(total_items=Coalesce(Subquery(total_items, output_field=IntegerField()), 0))
+    )
+
+
+def order_feed_queryset():
+    """
+    Orders with their table, line items and item count loaded up front.
+
+    The table is joined, the line items (and their menu items) come from a
+    single prefetch query and total_items is summed in the database, so the
+    number of queries does not depend on how many orders are returned.
+    """
+    return order_summary_queryset().prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('item').order_by('id'))
+    )
+
+
+def filter_orders(queryset, status=None, date_from=None, date_to=None):
+    """Restrict a queryset by status and by an inclusive updated_at date window."""
+    if status:
+        queryset = queryset.filter(status=status)
+    if date_from:
+        start = timezone.make_aware(datetime.combine(date_from, time.min))
+        queryset = queryset.filter(updated_at__gte=start)
+    if date_to:
+        end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+        queryset = queryset.filter(updated_at__lt=end)
+    return queryset
+
+
+def order_page_queryset(status=None, date_from=None, date_to=None, before=None, owner=None):
+    """
+    The kitchen board's orders older than the `before` (updated_at, id)
+    position, newest first; only the owner's restaurant's if an owner is
+    given. Served by the (owner, [status,] -updated_at, -id) indexes.
+    """
+    orders = filter_orders(order_feed_queryset(), status, date_from, date_to)
+    if owner is not None:
+        orders = orders.filter(owner=owner)
+
+    if before:
+        updated_at, order_id = before
+        orders = orders.filter(
+            Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=order_id)
+        )
+    return orders.order_by('-updated_at', '-id')
+
+
+def get_order_page(status=None, date_from=None, date_to=None, before=None, limit=ORDER_PAGE_SIZE, owner=None):
+    """
+    Return one page of the kitchen board, newest first, and the cursor of the next page.
+
+    Pages are keyed on (updated_at, id) rather than OFFSET so fetching an
+    older page costs the same as fetching the first one. With an owner,
+    only that restaurant's orders are listed.
+    """
+    orders = list(order_page_queryset(status, date_from, date_to, before, owner)[:limit + 1])
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        next_cursor = encode_cursor(last.updated_at, last.id)
+
+    return orders, next_cursor
+
+
+def parse_order_filters(params):
+    """
+    Read the status/date_from/date_to/before query parameters.
+
+    Returns a dict of keyword arguments for get_order_page. Raises ValueError
+    with a readable message on malformed input.
+    """
+    filters = {}
+
+    status = params.get('status', '')
+    if status and status != 'all':
+        if status not in ORDER_STATUSES:
+            raise ValueError(f"Unknown status '{status}'")
+        filters['status'] = status
+
+    for name in ('date_from', 'date_to'):
+        value = params.get(name, '')
+        if value:
+            parsed = parse_date(value)
+            if parsed is None:
+                raise ValueError(f"Invalid {name} '{value}', expected YYYY-MM-DD")
+            filters[name] = parsed
+
+    before = params.get('before', '')
+    if before:
+        filters['before'] = decode_cursor(before)
+
+    return filters
+
+
+def serialize_order_items(order):
+    """Line items of an order fetched through order_feed_queryset."""
+    return [
+        {
+            'name': item.item.name,
+            'quantity': item.quantity,
+            'price': float(item.price),
+            'subtotal': float(item.price * item.quantity),
+        }
+        for item in order.orderitem_set.all()
+    ]
+
+
+def changed_orders_queryset(since=None, owner=None):
+    """
+    Settled orders created or modified after the `since` (updated_at, id)
+    position, oldest first; only the owner's restaurant's if an owner is
+    given.
+    """
+    settled = timezone.now() - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+    orders = order_feed_queryset().filter(updated_at__lt=settled)
+    if owner is not None:
+        orders = orders.filter(owner=owner)
+
+    if since:
+        updated_at, order_id = since
+        orders = orders.filter(
+            Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=order_id)
+        )
+    return orders.order_by('updated_at', 'id')
+
+
+def get_changed_orders(since=None, limit=CHANGES_PAGE_SIZE, owner=None):
+    """
+    Orders created or modified after the `since` (updated_at, id) position,
+    oldest first; only the owner's restaurant's if an owner is given.
+
+    Returns (orders, cursor, has_more). The cursor points at the last order
+    returned (or stays at `since` when nothing changed) and is what the
+    client sends next time. The work done is proportional to the number of
+    changed orders, not to the size of the history.
+    """
+    orders = list(changed_orders_queryset(since, owner)[:limit + 1])
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+
+    if orders:
+        cursor = encode_cursor(orders[-1].updated_at, orders[-1].id)
+    elif since:
+        cursor = encode_cursor(*since)
+    else:
+        cursor = None
+
+    return orders, cursor, has_more
+
+
+def serialize_guest_order(order):
+    """What anyone holding an order id may see: its status and items, without the table, times or notes."""
+    return {
+        'id': order.id,
+        'status': order.status,
+        'items': [
+            {
+                'item_name': item.item.name,
+                'quantity': item.quantity,
+                'price': float(item.price),
+                'subtotal': float(item.price * item.quantity),
+            }
+            for item in order.orderitem_set.all()
+        ],
+    }
+
+
+def serialize_order_detail(order):
+    """Full order with its items inline, as returned by the order APIs."""
+    return {
+        'id': order.id,
+        'table_number': order.table.table_number,
+        'status': order.status,
+        'date': order.updated_at.strftime('%Y-%m-%d'),
+        'time': order.updated_at.strftime('%I:%M %p'),
+        'created_at': order.created_at.isoformat(),
+        'updated_at': order.updated_at.isoformat(),
+        'total_amount': float(order.total_amount),
+        'total_items': order.total_items,
+        'special_instructions': order.special_instructions or '',
+        'items': [
+            {
+                'item_id': item.item_id,
+                'item_name': item.item.name,
+                'quantity': item.quantity,
+                'price': float(item.price),
+                'subtotal': float(item.price * item.quantity),
+            }
+            for item in order.orderitem_set.all()
+        ],
+    }
+
+
+def serialize_board_order(order):
+    """Template data for one card on the kitchen board."""
+    return {
+        'id': order.id,
+        'table_number': order.table.table_number,
+        'status': order.status,
+        'updated_at': order.updated_at,
+        'date': order.updated_at.strftime('%Y-%m-%d'),
+        'time': order.updated_at.strftime('%I:%M %p'),
+        'total_items': order.total_items,
+        'total_price': float(order.total_amount),
+        'items': json.dumps(serialize_order_items(order)),
+    }
+
+
+def parse_order_lines(request):
+    """
+    Read the submitted table, instructions, (menu item id, quantity) lines
+    and the id of the menu version the guest ordered from and the
+    idempotency key, if given.
+
+    Accepts either a JSON body
+        {"table": "4", "special_instructions": "...", "menu_version": 12,
+         "idempotency_key": "...", "items": [{"id": 1, "quantity": 2}]}
+    or the indexed form fields item_id_N / item_quantity_N posted by the guest
+    page. An Idempotency-Key header takes precedence over the field. Raises
+    ValueError on malformed input.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON Parsing error: {e}")
+        if not isinstance(data, dict):
+            raise ValueError("Order must be a JSON object")
+        table_number = str(data.get('table') or '').strip()
+        special_instructions = data.get('special_instructions') or ''
+        menu_version_id = data.get('menu_version')
+        idempotency_key = data.get('idempotency_key')
+        raw_lines = [
+            (line.get('id'), line.get('quantity'))
+            for line in data.get('items') or []
+            if isinstance(line, dict)
+        ]
+    else:
+        table_number = request.POST.get('table', '').strip()
+        special_instructions = request.POST.get('special_instructions', '')
+        menu_version_id = request.POST.get('menu_version') or None
+        idempotency_key = request.POST.get('idempotency_key')
+        raw_lines = []
+        index = 0
+        while f'item_id_{index}' in request.POST:
+            raw_lines.append((request.POST.get(f'item_id_{index}'), request.POST.get(f'item_quantity_{index}')))
+            index += 1
+
+    if not table_number:
+        raise ValueError("Missing table number")
+    check_table_number(table_number)
+    idempotency_key = request.headers.get('Idempotency-Key') or idempotency_key or None
+    if idempotency_key is not None and not (
+        isinstance(idempotency_key, str) and IDEMPOTENCY_KEY.fullmatch(idempotency_key)
+    ):
+        raise ValueError("Idempotency key must be 1 to 64 printable ASCII characters")
+    if menu_version_id is not None:
+        try:
+            menu_version_id = int(menu_version_id)
+        except (TypeError, ValueError):
+            raise ValueError("menu_version must be an integer")
+
+    lines = []
+    for item_id, quantity in raw_lines:
+        try:
+            item_id, quantity = int(item_id), int(quantity)
+        except (TypeError, ValueError):
+            raise ValueError("Item id and quantity must be integers")
+        if not 1 <= quantity <= MAX_ITEM_QUANTITY:
+            raise ValueError(f"Quantity must be between 1 and {MAX_ITEM_QUANTITY}")
+        lines.append((item_id, quantity))
+
+    if not lines:
+        raise ValueError("Order has no items")
+
+    return table_number, special_instructions, lines, menu_version_id, idempotency_key
+
+
+def _version_lines(snapshot, lines):
+    """(owner id, lines) priced from a published menu version's snapshot; unknown items are skipped."""
+    if snapshot is None:
+        raise ValueError("This menu is no longer available, please reload the page")
+    prices = {
+        item['id']: Decimal(item['price'])
+        for category in snapshot['categories']
+        for item in category['items']
+    }
+    # Unsaved stand-ins carrying the id and the price the guest saw
+    return snapshot['menu']['owner_id'], [
+        (MenuItem(id=item_id, price=prices[item_id]), quantity)
+        for item_id, quantity in lines if item_id in prices
+    ]
+
+
+def _check_superseded(superseded_at):
+    """Refuse a version replaced longer ago than MENU_VERSION_GRACE_HOURS."""
+    grace = timedelta(hours=settings.MENU_VERSION_GRACE_HOURS)
+    if superseded_at is not None and superseded_at < timezone.now() - grace:
+        raise ValueError("This menu is no longer available, please reload the page")
+
+
+def _live_items():
+    return MenuItem.objects.filter(active=True).annotate(owner_id=F('category__menu__user_id'))
+
+
+def _owner_lines(menu_items, lines):
+    """(owner id, lines) of the items found; unknown or inactive items are skipped."""
+    lines = [(menu_items[item_id], quantity) for item_id, quantity in lines if item_id in menu_items]
+    owners = {item.owner_id for item, _ in lines}
+    if len(owners) > 1:
+        raise ValueError("Items from different restaurants cannot be ordered together")
+    return (owners.pop() if owners else None), lines
+
+
+def _live_lines(lines):
+    """(owner id, lines) priced from the current menu items (one query)."""
+    return _owner_lines(_live_items().in_bulk([item_id for item_id, _ in lines]), lines)
+
+
+def find_order(idempotency_key):
+    """The order placed with an idempotency key, with its table, or None."""
+    return Order.objects.select_related('table').filter(idempotency_key=idempotency_key).first()
+
+
+async def afind_order(idempotency_key):
+    """Async find_order."""
+    return await Order.objects.select_related('table').filter(idempotency_key=idempotency_key).afirst()
+
+
+def _write_order(owner_id, table_number, lines, user, special_instructions, menu_version_id, idempotency_key=None):
+    """
+    Insert the order, its lines and the sales deltas in one transaction.
+
+    If another request with the same idempotency key commits first, the
+    unique index rejects this order, the transaction rolls back (no lines,
+    sales or event) and that request's order is returned instead. Raises
+    ValueError if the total does not fit Order.total_amount.
+    """
+    subtotal = sum(item.price * quantity for item, quantity in lines)
+    tax_rate = Decimal(str(settings.ORDER_TAX_RATE))
+    total = (subtotal * (1 + tax_rate)).quantize(Decimal('0.01'))
+    if total > MAX_ORDER_TOTAL:
+        raise ValueError("Order total is too large")
+
+    try:
+        with transaction.atomic():
+            table, created = Table.objects.get_or_create(
+                user_id=owner_id,
+                table_number=table_number,
+                defaults={'active': True}
+            )
+            order = Order.objects.create(
+                table=table,
+                owner_id=owner_id,
+                user=user,
+                total_amount=total,
+                special_instructions=special_instructions,
+                menu_version_id=menu_version_id,
+                idempotency_key=idempotency_key,
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, item=item, quantity=quantity, price=item.price)
+                for item, quantity in lines
+            ])
+            apply_sales_deltas(order_sales_deltas(order, lines))
+            publish_on_commit(order_event('order.created', order, sum(quantity for _, quantity in lines)))
+    except IntegrityError:
+        existing = find_order(idempotency_key) if idempotency_key is not None else None
+        if existing is None:
+            raise
+        return existing
+
+    return order
+
+
+def create_order(table_number, lines, user=None, special_instructions='', menu_version_id=None, idempotency_key=None):
+    """
+    Create an order and its line items in one transaction.
+
+    With a menu_version_id, items and prices come from that published
+    version, the menu the guest was shown, usually without any query; a
+    version replaced more than MENU_VERSION_GRACE_HOURS ago is refused.
+    Without one, all menu items are fetched with a single id__in query and
+    the order is tied to the restaurant's current version. Either way prices and the
+    total never come from the client, and unknown items are skipped. The
+    lines are inserted with one bulk_create. The table belongs to the
+    restaurant owning the menu, so it is looked up by (owner, table number),
+    which is unique. The sales rollup is updated in the same transaction.
+
+    With an idempotency_key already used, the order placed with it is
+    returned before any item is looked up, so retries never add an order.
+
+    Raises ValueError if none of the items can be ordered.
+    """
+    if idempotency_key is not None:
+        existing = find_order(idempotency_key)
+        if existing is not None:
+            return existing
+    if menu_version_id is not None:
+        owner_id, lines = _version_lines(get_menu_version(menu_version_id), lines)
+        if (get_tenant_menu(owner_id)['menu'] or {}).get('version_id') != menu_version_id:
+            _check_superseded(version_superseded_at(menu_version_id))
+    else:
+        owner_id, lines = _live_lines(lines)
+    if not lines:
+        raise ValueError("None of the ordered items are available")
+    if menu_version_id is None:
+        menu_version_id = (get_tenant_menu(owner_id)['menu'] or {}).get('version_id')
+    return _write_order(owner_id, table_number, lines, user, special_instructions, menu_version_id, idempotency_key)
+
+
+async def acreate_order(table_number, lines, user=None, special_instructions='', menu_version_id=None,
+                        idempotency_key=None):
+    """
+    Async create_order.
+
+    Pricing reads the version through the async cache and ORM APIs. The
+    async ORM has no transactions, so the writes run as a single sync call
+    on a worker thread.
+    """
+    if idempotency_key is not None:
+        existing = await afind_order(idempotency_key)
+        if existing is not None:
+            return existing
+    if menu_version_id is not None:
+        owner_id, lines = _version_lines(await aget_menu_version(menu_version_id), lines)
+        if ((await aget_tenant_menu(owner_id))['menu'] or {}).get('version_id') != menu_version_id:
+            _check_superseded(await aversion_superseded_at(menu_version_id))
+    else:
+        owner_id, lines = _owner_lines(await _live_items().ain_bulk([item_id for item_id, _ in lines]), lines)
+    if not lines:
+        raise ValueError("None of the ordered items are available")
+    if menu_version_id is None:
+        menu_version_id = ((await aget_tenant_menu(owner_id))['menu'] or {}).get('version_id')
+    return await sync_to_async(_write_order)(
+        owner_id, table_number, lines, user, special_instructions, menu_version_id, idempotency_key,
+    )
+
+
+def transition_orders(order_ids, status, from_status='pending', owner=None):
+    """
+    Move orders from `from_status` to `status` with one conditional UPDATE.
+
+    The UPDATE only matches rows still in `from_status`, so when several
+    tablets act on the same order at once exactly one of them wins and no
+    row locks are taken. Returns (updated, conflicts, missing): the orders
+    this call changed, the orders found in another status (with their
+    current state) and the ids that do not exist. With an owner, only that
+    restaurant's orders are touched and the others' ids count as missing.
+
+    Raises ValueError if the transition is not allowed.
+    """
+    if status not in ORDER_TRANSITIONS.get(from_status, ()):
+        raise ValueError(f"Cannot change an order from '{from_status}' to '{status}'")
+
+    scope = Q(id__in=order_ids)
+    if owner is not None:
+        # On the order itself, not through a join: backends that cannot
+        # UPDATE from a join (MySQL) would otherwise select the ids first and
+        # drop the status condition from the UPDATE itself
+        scope &= Q(owner=owner)
+    now = timezone.now()
+    with transaction.atomic():
+        count = Order.objects.filter(scope, status=from_status).update(status=status, updated_at=now)
+
+        # Rows carrying this call's timestamp and status are the ones it updated
+        orders = {order.id: order for order in order_summary_queryset().filter(scope)}
+        updated, conflicts = [], []
+        for order in orders.values():
+            if count and order.status == status and order.updated_at == now:
+                updated.append(order)
+            else:
+                conflicts.append(order)
+        missing = [order_id for order_id in order_ids if order_id not in orders]
+
+        # Cancelled orders no longer count towards sales
+        if status == 'cancelled' and updated:
+            apply_sales_deltas(cancelled_sales_deltas([order.id for order in updated]))
+
+    for order in updated:
+        publish_on_commit(order_event('order.updated', order, order.total_items))
+
+    return updated, conflicts, missing
+
+
+def serialize_order_status(order):
+    """Status of an order as returned by the transition API."""
+    return {
+        'id': order.id,
+        'status': order.status,
+        'updated_at': order.updated_at.isoformat(),
+    }
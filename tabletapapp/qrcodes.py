@@ -0,0 +1,173 @@
+# tabletapapp/qrcodes.py
+"""
+Server-side QR codes for table pages.
+
+Each code is a PNG rendered with segno and cached on disk under
+QR_CACHE_DIR, named by a hash of the table and the URL it encodes, so a
+code is only drawn again when its URL changes. Batches of codes are
+rendered on a small thread pool and can be packed into a printable PDF
+sheet (drawn with Pillow) or a ZIP of PNGs. Nothing is loaded from a CDN.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.urls import reverse
+
+import segno
+from PIL import Image, ImageDraw, ImageFont
+
+from .models import Table
+
+QR_FORMATS = ('pdf', 'zip')
+MAX_TABLES_PER_BATCH = 500
+TABLE_NUMBER_MAX_LENGTH = Table._meta.get_field('table_number').max_length
+
+# Pixels per QR module in the cached PNGs, and quiet-zone width in modules
+QR_SCALE = 8
+QR_BORDER = 4
+
+# Printable sheet: A4 at 150 dpi, three columns by four rows of codes
+SHEET_DPI = 150
+SHEET_SIZE = (1240, 1754)
+SHEET_COLUMNS, SHEET_ROWS = 3, 4
+SHEET_CODE_SIZE = 320
+
+
+def table_url(base_url, owner_id, table_number):
+    """Absolute URL of a restaurant's table page, as encoded in its QR code."""
+    path = reverse('restaurant_table_view', args=[owner_id, table_number])
+    return base_url.rstrip('/') + path
+
+
+def check_table_number(table_number):
+    """Raise ValueError if a table number does not fit Table.table_number."""
+    if len(table_number) > TABLE_NUMBER_MAX_LENGTH:
+        raise ValueError(f"Table numbers are at most {TABLE_NUMBER_MAX_LENGTH} characters")
+
+
+def parse_qr_params(params):
+    """
+    Read the start/end table numbers and the format of a batch request.
+
+    Returns (table numbers as strings, format). Raises ValueError with a
+    readable message on malformed input.
+    """
+    try:
+        start, end = int(params.get('start', '')), int(params.get('end', ''))
+    except ValueError:
+        raise ValueError("start and end must be table numbers")
+    if start < 1 or end < start:
+        raise ValueError("Expected 1 <= start <= end")
+    if end - start + 1 > MAX_TABLES_PER_BATCH:
+        raise ValueError(f"At most {MAX_TABLES_PER_BATCH} tables per batch")
+    check_table_number(str(end))
+
+    export_format = params.get('format') or 'pdf'
+    if export_format not in QR_FORMATS:
+        raise ValueError(f"Unknown format '{export_format}', expected one of {', '.join(QR_FORMATS)}")
+    return [str(number) for number in range(start, end + 1)], export_format
+
+
+def ensure_tables(owner_id, table_numbers, base_url):
+    """
+    Create the restaurant's missing tables and store the URL each QR code encodes.
+
+    Returns (table number, URL) pairs in the given order; three queries
+    whatever the number of tables.
+    """
+    Table.objects.bulk_create(
+        [Table(user_id=owner_id, table_number=number, active=True) for number in table_numbers],
+        ignore_conflicts=True,
+    )
+    tables = Table.objects.filter(user_id=owner_id, table_number__in=table_numbers)
+    changed = []
+    for table in tables:
+        url = table_url(base_url, owner_id, table.table_number)
+        if table.qr_code_url != url:
+            table.qr_code_url = url
+            changed.append(table)
+    Table.objects.bulk_update(changed, ['qr_code_url'])
+    return [(number, table_url(base_url, owner_id, number)) for number in table_numbers]
+
+
+def qr_png(table_number, url):
+    """PNG bytes of the QR code for a table's URL, drawn once and then read from disk."""
+    key = hashlib.sha256(f"{table_number}\n{url}\n{QR_SCALE}\n{QR_BORDER}".encode('utf-8')).hexdigest()
+    path = os.path.join(settings.QR_CACHE_DIR, key[:2], f"{key}.png")
+    try:
+        with open(path, 'rb') as cached:
+            return cached.read()
+    except FileNotFoundError:
+        pass
+
+    buffer = io.BytesIO()
+    segno.make(url, error='h', micro=False).save(buffer, kind='png', scale=QR_SCALE, border=QR_BORDER)
+    content = buffer.getvalue()
+
+    # Write to a temporary file first so concurrent readers never see half a PNG
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(content)
+    os.replace(tmp_path, path)
+    return content
+
+
+def render_zip(codes):
+    """ZIP archive of (table number, PNG bytes) pairs, one table-<n>.png each."""
+    buffer = io.BytesIO()
+    # PNGs are already compressed
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for table_number, png in codes:
+            archive.writestr(f"table-{table_number}.png", png)
+    return buffer.getvalue()
+
+
+def render_sheet(codes):
+    """Printable A4 PDF with the labelled codes of (table number, PNG bytes) pairs."""
+    font = ImageFont.load_default(size=32)
+    cell_width = SHEET_SIZE[0] // SHEET_COLUMNS
+    cell_height = SHEET_SIZE[1] // SHEET_ROWS
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+
+    pages = []
+    for page_start in range(0, len(codes), per_page):
+        page = Image.new('L', SHEET_SIZE, 255)
+        draw = ImageDraw.Draw(page)
+        for index, (table_number, png) in enumerate(codes[page_start:page_start + per_page]):
+            left = (index % SHEET_COLUMNS) * cell_width
+            top = (index // SHEET_COLUMNS) * cell_height
+            with Image.open(io.BytesIO(png)) as code:
+                # Nearest-neighbour keeps the modules sharp
+                code = code.convert('L').resize((SHEET_CODE_SIZE, SHEET_CODE_SIZE), Image.Resampling.NEAREST)
+            page.paste(code, (left + (cell_width - SHEET_CODE_SIZE) // 2, top + 20))
+            draw.text(
+                (left + cell_width // 2, top + SHEET_CODE_SIZE + 45),
+                f"Table {table_number}", fill=0, font=font, anchor='mm',
+            )
+        # Black and white pages keep a 200-table sheet small
+        pages.append(page.convert('1', dither=Image.Dither.NONE))
+
+    buffer = io.BytesIO()
+    pages[0].save(buffer, 'PDF', save_all=True, append_images=pages[1:], resolution=SHEET_DPI)
+    return buffer.getvalue()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_qr_pool():
+    """The process-wide pool drawing codes and sheets, created on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.QR_WORKERS, thread_name_prefix='qr-code')
+    return _executor
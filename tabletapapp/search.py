@@ -0,0 +1,128 @@
+# tabletapapp/search.py
+"""
+Menu item search over item names, descriptions and category names.
+
+Every word of the query is matched as a prefix ("carb" finds "Carbonara"),
+and all of them must appear in the item's name and description or all in
+its category's name. The match runs against a full-text index created by
+migration 0010: InnoDB FULLTEXT on MySQL, an FTS5 table on SQLite.
+Neither needs any work from the application when items are saved. Other
+databases fall back to icontains lookups.
+
+MySQL ignores words shorter than innodb_ft_min_token_size (3 by default)
+and its stopwords.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import MenuItem
+
+MAX_SEARCH_TERMS = 8
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+ACTIVE_FILTERS = ('true', 'false', 'all')
+
+_WORD = re.compile(r'\w+')
+
+
+def search_terms(query):
+    """The words of a query, lowercased; punctuation never reaches the match syntax."""
+    return _WORD.findall(query.lower())[:MAX_SEARCH_TERMS]
+
+
+def parse_search_params(params):
+    """
+    Read q, menu_id, active (true, false or all) and limit.
+
+    Returns (terms, menu id or None, active filter, limit). Raises
+    ValueError on malformed input.
+    """
+    terms = search_terms(params.get('q', ''))
+    if not terms:
+        raise ValueError("q must contain at least one word")
+
+    menu_id = params.get('menu_id') or None
+    if menu_id is not None:
+        try:
+            menu_id = int(menu_id)
+        except ValueError:
+            raise ValueError("menu_id must be an integer")
+
+    active = params.get('active') or 'true'
+    if active not in ACTIVE_FILTERS:
+        raise ValueError(f"Unknown active '{active}', expected one of {', '.join(ACTIVE_FILTERS)}")
+
+    try:
+        limit = int(params.get('limit') or DEFAULT_SEARCH_LIMIT)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_SEARCH_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+    return terms, menu_id, active, limit
+
+
+def _match(terms):
+    """Q object selecting the items that match every term."""
+    if connection.vendor == 'mysql':
+        boolean = ' '.join(f'+{term}*' for term in terms)
+        return Q(id__in=RawSQL(
+            "SELECT id FROM tabletapapp_menuitem WHERE MATCH(name, description) AGAINST (%s IN BOOLEAN MODE)",
+            [boolean],
+        )) | Q(category_id__in=RawSQL(
+            "SELECT id FROM tabletapapp_menucategory WHERE MATCH(name) AGAINST (%s IN BOOLEAN MODE)",
+            [boolean],
+        ))
+
+    if connection.vendor == 'sqlite':
+        phrases = ' '.join(f'"{term}"*' for term in terms)
+        return Q(id__in=RawSQL(
+            "SELECT rowid FROM tabletapapp_menuitem_fts WHERE tabletapapp_menuitem_fts MATCH %s",
+            [f'{{name description}} : ({phrases}) OR category : ({phrases})'],
+        ))
+
+    return icontains_match(terms)
+
+
+def icontains_match(terms):
+    """The same selection with icontains lookups: no index needed, a scan of every item."""
+    item, category = Q(), Q()
+    for term in terms:
+        item &= Q(name__icontains=term) | Q(description__icontains=term)
+        category &= Q(category__name__icontains=term)
+    return item | category
+
+
+def search_items(terms, owner=None, menu_id=None, active='true', limit=DEFAULT_SEARCH_LIMIT, full_text=True):
+    """
+    Items matching the terms, optionally limited to one owner's menus, one
+    menu and active or inactive items, ordered by name. One query.
+    full_text=False uses icontains instead of the index (for comparisons).
+    """
+    match = _match(terms) if full_text else icontains_match(terms)
+    items = MenuItem.objects.filter(match).select_related('category__menu')
+    if owner is not None:
+        items = items.filter(category__menu__user=owner)
+    if menu_id is not None:
+        items = items.filter(category__menu_id=menu_id)
+    # An item is only on the menu while its category is too and the menu is not archived
+    if active == 'true':
+        items = items.filter(active=True, category__active=True, category__menu__archived=False)
+    elif active == 'false':
+        items = items.filter(Q(active=False) | Q(category__active=False) | Q(category__menu__archived=True))
+    return list(items.order_by('name', 'id')[:limit])
+
+
+def serialize_search_result(item):
+    category, menu = item.category, item.category.menu
+    return {
+        'id': item.id,
+        'name': item.name,
+        'description': item.description or '',
+        'price': float(item.price),
+        'active': item.active and category.active,
+        'category': {'id': category.id, 'name': category.name},
+        'menu': {'id': menu.id, 'name': menu.name, 'owner_id': menu.user_id},
+    }
@@ -0,0 +1,92 @@
+# tabletapapp/subscribers.py
+"""
+Subscriber list of the admin page.
+
+Searches are prefix matches on username and email, which the unique
+indexes on both columns serve on MySQL, instead of infix icontains scans.
+Pages are keyed on id rather than OFFSET, and the total shown is an
+estimate, so no page ever runs COUNT(*) over the whole table. Each user
+comes with their menu count and last order time, computed by subqueries
+in the same query.
+"""
+from django.db import connection
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import CustomUser, Menu, Order
+
+SUBSCRIBER_PAGE_SIZE = 5
+
+# Matching users are counted up to this many; larger totals show as "1000+"
+SUBSCRIBER_COUNT_CAP = 1000
+
+
+def search_subscribers(search=''):
+    """Users whose username or email starts with the search text (all users if it is empty)."""
+    users = CustomUser.objects.all()
+    search = search.strip()
+    if search:
+        users = users.filter(Q(username__istartswith=search) | Q(email__istartswith=search))
+    return users
+
+
+def with_subscriber_stats(users):
+    """Annotate menu_count (menus not archived) and last_order_at (of the user's restaurant)."""
+    menu_count = (
+        Menu.objects
+        .filter(user=OuterRef('pk'), archived=False)
+        .order_by()
+        .values('user')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    last_order = (
+        Order.objects
+        .filter(table__user=OuterRef('pk'))
+        .order_by('-created_at')
+        .values('created_at')[:1]
+    )
+    return users.annotate(
+        menu_count=Coalesce(Subquery(menu_count, output_field=IntegerField()), 0),
+        last_order_at=Subquery(last_order),
+    )
+
+
+def get_subscriber_page(search='', after=None, limit=SUBSCRIBER_PAGE_SIZE):
+    """
+    Return one page of users in id order, with their stats, and the id to continue after.
+
+    One query, however deep the page.
+    """
+    users = with_subscriber_stats(search_subscribers(search))
+    if after is not None:
+        users = users.filter(id__gt=after)
+    users = list(users.order_by('id')[:limit + 1])
+
+    next_after = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_after = users[-1].id
+    return users, next_after
+
+
+def estimate_subscribers(search=''):
+    """
+    Return (number of matching users, whether it is exact).
+
+    Without a search, MySQL's table statistics give an estimate for free.
+    Searches are counted exactly up to SUBSCRIBER_COUNT_CAP.
+    """
+    if not search.strip() and connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s",
+                [CustomUser._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] is not None:
+            return row[0], False
+
+    count = search_subscribers(search)[:SUBSCRIBER_COUNT_CAP + 1].count()
+    return min(count, SUBSCRIBER_COUNT_CAP), count <= SUBSCRIBER_COUNT_CAP
@@ -1,3 +1,1480 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import importlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import segno
+from asgiref.sync import sync_to_async
+from PIL import Image
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .ai import get_generator as get_description_generator, reset_generator
+from .analytics import rebuild_sales
+from .benchmarks import (
+    ENDPOINTS, count_queries, percentile, process_tree_rss, run_in_process, seed_menu, seed_order_history, seed_tenants,
+    tenant_fixture,
+)
+from .events import InMemoryOrderEvents, get_backend as get_event_backend
+from .exports import aiter_export, iter_orders
+from .images import menus_showing, render_variants
+from .menu_cache import (
+    PUBLISHED_MENU_KEY, TENANT_MENU_KEY, aget_tenant_menu, cache_stats, clear_local_menus, collect_menu_versions,
+    get_tenant_menu, publish_menu_on_commit, rebuild_published_menu, rebuild_tenant_menu,
+)
+from .metrics import QueryRecorder, metrics_summary, record, reset_metrics, sql_shape
+from .models import (
+    CustomUser, DailySales, Menu, MenuCategory, MenuImage, MenuItem, MenuVersion, Order, OrderItem, Table,
+)
+from .orders import (
+    ORDER_PAGE_SIZE, _write_order, acreate_order, changed_orders_queryset, create_order, decode_cursor,
+    get_order_page, order_page_queryset, transition_orders,
+)
+from .subscribers import get_subscriber_page
+
+
+class OrderBoardTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.client.force_login(self.user)
+        seed_order_history(20, user=self.user)
+        _, small = count_queries(self.client_get_board)
+        seed_order_history(400, user=self.user)
+        _, large = count_queries(self.client_get_board)
+        self.assertEqual(small, large)
+
+    def client_get_board(self):
+        response = self.client.get(reverse('order'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_keyset_pages_cover_history_once(self):
+        seed_order_history(ORDER_PAGE_SIZE * 2 + 5, user=self.user)
+        seen = []
+        before = None
+        while True:
+            orders, next_cursor = get_order_page(before=before)
+            seen.extend(order.id for order in orders)
+            if not next_cursor:
+                break
+            before = decode_cursor(next_cursor)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(sorted(seen), sorted(Order.objects.values_list('id', flat=True)))
+
+    def test_status_filter_and_total_items(self):
+        seed_order_history(30, user=self.user, items_per_order=2)
+        orders, _ = get_order_page(status='pending')
+        self.assertTrue(all(order.status == 'pending' for order in orders))
+        for order in orders:
+            self.assertEqual(order.total_items, sum(i.quantity for i in order.orderitem_set.all()))
+
+    def test_invalid_cursor_is_rejected(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('order'), {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_board_lists_only_the_users_restaurant(self):
+        other = CustomUser.objects.create_user(email='other@example.com', username='other', password='secret')
+        seed_order_history(3, user=self.user)
+        seed_order_history(4, user=other)
+        self.client.force_login(other)
+        ids = {order['id'] for order in self.client_get_board().context['orders']}
+        self.assertEqual(ids, set(Order.objects.filter(table__user=other).values_list('id', flat=True)))
+
+    @skipUnless(connection.vendor == 'sqlite', "reads SQLite's plan output")
+    def test_restaurant_boards_read_the_owner_index(self):
+        for queryset in (order_page_queryset(owner=self.user), changed_orders_queryset(owner=self.user)):
+            plan = queryset[:ORDER_PAGE_SIZE + 1].explain()
+            self.assertIn('order_owner_updated_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class PublishedMenuTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+
+    def test_guest_page_runs_no_queries_once_cached(self):
+        seed_menu(self.user, categories=3, items_per_category=5)
+        self.client.get(reverse('table_view', args=[1]))
+        response, queries = count_queries(self.client.get, reverse('table_view', args=[1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+        self.assertContains(response, 'Category 2 item 4')
+
+    def test_menu_update_invalidates_snapshot(self):
+        menu = seed_menu(self.user)
+        self.client.get(reverse('table_view', args=[1]))
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                reverse('update_menu', args=[menu.id]),
+                json.dumps({'name': 'Dinner'}),
+                content_type='application/json',
+            )
+        self.assertContains(self.client.get(reverse('table_view', args=[1])), 'Dinner')
+
+    def test_a_rebuild_after_a_miss_never_overwrites_a_newer_snapshot(self):
+        seed_menu(self.user)
+        newer = {'menu': {'version_id': 'newer'}, 'categories': []}
+        cache.set(PUBLISHED_MENU_KEY, newer, timeout=None)
+        self.assertEqual(rebuild_published_menu(), newer)
+        self.assertNotEqual(rebuild_published_menu(replace=True), newer)
+        self.assertNotEqual(cache.get(PUBLISHED_MENU_KEY), newer)
+
+    def test_missing_active_menu(self):
+        Menu.objects.create(user=self.user, name='Old', active=False)
+        response = self.client.get(reverse('table_view', args=[1]))
+        self.assertEqual(response.status_code, 400)
+        self.assertGreaterEqual(cache_stats()['misses'], 1)
+
+
+class SaveMenuDataTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.client.force_login(self.user)
+        self.menu = Menu.objects.create(user=self.user, name='Lunch')
+
+    def save(self, data):
+        response = self.client.post(
+            reverse('save_menu_data', args=[self.menu.id]),
+            json.dumps({'data': data}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_resave_touches_nothing(self):
+        first = self.save({
+            'Mains': [{'name': 'Steak', 'price': 25, 'description': 'Grilled'}],
+            'Drinks': [{'name': 'Coffee', 'price': 3.5}],
+        })
+        self.assertEqual(first['inserted'], 4)
+        second = self.save(first['data'])
+        self.assertEqual((second['inserted'], second['updated'], second['deactivated']), (0, 0, 0))
+
+    def test_diff_counts(self):
+        data = self.save({
+            'Mains': [{'name': 'Steak', 'price': 25}, {'name': 'Fish', 'price': 20}],
+            'Drinks': [{'name': 'Coffee', 'price': 3.5}],
+        })['data']
+        data['Mains'][0]['price'] = 27
+        del data['Drinks']
+        result = self.save(data)
+        # Steak repriced; Drinks and Coffee deactivated
+        self.assertEqual((result['inserted'], result['updated'], result['deactivated']), (0, 1, 2))
+        self.assertEqual(list(result['data']), ['Mains'])
+        self.assertEqual(result['data']['Mains'][0]['price'], 27.0)
+
+    def test_large_menu_is_saved_in_bulk(self):
+        large = {f'Cat {c}': [{'name': f'Dish {c}-{i}', 'price': i} for i in range(30)] for c in range(10)}
+        result, queries = count_queries(self.save, large)
+        self.assertEqual(result['inserted'], 310)
+        # Per-row saves would need 600+ queries; bulk writes only split into batches
+        self.assertLess(queries, 30)
+
+    def test_invalid_price(self):
+        response = self.client.post(
+            reverse('save_menu_data', args=[self.menu.id]),
+            json.dumps({'data': {'Mains': [{'name': 'Steak', 'price': 'abc'}]}}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class SubmitOrderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_menus()
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.menu = seed_menu(self.user, categories=2, items_per_category=10)
+        self.items = list(MenuItem.objects.filter(category__menu=self.menu).order_by('id'))
+
+    def test_json_order_is_priced_server_side(self):
+        payload = {
+            'table': '7',
+            'total_price': '0.01',
+            'items': [{'id': item.id, 'quantity': 2} for item in self.items[:15]],
+        }
+        # Normally published long before the first order
+        get_tenant_menu(self.user.id)
+        response, queries = count_queries(
+            self.client.post, reverse('submit_order'), json.dumps(payload), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        # Down from ~32 with per-line lookups; savepoints make up several of
+        # these and three keep the sales rollup up to date
+        self.assertLessEqual(queries, 13)
+        order = Order.objects.get(id=response.json()['order_id'])
+        subtotal = sum(item.price * 2 for item in self.items[:15])
+        self.assertEqual(order.total_amount, (subtotal * Decimal('1.10')).quantize(Decimal('0.01')))
+        self.assertEqual(order.orderitem_set.count(), 15)
+
+    def test_form_fields_still_accepted(self):
+        item = self.items[0]
+        response = self.client.post(reverse('submit_order'), {
+            'table': '3',
+            'total_price': '999',
+            'item_id_0': item.id, 'item_name_0': item.name, 'item_quantity_0': 1, 'item_price_0': '0.01',
+        }, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(OrderItem.objects.get().price, item.price)
+
+    def test_tables_belong_to_the_menu_owner(self):
+        for _ in range(2):
+            self.client.post(
+                reverse('submit_order'),
+                json.dumps({'table': '5', 'items': [{'id': self.items[0].id, 'quantity': 1}]}),
+                content_type='application/json',
+            )
+        table = Table.objects.get()
+        self.assertEqual((table.user, table.table_number), (self.user, '5'))
+        self.assertEqual(table.order_set.filter(owner=self.user).count(), 2)
+
+    def test_values_that_do_not_fit_the_columns_are_rejected(self):
+        def submit(table, item, quantity):
+            return self.client.post(
+                reverse('submit_order'),
+                json.dumps({'table': table, 'items': [{'id': item.id, 'quantity': quantity}]}),
+                content_type='application/json',
+            )
+
+        self.assertEqual(submit('7' * 21, self.items[0], 1).status_code, 400)
+        self.assertEqual(submit('7', self.items[0], 10 ** 12).status_code, 400)
+        MenuItem.objects.filter(id=self.items[1].id).update(price=Decimal('99999999.00'))
+        self.assertEqual(submit('7', self.items[1], 2).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_inactive_items_are_rejected(self):
+        MenuItem.objects.filter(id=self.items[0].id).update(active=False)
+        response = self.client.post(
+            reverse('submit_order'),
+            json.dumps({'table': '1', 'items': [{'id': self.items[0].id, 'quantity': 1}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_retries_with_the_same_key_return_the_first_order(self):
+        payload = json.dumps({'table': '2', 'items': [{'id': self.items[0].id, 'quantity': 3}]})
+        first = self.client.post(
+            reverse('submit_order'), payload, content_type='application/json', HTTP_IDEMPOTENCY_KEY='tap-1',
+        )
+        retry, queries = count_queries(
+            self.client.post, reverse('submit_order'), payload,
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY='tap-1',
+        )
+        self.assertEqual(retry.json()['order_id'], first.json()['order_id'])
+        # The key lookup only: no items, no writes
+        self.assertEqual(queries, 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(DailySales.objects.get().quantity, 3)
+
+        form = {'table': '2', 'item_id_0': self.items[1].id, 'item_quantity_0': 1, 'idempotency_key': 'tap-2'}
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('submit_order'), form, HTTP_ACCEPT='text/html').status_code, 302)
+        self.assertEqual(Order.objects.filter(idempotency_key='tap-2').count(), 1)
+
+        response = self.client.post(
+            reverse('submit_order'), payload, content_type='application/json', HTTP_IDEMPOTENCY_KEY='x' * 65,
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_duplicate_gets_the_committed_order(self):
+        first = create_order('2', [(self.items[0].id, 1)], idempotency_key='race')
+        # The losing request already priced its lines when the insert hits the unique index
+        order = _write_order(self.user.id, '2', [(self.items[0], 1)], None, '', None, 'race')
+        self.assertEqual(order.id, first.id)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.assertEqual(DailySales.objects.get().quantity, 1)
+
+
+class OrderEventTests(TestCase):
+    def test_subscribers_receive_events_published_from_other_threads(self):
+        backend = InMemoryOrderEvents()
+
+        async def listen():
+            stream = backend.subscribe(heartbeat=5)
+            first = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0)
+            await asyncio.to_thread(backend.publish, {'type': 'order.created', 'order': {'id': 1}})
+            event = await first
+            await stream.aclose()
+            return event
+
+        self.assertEqual(asyncio.run(listen())['order']['id'], 1)
+        self.assertEqual(backend.subscriber_count(), 0)
+
+    def test_submitted_orders_are_published_after_commit(self):
+        user = CustomUser.objects.create_user(email='owner@example.com', username='owner')
+        seed_menu(user)
+        item = MenuItem.objects.first()
+        published = []
+        with mock.patch.object(get_event_backend(), 'publish', published.append):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    reverse('submit_order'),
+                    json.dumps({'table': '2', 'items': [{'id': item.id, 'quantity': 3}]}),
+                    content_type='application/json',
+                )
+        self.assertEqual(published[0]['type'], 'order.created')
+        self.assertEqual(published[0]['order']['total_items'], 3)
+        self.assertEqual(published[0]['order']['table_number'], '2')
+        self.assertEqual(published[0]['owner_id'], user.id)
+
+    def test_stream_is_not_served_under_wsgi(self):
+        user = CustomUser.objects.create_user(email='owner@example.com', username='owner')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('order_stream')).status_code, 204)
+
+    async def test_boards_only_receive_their_restaurants_orders(self):
+        user = await CustomUser.objects.acreate(email='owner@example.com', username='owner')
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get(reverse('order_stream'))
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 3000\n\n')
+
+        backend = get_event_backend()
+        pending = asyncio.ensure_future(anext(chunks))
+        while not backend.subscriber_count():
+            await asyncio.sleep(0)
+        for owner_id, order_id in ((user.id + 1, 1), (user.id, 2)):
+            backend.publish({'type': 'order.created', 'owner_id': owner_id, 'order': {'id': order_id}})
+        self.assertEqual(await pending, b'event: order.created\ndata: {"id": 2}\n\n')
+        await response.streaming_content.aclose()
+
+
+class _StubCompletionHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the chat completions endpoint."""
+    delay = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(body)
+        time.sleep(self.delay)
+        prompt = body['messages'][-1]['content'].split('\n', 1)[1]
+        payload = json.dumps({
+            'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': f' Delicious {prompt}. '}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class GenerateMenuTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubCompletionHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        base_url = f'http://127.0.0.1:{self.server.server_port}/v1'
+        settings_override = self.settings(OPENAI_API_KEY='test', OPENAI_BASE_URL=base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_generator()
+        self.addCleanup(reset_generator)
+        self.user = CustomUser.objects.create_user(email='chef@example.com', username='chef', password='pw')
+        self.client.force_login(self.user)
+
+    def generate(self, payload):
+        return self.client.post(reverse('generate_menu'), json.dumps(payload), content_type='application/json')
+
+    def test_results_are_cached_by_normalized_description(self):
+        first = self.generate({'description': 'Grilled  Steak'})
+        self.assertEqual(first.json(), {'menu': 'Delicious Grilled  Steak.'})
+        second = self.generate({'description': 'grilled steak '})
+        self.assertEqual(second.json()['menu'], 'Delicious Grilled  Steak.')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_identical_inflight_requests_are_coalesced(self):
+        _StubCompletionHandler.delay = 0.2
+        self.addCleanup(setattr, _StubCompletionHandler, 'delay', 0)
+        generator = get_description_generator()
+        futures = [generator.submit('Cheesecake') for _ in range(5)]
+        self.assertEqual({f.result(timeout=5) for f in futures}, {'Delicious Cheesecake.'})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_batch_generation(self):
+        response = self.generate({'descriptions': ['Coffee', 'Tea', 'coffee']})
+        self.assertEqual(
+            [entry['menu'] for entry in response.json()['menus']],
+            ['Delicious Coffee.', 'Delicious Tea.', 'Delicious Coffee.'],
+        )
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_missing_description(self):
+        self.assertEqual(self.generate({'description': ''}).status_code, 400)
+
+    def test_generation_needs_a_login_and_a_csrf_token(self):
+        self.client.logout()
+        self.assertEqual(self.generate({'description': 'Steak'}).status_code, 302)
+        csrf_client = self.client_class(enforce_csrf_checks=True)
+        csrf_client.force_login(self.user)
+        response = csrf_client.post(
+            reverse('generate_menu'), json.dumps({'description': 'Steak'}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.server.requests, [])
+
+    @override_settings(AI_MAX_CONCURRENCY=1)
+    async def test_a_disconnected_client_does_not_fail_the_others(self):
+        reset_generator()
+        _StubCompletionHandler.delay = 0.3
+        self.addCleanup(setattr, _StubCompletionHandler, 'delay', 0)
+        await self.async_client.aforce_login(self.user)
+        # Keep the only worker busy so that the shared job is still queued
+        busy = get_description_generator().submit('Blocker')
+
+        def post():
+            return asyncio.ensure_future(self.async_client.post(
+                reverse('generate_menu'), json.dumps({'description': 'Cheesecake'}), content_type='application/json',
+            ))
+
+        gone, waiting = post(), post()
+        await asyncio.sleep(0.05)
+        gone.cancel()
+        response = await waiting
+        self.assertEqual(response.json(), {'menu': 'Delicious Cheesecake.'})
+        await asyncio.wrap_future(busy)
+
+    def test_cancelled_completions_are_reported_as_failures(self):
+        cancelled = Future()
+        cancelled.cancel()
+        with mock.patch.object(get_description_generator(), 'submit', return_value=cancelled):
+            response = self.generate({'description': 'Cheesecake'})
+            self.assertEqual(response.status_code, 500)
+            self.assertIn('OpenAI API Call failed', response.json()['error'])
+            response = self.generate({'descriptions': ['Cheesecake']})
+            self.assertIn('error', response.json()['menus'][0])
+
+
+class OrderStatusTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.client.force_login(self.user)
+        seed_order_history(6, user=self.user)
+        Order.objects.update(status='pending')
+        self.order_ids = list(Order.objects.order_by('id').values_list('id', flat=True))
+
+    def post_status(self, url, payload):
+        return self.client.post(url, json.dumps(payload), content_type='application/json')
+
+    def test_second_transition_loses(self):
+        url = reverse('update_order_status', args=[self.order_ids[0]])
+        first = self.post_status(url, {'status': 'completed'})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['order']['status'], 'completed')
+        second = self.post_status(url, {'status': 'cancelled'})
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(second.json()['order']['status'], 'completed')
+
+    def test_updated_at_advances(self):
+        before = Order.objects.get(id=self.order_ids[0]).updated_at
+        response = self.post_status(reverse('update_order_status', args=[self.order_ids[0]]), {'status': 'completed'})
+        self.assertGreater(parse_datetime(response.json()['order']['updated_at']), before)
+
+    def test_batch_transition(self):
+        Order.objects.filter(id=self.order_ids[0]).update(status='cancelled')
+        response = self.post_status(reverse('update_orders_status'), {
+            'order_ids': self.order_ids + [999999], 'status': 'completed',
+        })
+        body = response.json()
+        self.assertEqual(sorted(o['id'] for o in body['updated']), self.order_ids[1:])
+        self.assertEqual([o['id'] for o in body['conflicts']], [self.order_ids[0]])
+        self.assertEqual(body['missing'], [999999])
+
+    def test_disallowed_transition(self):
+        response = self.post_status(
+            reverse('update_order_status', args=[self.order_ids[0]]),
+            {'status': 'pending', 'from_status': 'completed'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_restaurants_orders_are_not_found(self):
+        other = CustomUser.objects.create_user(email='other@example.com', username='other', password='secret')
+        self.client.force_login(other)
+        response = self.post_status(reverse('update_order_status', args=[self.order_ids[0]]), {'status': 'cancelled'})
+        self.assertEqual(response.status_code, 404)
+        response = self.post_status(reverse('update_orders_status'), {
+            'order_ids': self.order_ids, 'status': 'cancelled',
+        })
+        self.assertEqual((response.json()['updated'], response.json()['missing']), ([], self.order_ids))
+        self.assertFalse(Order.objects.exclude(status='pending').exists())
+
+    def test_scoped_update_keeps_the_status_condition(self):
+        # Mimic MySQL, which cannot select from the table being updated
+        with mock.patch.object(connection.features, 'update_can_self_select', False), \
+                CaptureQueriesContext(connection) as queries:
+            updated, conflicts, missing = transition_orders(self.order_ids[:2], 'completed', owner=self.user)
+        self.assertEqual(len(updated), 2)
+        update, = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertIn('"status" = \'pending\'', update)
+
+
+class OrderChangesTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.client.force_login(self.user)
+        seed_order_history(30, user=self.user)
+        Order.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+
+    def changes(self, **params):
+        response = self.client.get(reverse('get_order_changes'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_paging_through_history(self):
+        first = self.changes(limit=20)
+        self.assertEqual(len(first['orders']), 20)
+        self.assertTrue(first['has_more'])
+        rest = self.changes(since=first['cursor'], limit=20)
+        self.assertEqual(len(rest['orders']), 10)
+        self.assertFalse(rest['has_more'])
+        ids = [o['id'] for o in first['orders'] + rest['orders']]
+        self.assertEqual(sorted(ids), sorted(Order.objects.values_list('id', flat=True)))
+
+    def test_only_the_delta_is_returned(self):
+        cursor = self.changes(limit=500)['cursor']
+        changed = Order.objects.order_by('id').first()
+        Order.objects.filter(id=changed.id).update(status='cancelled', updated_at=timezone.now() - timedelta(minutes=1))
+
+        response, queries = count_queries(self.client.get, reverse('get_order_changes'), {'since': cursor})
+        body = response.json()
+        self.assertEqual([o['id'] for o in body['orders']], [changed.id])
+        self.assertEqual(body['orders'][0]['status'], 'cancelled')
+        self.assertTrue(body['orders'][0]['items'])
+
+        # An unchanged history returns nothing and keeps the cursor
+        empty = self.changes(since=body['cursor'])
+        self.assertEqual((empty['orders'], empty['cursor']), ([], body['cursor']))
+        _, queries_without_changes = count_queries(
+            self.client.get, reverse('get_order_changes'), {'since': body['cursor']}
+        )
+        self.assertLessEqual(queries_without_changes, queries)
+
+    def test_other_restaurants_orders_are_left_out(self):
+        other = CustomUser.objects.create_user(email='other@example.com', username='other', password='secret')
+        seed_order_history(5, user=other)
+        Order.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        ids = {o['id'] for o in self.changes(limit=500)['orders']}
+        self.assertEqual(ids, set(Order.objects.filter(table__user=self.user).values_list('id', flat=True)))
+        self.client.force_login(other)
+        self.assertEqual(len(self.changes(limit=500)['orders']), 5)
+
+
+class ExportOrdersTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.client.force_login(self.user)
+        seed_order_history(30, user=self.user)
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+        earlier = list(Order.objects.order_by('id').values_list('id', flat=True)[:10])
+        Order.objects.filter(id__in=earlier).update(created_at=timezone.now() - timedelta(days=1))
+
+    def export(self, **params):
+        params = {'start': self.yesterday.isoformat(), 'end': self.today.isoformat(), **params}
+        response = self.client.get(reverse('export_orders'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_has_every_line_and_daily_totals(self):
+        rows = list(csv.DictReader(self.export().splitlines()))
+        lines = [row for row in rows if row['record'] == 'line']
+        self.assertEqual(len(lines), OrderItem.objects.count())
+
+        totals = {row['date']: row for row in rows if row['record'] == 'day_total'}
+        self.assertEqual(set(totals), {self.yesterday.isoformat(), self.today.isoformat()})
+        counted = Order.objects.exclude(status='cancelled')
+        self.assertEqual(sum(int(row['order_count']) for row in totals.values()), counted.count())
+        self.assertEqual(
+            sum(Decimal(row['order_total']) for row in totals.values()),
+            sum(order.total_amount for order in counted),
+        )
+
+    def test_jsonl_orders_carry_their_items(self):
+        records = [json.loads(line) for line in self.export(format='jsonl').splitlines()]
+        orders = [record for record in records if record['type'] == 'order']
+        self.assertEqual(len(orders), 30)
+        self.assertTrue(all(order['items'] for order in orders))
+        self.assertEqual([record['type'] for record in records[30:]], ['day_total', 'day_total'])
+
+    def test_chunks_cover_the_range_once(self):
+        ids = [order.id for order in iter_orders(self.yesterday, self.today, chunk_size=7)]
+        self.assertEqual(sorted(ids), sorted(Order.objects.values_list('id', flat=True)))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(list(iter_orders(self.today, self.today, chunk_size=7))), 20)
+
+    async def test_asgi_streams_the_same_export_in_batches(self):
+        await self.async_client.aforce_login(self.user)
+        params = {'start': self.yesterday.isoformat(), 'end': self.today.isoformat()}
+        response = await self.async_client.get(reverse('export_orders'), params)
+        self.assertTrue(response.is_async)
+        streamed = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+        self.assertEqual(streamed, await sync_to_async(self.export)())
+
+        batches = [batch async for batch in aiter_export(self.yesterday, self.today, 'jsonl', batch_size=7)]
+        self.assertEqual(len(batches), 5)
+        self.assertEqual(sum(batch.count('\n') for batch in batches), 32)
+
+    def test_other_owners_see_nothing(self):
+        other = CustomUser.objects.create_user(email='other@example.com', username='other', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.export().splitlines()[1:], [])
+
+    def test_rejects_bad_ranges_and_anonymous_users(self):
+        response = self.client.get(reverse('export_orders'), {'start': 'yesterday', 'end': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+        self.client.logout()
+        response = self.client.get(reverse('export_orders'), {'start': '2024-01-01', 'end': '2024-01-02'})
+        self.assertEqual(response.status_code, 401)
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_menus()
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.menu = seed_menu(self.user, categories=1, items_per_category=3)
+        self.items = list(MenuItem.objects.filter(category__menu=self.menu).order_by('id'))
+        self.client.force_login(self.user)
+
+    def submit(self, table, quantities):
+        response = self.client.post(
+            reverse('submit_order'),
+            json.dumps({'table': table, 'items': [
+                {'id': item.id, 'quantity': quantity} for item, quantity in zip(self.items, quantities) if quantity
+            ]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['order_id']
+
+    def rollup(self):
+        return sorted(DailySales.objects.values_list('table__table_number', 'item_id', 'quantity', 'revenue'))
+
+    def sales(self, **params):
+        response = self.client.get(reverse('sales_analytics'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_orders_roll_up_incrementally_and_cancellations_roll_back(self):
+        self.submit('1', [2, 1])
+        self.submit('1', [1, 0, 4])
+        cancelled = self.submit('2', [3])
+        first = self.items[0]
+        self.assertIn(('1', first.id, 3, first.price * 3), self.rollup())
+
+        response = self.client.post(
+            reverse('update_order_status', args=[cancelled]),
+            json.dumps({'status': 'cancelled'}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(('2', first.id, 0, Decimal('0.00')), self.rollup())
+
+        incremental = [row for row in self.rollup() if row[2]]
+        rebuild_sales()
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_api_groups_by_day_table_and_item(self):
+        self.submit('1', [2, 1])
+        self.submit('2', [1])
+        by_day = self.sales()
+        expected = self.items[0].price * 3 + self.items[1].price
+        self.assertEqual(by_day['totals'], {'quantity': 4, 'revenue': float(expected)})
+        self.assertEqual([row['date'] for row in by_day['rows']], [timezone.localdate().isoformat()])
+        self.assertEqual([row['table_number'] for row in self.sales(group_by='table')['rows']], ['1', '2'])
+        items = {row['item_id']: row['quantity'] for row in self.sales(group_by='item')['rows']}
+        self.assertEqual(items, {self.items[0].id: 3, self.items[1].id: 1})
+
+    def test_api_reads_only_the_rollup(self):
+        for table in range(10):
+            self.submit(str(table), [1, 2, 3])
+        response, queries = count_queries(self.client.get, reverse('sales_analytics'), {'group_by': 'item'})
+        self.assertEqual(response.json()['totals']['quantity'], 60)
+        # Session, user and the rollup query, whatever the order volume
+        self.assertLessEqual(queries, 3)
+
+    def test_other_owners_and_bad_params(self):
+        self.submit('1', [1])
+        other = CustomUser.objects.create_user(email='other@example.com', username='other', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.sales()['rows'], [])
+        self.assertEqual(self.client.get(reverse('sales_analytics'), {'group_by': 'week'}).status_code, 400)
+
+
+class TableOwnerMigrationTests(TestCase):
+    def setUp(self):
+        migration = importlib.import_module('tabletapapp.migrations.0012_assign_table_owners')
+        self.assign_table_owners = migration.assign_table_owners
+        self.owners = [
+            CustomUser.objects.create_user(email=f'o{n}@example.com', username=f'owner{n}', password='pw')
+            for n in range(2)
+        ]
+        self.items = [MenuItem.objects.filter(category__menu=seed_menu(owner, 1, 1)).get() for owner in self.owners]
+
+    def order(self, table, *items):
+        order = Order.objects.create(table=table, total_amount=Decimal('10.00'))
+        OrderItem.objects.bulk_create([OrderItem(order=order, item=item, quantity=1, price=item.price) for item in items])
+        return order
+
+    def test_guest_tables_are_given_to_the_restaurants_ordered_from(self):
+        shared = Table.objects.create(table_number='4', active=True)
+        first = self.order(shared, self.items[0])
+        second = self.order(shared, self.items[1], self.items[0])
+        existing = Table.objects.create(user=self.owners[0], table_number='9')
+        third = self.order(Table.objects.create(table_number='9'), self.items[0])
+        empty = Table.objects.create(table_number='5')
+
+        self.assign_table_owners(apps, None)
+
+        shared.refresh_from_db()
+        self.assertEqual(shared.user, self.owners[0])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        third.refresh_from_db()
+        self.assertEqual(first.table, shared)
+        self.assertEqual((second.table.user, second.table.table_number), (self.owners[1], '4'))
+        self.assertEqual(third.table, existing)
+        empty.refresh_from_db()
+        self.assertIsNone(empty.user)
+
+
+def _photo(width=1600, height=900, color=(200, 80, 40)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _photo_data_url(**kwargs):
+    return 'data:image/png;base64,' + base64.b64encode(_photo(**kwargs)).decode('ascii')
+
+
+class MenuImageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        settings_override = override_settings(MEDIA_ROOT=media.name, IMAGE_VARIANT_WIDTHS=[400, 800, 1200])
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.client.force_login(self.user)
+        self.menu = Menu.objects.create(user=self.user, name='Lunch', active=True)
+
+    def save(self, data):
+        return self.client.post(
+            reverse('save_menu_data', args=[self.menu.id]),
+            json.dumps({'data': data}),
+            content_type='application/json',
+        )
+
+    def test_identical_photos_are_stored_once(self):
+        photo = _photo_data_url()
+        response = self.save({'Mains': [
+            {'name': 'Steak', 'price': 25, 'image': photo},
+            {'name': 'Steak frites', 'price': 28, 'image': photo},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(MenuImage.objects.count(), 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'menu_images', 'originals'))), 1)
+        self.assertEqual(len({item.image.name for item in MenuItem.objects.all()}), 1)
+
+    def test_guest_page_offers_resized_variants(self):
+        self.save({'Mains': [{'name': 'Steak', 'price': 25, 'image': _photo_data_url(width=1000, height=500)}]})
+        image = MenuImage.objects.get()
+        variants = render_variants(image)
+        # Widths above the original are capped at its own width
+        self.assertEqual(sorted(variants['webp'], key=int), ['400', '800', '1000'])
+        self.assertLess(variants['jpeg']['400']['size'], image.size)
+        # As generate_variants does once they are rendered
+        publish_menu_on_commit(menus_showing(image))
+
+        cache.clear()
+        response = self.client.get(reverse('table_view', args=[1]))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, f"{image.sha256}-400.webp 400w")
+        self.assertContains(response, f"{image.sha256}-400.jpg")
+
+    def test_invalid_image_is_rejected(self):
+        bogus = 'data:image/png;base64,' + base64.b64encode(b'not an image').decode('ascii')
+        response = self.save({'Mains': [{'name': 'Steak', 'price': 25, 'image': bogus}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MenuImage.objects.exists())
+
+    def test_decompression_bombs_are_rejected(self):
+        # Pillow refuses images over twice MAX_IMAGE_PIXELS before decoding them
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 10):
+            response = self.save({'Mains': [{'name': 'Steak', 'price': 25, 'image': _photo_data_url()}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MenuImage.objects.exists())
+
+    def upload(self, content, name='dish.png'):
+        return self.client.post(reverse('upload_menu_image'), {'image': SimpleUploadedFile(name, content)})
+
+    def test_upload_returns_an_id_the_menu_references(self):
+        response = self.upload(_photo())
+        self.assertEqual(response.status_code, 201)
+        image_id = response.json()['id']
+        self.assertEqual(self.upload(_photo()).json()['id'], image_id)
+
+        saved = self.save({'Mains': [{'name': 'Steak', 'price': 25, 'image_id': image_id}]})
+        self.assertEqual(saved.status_code, 200)
+        item = saved.json()['data']['Mains'][0]
+        self.assertEqual(item['image_id'], image_id)
+        self.assertEqual(MenuItem.objects.get().menu_image_id, image_id)
+
+        # Saving the editor's data back unchanged touches nothing
+        resaved = self.save(saved.json()['data']).json()
+        self.assertEqual((resaved['inserted'], resaved['updated']), (0, 0))
+
+    def test_oversized_uploads_are_refused_before_they_are_stored(self):
+        with mock.patch('tabletapapp.views.store_image') as store:
+            response = self.client.post(
+                reverse('upload_menu_image'), {'image': SimpleUploadedFile('dish.png', b'x')},
+                CONTENT_LENGTH=str(10 ** 10),
+            )
+            self.assertEqual(response.status_code, 413)
+            # Within the multipart allowance, so only the upload handler can stop it
+            with override_settings(MENU_IMAGE_MAX_BYTES=1024):
+                self.assertEqual(self.upload(b'x' * 4096).status_code, 413)
+        store.assert_not_called()
+
+        csrf_client = self.client_class(enforce_csrf_checks=True)
+        csrf_client.force_login(self.user)
+        response = csrf_client.post(reverse('upload_menu_image'), {'image': SimpleUploadedFile('dish.png', _photo())})
+        self.assertEqual(response.status_code, 403)
+
+    def test_upload_rejects_bad_files_and_ids(self):
+        self.assertEqual(self.upload(b'not an image').status_code, 400)
+        with override_settings(MENU_IMAGE_MAX_BYTES=100):
+            self.assertEqual(self.upload(_photo()).status_code, 413)
+        response = self.save({'Mains': [{'name': 'Steak', 'price': 25, 'image_id': 999}]})
+        self.assertEqual(response.status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.upload(_photo()).status_code, 401)
+
+
+class HttpCachingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.menu = seed_menu(self.user, categories=3, items_per_category=5)
+        self.editor = self.client_class()
+        self.editor.force_login(self.user)
+
+    def change_menu(self):
+        data = self.editor.get(reverse('menu_list')).json()['menus'][0]['data']
+        first = next(iter(data))
+        data[first][0]['price'] += 1
+        response = self.editor.post(
+            reverse('save_menu_data', args=[self.menu.id]), json.dumps({'data': data}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['updated'], 1)
+
+    def test_guest_page_revalidates_without_database_work(self):
+        response = self.client.get(reverse('table_view', args=[4]))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        # Nothing per-visitor, so a shared cache may store it
+        self.assertNotIn('csrfmiddlewaretoken', response.content.decode())
+        self.assertFalse(response.cookies)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('table_view', args=[4]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(queries), 0)
+
+        self.change_menu()
+        response = self.client.get(reverse('table_view', args=[4]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_menu_api_304_skips_categories_and_items(self):
+        response = self.editor.get(reverse('menu_list'))
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.editor.get(reverse('menu_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        touched = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('tabletapapp_menuitem', touched)
+        self.assertNotIn('tabletapapp_menucategory', touched)
+
+        self.change_menu()
+        response = self.editor.get(reverse('menu_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_orders_are_accepted_without_a_csrf_token(self):
+        guest = self.client_class(enforce_csrf_checks=True)
+        item = MenuItem.objects.filter(category__menu=self.menu).first()
+        response = guest.post(
+            reverse('submit_order'),
+            json.dumps({'table': '4', 'items': [{'id': item.id, 'quantity': 1}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class MenuListTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.client.force_login(self.user)
+        self.menu = seed_menu(self.user, categories=2, items_per_category=3)
+
+    def test_query_count_does_not_grow_with_menus(self):
+        _, one_menu = count_queries(self.client.get, reverse('menu_list'))
+        for n in range(4):
+            seed_menu(self.user, categories=12, items_per_category=8, name=f'Menu {n}')
+        response, five_menus = count_queries(self.client.get, reverse('menu_list'))
+        menus = response.json()['menus']
+        self.assertEqual(len(menus), 5)
+        self.assertEqual(sum(len(items) for menu in menus for items in menu['data'].values()), 6 + 4 * 96)
+        # Previously 1 + menus + categories queries (~65 here)
+        self.assertEqual(five_menus, one_menu)
+
+    def test_single_menu(self):
+        other = seed_menu(self.user, categories=1, items_per_category=1, name='Drinks')
+        response = self.client.get(reverse('menu_list'), {'menu_id': other.id})
+        self.assertEqual([menu['id'] for menu in response.json()['menus']], [other.id])
+        self.assertEqual(self.client.get(reverse('menu_list'), {'menu_id': 0}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('menu_list'), {'menu_id': 'x'}).status_code, 400)
+
+
+class RestaurantTableViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_menus()
+        self.addCleanup(clear_local_menus)
+        self.owners = []
+        for name in ('alpha', 'beta'):
+            owner = CustomUser.objects.create_user(email=f'{name}@example.com', username=name, password='secret')
+            seed_menu(owner, categories=2, items_per_category=2, name=f'{name} menu')
+            self.owners.append(owner)
+
+    def page(self, owner, table='4'):
+        return self.client.get(reverse('restaurant_table_view', args=[owner.id, table]))
+
+    def test_each_restaurant_gets_its_own_menu(self):
+        alpha, beta = self.owners
+        self.assertContains(self.page(alpha), 'alpha menu')
+        self.assertNotContains(self.page(alpha), 'beta menu')
+        self.assertContains(self.page(beta), 'beta menu')
+        nobody = CustomUser.objects.create_user(email='c@example.com', username='gamma', password='secret')
+        self.assertEqual(self.page(nobody).status_code, 404)
+
+    def test_repeat_scans_skip_the_database(self):
+        self.page(self.owners[0])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.page(self.owners[0], table='9').status_code, 200)
+        self.assertEqual(len(queries), 0)
+        self.assertGreaterEqual(cache_stats()['local_hits'], 1)
+
+    def test_a_rebuild_after_a_miss_never_overwrites_a_newer_snapshot(self):
+        alpha = self.owners[0]
+        key = TENANT_MENU_KEY.format(owner_id=alpha.id)
+        # Stored by an edit's on_commit rebuild while this miss read the database
+        newer = {'menu': {'version_id': 'newer'}, 'categories': []}
+        cache.set(key, newer, timeout=None)
+        self.assertEqual(rebuild_tenant_menu(alpha.id), newer)
+        self.assertEqual(cache.get(key), newer)
+        self.assertNotEqual(rebuild_tenant_menu(alpha.id, replace=True), newer)
+        self.assertNotEqual(cache.get(key), newer)
+
+    @override_settings(TENANT_MENU_LOCAL_SIZE=2, EMPTY_MENU_CACHE_TTL=60)
+    def test_unknown_restaurants_are_not_kept_forever(self):
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            for owner_id in (999997, 999998, 999999):
+                self.assertIsNone(get_tenant_menu(owner_id)['menu'])
+        self.assertEqual([call.kwargs['timeout'] for call in add.call_args_list], [60, 60, 60])
+
+        # The oldest fell out of this process and comes back from the shared cache
+        stats = cache_stats()
+        get_tenant_menu(999997)
+        self.assertEqual(cache_stats()['local_hits'], stats['local_hits'])
+        self.assertEqual(cache_stats()['hits'], stats['hits'] + 1)
+        get_tenant_menu(999997)
+        self.assertEqual(cache_stats()['local_hits'], stats['local_hits'] + 1)
+
+    def test_edits_only_refresh_the_owners_menu(self):
+        alpha, beta = self.owners
+        self.page(alpha), self.page(beta)
+        beta_etag = self.page(beta)['ETag']
+
+        editor = self.client_class()
+        editor.force_login(alpha)
+        menu = Menu.objects.get(user=alpha)
+        data = editor.get(reverse('menu_list')).json()['menus'][0]['data']
+        first = next(iter(data))
+        data[first][0]['name'] = 'Renamed dish'
+        with self.captureOnCommitCallbacks(execute=True):
+            editor.post(reverse('save_menu_data', args=[menu.id]), json.dumps({'data': data}),
+                        content_type='application/json')
+
+        self.assertContains(self.page(alpha), 'Renamed dish')
+        self.assertEqual(self.page(beta)['ETag'], beta_etag)
+
+    def test_form_order_redirects_to_the_restaurant_page(self):
+        alpha = self.owners[0]
+        item = MenuItem.objects.filter(category__menu__user=alpha).first()
+        response = self.client.post(reverse('submit_order'), {
+            'table': '4', 'item_id_0': item.id, 'item_quantity_0': 1,
+        }, HTTP_ACCEPT='text/html')
+        self.assertRedirects(
+            response, reverse('restaurant_table_view', args=[alpha.id, '4']) + '?order_success=true',
+            fetch_redirect_response=False,
+        )
+
+
+class QRCodeTests(TestCase):
+    def setUp(self):
+        qr_cache = tempfile.TemporaryDirectory()
+        self.addCleanup(qr_cache.cleanup)
+        self.qr_cache = qr_cache.name
+        settings_override = override_settings(QR_CACHE_DIR=qr_cache.name, PUBLIC_BASE_URL='https://tt.example')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', username='owner', password='secret'
+        )
+        self.client.force_login(self.user)
+
+    def batch(self, **params):
+        response = self.client.get(reverse('table_qrcodes'), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_zip_batch_creates_tables_and_records_urls(self):
+        response = self.batch(start=1, end=5, format='zip')
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            self.assertEqual(sorted(archive.namelist()), [f'table-{n}.png' for n in range(1, 6)])
+            with Image.open(io.BytesIO(archive.read('table-3.png'))) as code:
+                self.assertEqual(code.format, 'PNG')
+        table = Table.objects.get(user=self.user, table_number='3')
+        self.assertEqual(table.qr_code_url, f'https://tt.example/tabletap/table/{self.user.id}/3/')
+        self.assertEqual(Table.objects.filter(user=self.user).count(), 5)
+
+    def test_codes_are_cached_on_disk(self):
+        self.batch(start=1, end=3, format='zip')
+        with mock.patch('tabletapapp.qrcodes.segno.make', wraps=segno.make) as make:
+            self.batch(start=1, end=13)
+        # Only the ten new tables were drawn
+        self.assertEqual(make.call_count, 10)
+
+    def test_printable_sheet(self):
+        response = self.batch(start=1, end=13)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_single_code_and_bad_ranges(self):
+        response = self.client.get(reverse('table_qrcode', args=['7']))
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(Table.objects.filter(user=self.user, table_number='7').exists())
+        self.assertEqual(self.client.get(reverse('table_qrcode', args=['7' * 21])).status_code, 400)
+        self.assertFalse(Table.objects.filter(table_number='7' * 21).exists())
+        too_long = 10 ** 20
+        for params in ({'start': 5, 'end': 1}, {'start': 1, 'end': 1000}, {'start': 'a', 'end': 2},
+                       {'start': too_long, 'end': too_long}):
+            self.assertEqual(self.client.get(reverse('table_qrcodes'), params).status_code, 400)
+
+
+class EndpointBenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_menus()
+
+    def test_percentiles_use_nearest_rank(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 0.50), 50)
+        self.assertEqual(percentile(samples, 0.99), 99)
+        self.assertEqual(percentile([7], 0.95), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_seeding_is_reused_and_every_endpoint_answers(self):
+        owners = seed_tenants(2, categories=2, items_per_category=3, orders=20, tables=4)
+        seed_tenants(2, categories=2, items_per_category=3, orders=20, tables=4)
+        self.assertEqual(Menu.objects.filter(user__in=owners).count(), 4)
+        self.assertEqual(Order.objects.filter(table__user__in=owners).count(), 40)
+
+        fixtures = [tenant_fixture(owner) for owner in owners]
+        for name in ENDPOINTS:
+            stats = run_in_process(name, fixtures, requests=4, warmup=1)
+            self.assertEqual((stats['requests'], stats['errors']), (4, 0), name)
+            self.assertIsNotNone(stats['p95_ms'])
+            self.assertGreaterEqual(stats['queries_max'], 0)
+
+    def test_process_tree_rss(self):
+        if not os.path.exists('/proc/self/status'):
+            self.skipTest("needs Linux /proc")
+        self.assertGreater(process_tree_rss(os.getpid()), 0)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        reset_metrics()
+        self.user = CustomUser.objects.create_user(email='m@example.com', username='metrics', password='pw')
+        self.admin = CustomUser.objects.create_superuser(email='a@example.com', username='admin', password='pw')
+        seed_menu(self.user, categories=2, items_per_category=2)
+
+    def test_views_are_timed_with_their_queries(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('menu_list'))
+        views = metrics_summary()
+        self.assertEqual(views['menu_list']['requests'], 1)
+        self.assertEqual(views['menu_list']['mean_queries'], len(ctx.captured_queries))
+        self.assertEqual(views['menu_list']['n_plus_one'], [])
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        self.client.get(reverse('table_view', args=[1]))
+        self.assertEqual(metrics_summary(), {})
+
+    async def test_async_views_are_measured(self):
+        await sync_to_async(seed_order_history)(1, user=self.user)
+        order_id = await Order.objects.values_list('id', flat=True).afirst()
+        # One query for the order and table, one for its items
+        response = await self.async_client.get(reverse('get_order_details', args=[order_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics_summary()['get_order_details']['mean_queries'], 2)
+
+    def test_queries_outside_requests_are_not_recorded(self):
+        MenuItem.objects.count()
+        self.assertEqual(metrics_summary(), {})
+        self.assertIn('_record_query', [wrapper.__name__ for wrapper in connection.execute_wrappers])
+
+    @override_settings(N_PLUS_ONE_THRESHOLD=3)
+    def test_repeated_query_shapes_are_flagged(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for item in MenuItem.objects.filter(category__menu__user=self.user):
+                item.category.name
+        record('menu_editor', 200, 0.01, recorder)
+        flagged = metrics_summary()['menu_editor']['n_plus_one']
+        self.assertEqual(len(flagged), 1)
+        self.assertIn('tabletapapp_menucategory', flagged[0]['sql'])
+        self.assertEqual(flagged[0]['max_executions'], 4)
+        self.assertEqual(
+            sql_shape('SELECT * FROM t WHERE id IN (%s, %s,%s)'), sql_shape('SELECT * FROM t WHERE id IN (%s)')
+        )
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_endpoints_are_restricted(self):
+        self.client.get(reverse('table_view', args=[1]))
+        self.assertEqual(self.client.get(reverse('prometheus_metrics')).status_code, 403)
+        response = self.client.get(reverse('prometheus_metrics'), HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('tabletap_request_duration_seconds_bucket{view="table_view",le="+Inf"} 1', response.content.decode())
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('request_metrics')).status_code, 403)
+        self.client.force_login(self.admin)
+        self.assertIn('table_view', self.client.get(reverse('request_metrics')).json()['views'])
+
+
+class MenuVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_menus()
+        self.user = CustomUser.objects.create_user(email='v@example.com', username='versions', password='pw')
+        self.client.force_login(self.user)
+        self.menu = Menu.objects.create(user=self.user, name='Dinner', active=True)
+        self.save(12)
+        self.first = MenuVersion.objects.get(menu=self.menu)
+
+    def save(self, price):
+        response = self.client.post(
+            reverse('save_menu_data', args=[self.menu.id]),
+            json.dumps({'data': {'Mains': [{'name': 'Pasta', 'price': price}]}}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def order(self, version_id):
+        # Items saved without an id are replaced, so each version has its own
+        version = MenuVersion.objects.filter(id=version_id).first() or self.first
+        item_id = version.snapshot['categories'][0]['items'][0]['id']
+        return self.client.post(
+            reverse('submit_order'),
+            json.dumps({'table': '2', 'menu_version': version_id, 'items': [{'id': item_id, 'quantity': 1}]}),
+            content_type='application/json',
+        )
+
+    def test_guests_keep_the_version_they_were_shown(self):
+        self.save(15)
+        self.assertEqual(self.menu.versions.count(), 2)
+        page = self.client.get(reverse('restaurant_table_view', args=[self.user.id, '2']))
+        self.assertContains(page, 'value="%d"' % self.menu.versions.latest('number').id)
+
+        # A guest who opened the menu before the price change pays the old price
+        order = Order.objects.get(id=self.order(self.first.id).json()['order_id'])
+        self.assertEqual(order.menu_version, self.first)
+        self.assertEqual(order.orderitem_set.get().price, Decimal('12.00'))
+        self.assertEqual(self.first.snapshot['categories'][0]['items'][0]['price'], '12.00')
+
+    def test_versions_are_served_immutable(self):
+        response = self.client.get(reverse('menu_version', args=[self.first.id]))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response.json()['menu']['version_id'], self.first.id)
+        self.assertEqual(self.client.get(reverse('menu_version', args=[999])).status_code, 404)
+        self.assertEqual(self.order(999).status_code, 400)
+
+    def test_collection_keeps_current_and_pending_versions(self):
+        pending = Order.objects.get(id=self.order(self.first.id).json()['order_id'])
+        self.save(13)
+        second = self.menu.versions.latest('number')
+        done = Order.objects.get(id=self.order(second.id).json()['order_id'])
+        Order.objects.filter(id=done.id).update(status='completed')
+        self.save(14)
+
+        self.assertEqual(collect_menu_versions(timedelta(hours=1)), 0)
+        self.assertEqual(collect_menu_versions(timedelta(0)), 1)
+        self.assertEqual(
+            set(self.menu.versions.values_list('number', flat=True)),
+            {self.first.number, self.menu.versions.latest('number').number},
+        )
+        done.refresh_from_db()
+        pending.refresh_from_db()
+        self.assertIsNone(done.menu_version)
+        self.assertEqual(pending.menu_version, self.first)
+
+    def test_archived_menus_cannot_be_ordered_from(self):
+        response = self.client.delete(reverse('update_menu', args=[self.menu.id]))
+        self.assertEqual(response.status_code, 200)
+        newest = self.menu.versions.latest('number')
+        self.assertEqual(newest.snapshot['categories'], [])
+        item_id = self.first.snapshot['categories'][0]['items'][0]['id']
+        response = self.client.post(
+            reverse('submit_order'),
+            json.dumps({'table': '2', 'menu_version': newest.id, 'items': [{'id': item_id, 'quantity': 1}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # Guests who opened the menu before it was deleted can still order, within the grace period
+        self.assertEqual(self.order(self.first.id).status_code, 200)
+        MenuVersion.objects.filter(id=newest.id).update(created_at=timezone.now() - timedelta(hours=2))
+        with override_settings(MENU_VERSION_GRACE_HOURS=1):
+            self.assertEqual(self.order(self.first.id).status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class MenuSearchTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='s@example.com', username='searcher', password='pw')
+        self.other = CustomUser.objects.create_user(email='o@example.com', username='other', password='pw')
+        self.client.force_login(self.user)
+        self.menu = Menu.objects.create(user=self.user, name='Dinner', active=True)
+        self.save({
+            'Mains': [
+                {'name': 'Spaghetti carbonara', 'price': 14, 'description': 'Guanciale, pecorino'},
+                {'name': 'Risotto', 'price': 16, 'description': 'Wild mushrooms'},
+            ],
+            'Desserts': [{'name': 'Tiramisu', 'price': 7}],
+        })
+        other_menu = Menu.objects.create(user=self.other, name='Other', active=True)
+        category = MenuCategory.objects.create(menu=other_menu, name='Mains', order=0)
+        MenuItem.objects.create(category=category, name='Carbonara', price=10)
+
+    def save(self, data, menu=None):
+        response = self.client.post(
+            reverse('save_menu_data', args=[(menu or self.menu).id]),
+            json.dumps({'data': data}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_menu_items'), params)
+        self.assertEqual(response.status_code, 200)
+        return [result['name'] for result in response.json()['results']]
+
+    def test_prefixes_descriptions_and_categories_match(self):
+        self.assertEqual(self.search(q='carb'), ['Spaghetti carbonara'])
+        self.assertEqual(self.search(q='mush'), ['Risotto'])
+        self.assertEqual(self.search(q='spag carb'), ['Spaghetti carbonara'])
+        self.assertEqual(self.search(q='dessert'), ['Tiramisu'])
+        self.assertEqual(self.search(q='tira', menu_id=self.menu.id + 1000), [])
+
+    def test_index_follows_edits(self):
+        self.save({'Mains': [{'name': 'Lasagne', 'price': 15}]})
+        self.assertEqual(self.search(q='lasa'), ['Lasagne'])
+        self.assertEqual(self.search(q='risotto'), [])
+        self.assertEqual(self.search(q='risotto', active='false'), ['Risotto'])
+        MenuCategory.objects.filter(menu=self.menu, name='Mains').update(name='Pasta')
+        self.assertEqual(self.search(q='pasta'), ['Lasagne'])
+
+    def test_archived_menus_are_not_active(self):
+        self.assertEqual(self.client.delete(reverse('update_menu', args=[self.menu.id])).status_code, 200)
+        self.assertEqual(self.search(q='tira'), [])
+        self.assertEqual(self.search(q='tira', active='false'), ['Tiramisu'])
+
+    def test_superusers_search_every_restaurant(self):
+        admin = CustomUser.objects.create_superuser(email='a@example.com', username='admin', password='pw')
+        self.client.force_login(admin)
+        self.assertEqual(self.search(q='carbonara'), ['Carbonara', 'Spaghetti carbonara'])
+
+    def test_bad_params(self):
+        for params in ({'q': '!!'}, {'q': 'x', 'limit': 0}, {'q': 'x', 'active': 'maybe'}, {'q': 'x', 'menu_id': 'a'}):
+            self.assertEqual(self.client.get(reverse('search_menu_items'), params).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('search_menu_items'), {'q': 'x'}).status_code, 401)
+
+
+class ManageSubscribersTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(email='admin@example.com', username='admin', password='pw')
+        self.users = [
+            CustomUser.objects.create_user(email=f'{name}@example.com', username=name, password='pw')
+            for name in ('alice', 'alicia', 'malik', 'bob', 'carol', 'dave', 'erin')
+        ]
+        seed_menu(self.users[0])
+        seed_order_history(3, user=self.users[0], tables=2)
+        self.client.force_login(self.admin)
+
+    def test_page_comes_with_stats_in_one_query(self):
+        (users, next_after), queries = count_queries(get_subscriber_page, 'ali')
+        self.assertEqual(queries, 1)
+        self.assertEqual([user.username for user in users], ['alice', 'alicia'])
+        self.assertIsNone(next_after)
+        self.assertEqual((users[0].menu_count, users[1].menu_count), (1, 0))
+        self.assertEqual(users[0].last_order_at, Order.objects.latest('created_at').created_at)
+        self.assertIsNone(users[1].last_order_at)
+
+    def test_keyset_pages(self):
+        response = self.client.get(reverse('manage'))
+        self.assertEqual(len(response.context['users']), 5)
+        self.assertEqual(response.context['total'], 8)
+        seen = [user.id for user in response.context['users']]
+        response = self.client.get(f"{reverse('manage')}?{response.context['next_params']}")
+        seen += [user.id for user in response.context['users']]
+        self.assertIsNone(response.context['next_params'])
+        self.assertEqual(seen, sorted(CustomUser.objects.values_list('id', flat=True)))
+
+    def test_only_superusers(self):
+        self.client.force_login(self.users[3])
+        self.assertEqual(self.client.get(reverse('manage')).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('manage')).status_code, 302)
+
+
+class AsyncGuestViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_menus()
+        self.addCleanup(clear_local_menus)
+        self.owner = CustomUser.objects.create_user(email='g@example.com', username='guests', password='pw')
+        seed_menu(self.owner, categories=2, items_per_category=2)
+
+    async def test_guest_flow_through_the_async_views(self):
+        page = await self.async_client.get(reverse('restaurant_table_view', args=[self.owner.id, '3']))
+        self.assertEqual(page.status_code, 200)
+        snapshot = await aget_tenant_menu(self.owner.id)
+        self.assertIs(snapshot, get_tenant_menu(self.owner.id))
+
+        item_id = snapshot['categories'][0]['items'][0]['id']
+        response = await self.async_client.post(
+            reverse('submit_order'),
+            json.dumps({'table': '3', 'menu_version': snapshot['menu']['version_id'],
+                        'items': [{'id': item_id, 'quantity': 2}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        order = await Order.objects.select_related('table').aget(id=response.json()['order_id'])
+        self.assertEqual(order.table.user_id, self.owner.id)
+        self.assertEqual(order.menu_version_id, snapshot['menu']['version_id'])
+
+        details = await self.async_client.get(reverse('get_order_details', args=[order.id]))
+        self.assertEqual(details.json()['items'][0]['quantity'], 2)
+        missing = await self.async_client.get(reverse('get_order_details', args=[order.id + 1]))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_guests_only_see_an_orders_status_and_items(self):
+        item = await MenuItem.objects.filter(category__menu__user=self.owner).afirst()
+        order = await acreate_order('5', [(item.id, 1)], special_instructions='Ring flat 2')
+        url = reverse('get_order_details', args=[order.id])
+
+        details = (await self.async_client.get(url)).json()
+        self.assertEqual(set(details), {'id', 'status', 'items'})
+        self.assertEqual(set(details['items'][0]), {'item_name', 'quantity', 'price', 'subtotal'})
+
+        other = await sync_to_async(CustomUser.objects.create_user)(
+            email='x@example.com', username='other', password='pw'
+        )
+        await self.async_client.aforce_login(other)
+        self.assertNotIn('special_instructions', (await self.async_client.get(url)).json())
+        await self.async_client.aforce_login(self.owner)
+        details = (await self.async_client.get(url)).json()
+        self.assertEqual((details['table_number'], details['special_instructions']), ('5', 'Ring flat 2'))
+
+    async def test_orders_without_a_version_use_the_live_items(self):
+        item = await MenuItem.objects.filter(category__menu__user=self.owner).afirst()
+        order = await acreate_order('5', [(item.id, 1), (item.id + 1000, 1)])
+        self.assertEqual(await order.orderitem_set.acount(), 1)
+        self.assertEqual(order.menu_version_id, (await aget_tenant_menu(self.owner.id))['menu']['version_id'])
+        with self.assertRaises(ValueError):
+            await acreate_order('5', [(item.id + 1000, 1)])
@@ -10,9 +10,18 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('order/', views.order, name='order'),
     path('get-order-details/<int:order_id>/', views.get_order_details, name='get_order_details'),
+    path('get-order-changes/', views.get_order_changes, name='get_order_changes'),
+    path('api/orders/export/', views.export_orders, name='export_orders'),
+    path('api/orders/stream/', views.order_stream, name='order_stream'),
+    path('api/orders/status/', views.update_orders_status, name='update_orders_status'),
+    path('api/orders/<int:order_id>/status/', views.update_order_status, name='update_order_status'),
     path('qrcode/', views.qrcode, name='qrcode'),
+    path('api/qrcodes/', views.table_qrcodes, name='table_qrcodes'),
+    path('api/qrcodes/table/<str:table_number>/', views.table_qrcode, name='table_qrcode'),
     path('register/', views.register_view, name='register'),
     path('table/<int:table_number>/', views.table_view, name='table_view'),
+    path('table/<int:owner_id>/<str:table_number>/', views.restaurant_table_view, name='restaurant_table_view'),
+    path('api/menu-versions/<int:version_id>/', views.menu_version, name='menu_version'),
     path('generate_menu/', views.generate_menu, name='generate_menu'),
     path("admin/", admin.site.urls),
     path("manage/", views.ManageSubscribersView.as_view(), name="manage"),
@@ -25,5 +34,11 @@ urlpatterns = [
     path('api/menus/create/', views.create_menu, name='create_menu'),
     path('api/menu/<int:menu_id>/', views.update_menu, name='update_menu'),
     path('api/menu/<int:menu_id>/data/', views.save_menu_data, name='save_menu_data'),
+    path('api/menu-items/search/', views.search_menu_items, name='search_menu_items'),
+    path('api/menu-images/', views.upload_menu_image, name='upload_menu_image'),
+    path('api/analytics/sales/', views.sales_analytics, name='sales_analytics'),
+    path('api/menu-cache/stats/', views.menu_cache_stats, name='menu_cache_stats'),
+    path('api/metrics/requests/', views.request_metrics, name='request_metrics'),
+    path('metrics/', views.prometheus_metrics, name='prometheus_metrics'),
 ]
 
@@ -1,5 +1,8 @@
 
 # tabletapapp/views.py
+import asyncio
+import hashlib
+import hmac
 import os
 import json
 from datetime import datetime
@@ -8,22 +11,49 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login as auth_login, logout, get_user_model
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.auth.views import LoginView
+from django.core.handlers.asgi import ASGIRequest
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
 from django.db.models import Q
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import (
+    HttpResponse, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse_lazy
-from django.views.decorators.csrf import csrf_exempt
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_http_methods, require_GET
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, View
 
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
-import openai
-from openai import OpenAI
 
+from .ai import get_generator as get_description_generator
+from .analytics import parse_sales_params, sales_summary
+from .events import get_backend as get_event_backend
+from .exports import aiter_export, iter_export, parse_export_params
 from .forms import CustomUserCreationForm, CustomLoginForm, CustomUserUpdateForm
+from .images import IMAGE_SIZES, MULTIPART_OVERHEAD, UploadSizeLimitHandler, image_sources, store_image
 from .models import Menu, MenuItem, CustomUser, Table, Order, OrderItem, MenuCategory
+from .menus import apply_menu_data, editor_data, serialize_menu_data, with_editor_data
+from .metrics import metrics_summary, prometheus_text
+from .menu_cache import (
+    aget_published_menu, aget_tenant_menu, cache_stats, get_menu_version, publish_menu_on_commit,
+)
+from .orders import (
+    CHANGES_MAX_PAGE_SIZE, CHANGES_PAGE_SIZE, ORDER_STATUSES, acreate_order, decode_cursor,
+    get_changed_orders, get_order_page, order_feed_queryset, parse_order_filters, parse_order_lines,
+    serialize_board_order, serialize_guest_order, serialize_order_detail, serialize_order_status, transition_orders,
+)
+from .search import parse_search_params, search_items, serialize_search_result
+from .subscribers import estimate_subscribers, get_subscriber_page
+from .qrcodes import check_table_number, ensure_tables, get_qr_pool, parse_qr_params, qr_png, render_sheet, render_zip
 
 
 def index(request):
@@ -72,73 +102,296 @@ def logout_view(request):
 
 @login_required
 def order(request):
-    # Get all orders with their related items
-    orders = Order.objects.all().order_by('-updated_at')
-    
-    # Store order items for each order
-    orders_with_items = []
-    
-    for order in orders:
-        # Get all items for this order
-        order_items = OrderItem.objects.filter(order=order).select_related('item')
-        
-        # Calculate total items
-        total_items = sum(item.quantity for item in order_items)
-        
-        # Format items for JSON inclusion in template
-        formatted_items = []
-        for item in order_items:
-            formatted_items.append({
-                'name': item.item.name,
-                'quantity': item.quantity,
-                'price': float(item.price),
-                'subtotal': float(item.price * item.quantity)
-            })
-        
-        # Create a data structure with order and its items
-        order_data = {
-            'id': order.id,
-            'table_number': order.table.id if hasattr(order.table, 'id') else order.table.number,
-            'status': order.status,
-            'updated_at': order.updated_at,
-            'date': order.updated_at.strftime('%Y-%m-%d'),
-            'time': order.updated_at.strftime('%I:%M %p'),
-            'total_items': total_items,
-            'total_price': float(order.total_amount),
-            'items': json.dumps(formatted_items)  # JSON encode the items list
-        }
-        
-        orders_with_items.append(order_data)
-    
-    # Pass the orders with their items to the template
-    return render(request, 'order.html', {'orders': orders_with_items})
+    try:
+        filters = parse_order_filters(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    # One page of orders, newest first, with tables and items loaded in bulk
+    orders, next_cursor = get_order_page(**filters, owner=_order_owner(request))
+
+    # Query string for the "older orders" link keeps the active filters
+    next_params = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['before'] = next_cursor
+        next_params = params.urlencode()
+
+    context = {
+        'orders': [serialize_board_order(order) for order in orders],
+        'status': request.GET.get('status', 'all'),
+        'date_from': request.GET.get('date_from', ''),
+        'date_to': request.GET.get('date_to', ''),
+        'is_first_page': 'before' not in filters,
+        'next_params': next_params,
+        # Where the changes feed picks up if the board cannot stream events
+        'changes_since': timezone.now().isoformat(),
+    }
+    return render(request, 'order.html', context)
+
+def _order_owner(request):
+    """The restaurant whose orders the request may see and change; None for superusers (all of them)."""
+    return None if request.user.is_superuser else request.user
+
+
+def _parse_status_request(request):
+    data = json.loads(request.body)
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    status = data.get('status')
+    from_status = data.get('from_status', 'pending')
+    if status not in ORDER_STATUSES or from_status not in ORDER_STATUSES:
+        raise ValueError("Unknown status")
+    return data, status, from_status
+
+
+@login_required
+@require_http_methods(["POST"])
+def update_order_status(request, order_id):
+    """
+    API endpoint to change one order's status.
+
+    Body: {"status": "completed", "from_status": "pending"}. Responds 409 with
+    the current status if the order was no longer in from_status.
+    """
+    try:
+        _, status, from_status = _parse_status_request(request)
+        updated, conflicts, missing = transition_orders([order_id], status, from_status, owner=_order_owner(request))
+    except (json.JSONDecodeError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if missing:
+        return JsonResponse({'error': 'Order not found'}, status=404)
+    if conflicts:
+        return JsonResponse({
+            'error': f"Order is no longer {from_status}",
+            'order': serialize_order_status(conflicts[0]),
+        }, status=409)
+    return JsonResponse({'success': True, 'order': serialize_order_status(updated[0])})
+
+
+@login_required
+@require_http_methods(["POST"])
+def update_orders_status(request):
+    """
+    API endpoint to change the status of many orders at once.
+
+    Body: {"order_ids": [1, 2], "status": "completed", "from_status": "pending"}.
+    """
+    try:
+        data, status, from_status = _parse_status_request(request)
+        order_ids = [int(order_id) for order_id in data.get('order_ids') or []]
+        if not order_ids:
+            raise ValueError("order_ids must be a non-empty list")
+        updated, conflicts, missing = transition_orders(order_ids, status, from_status, owner=_order_owner(request))
+    except (json.JSONDecodeError, TypeError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'updated': [serialize_order_status(order) for order in updated],
+        'conflicts': [serialize_order_status(order) for order in conflicts],
+        'missing': missing,
+    })
+
+
+@login_required
+@require_GET
+async def order_stream(request):
+    """
+    Server-Sent Events stream of new and updated orders for the kitchen board.
+
+    Async so that under ASGI an idle dashboard holds no worker thread, and
+    events come from the in-process broker without touching the database.
+    Boards only receive their own restaurant's orders (superusers all).
+
+    Under WSGI the endless stream would hold a worker thread without ever
+    sending a byte, so the answer is 204, which stops EventSource from
+    reconnecting; the board then polls the changes feed instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+    owner_id = None if user.is_superuser else user.id
+
+    async def stream():
+        # Ask browsers to reconnect after 3 seconds if the connection drops
+        yield "retry: 3000\n\n"
+        async for event in get_event_backend().subscribe(heartbeat=15):
+            if event is None:
+                yield ": keepalive\n\n"
+            elif owner_id is None or event['owner_id'] == owner_id:
+                yield f"event: {event['type']}\ndata: {json.dumps(event['order'])}\n\n"
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @login_required
 def qrcode(request):
     return render(request, 'qrcode.html')
 
-def table_view(request, table_number):
-    # Get the active menu
-    active_menu = Menu.objects.filter(active=True, archived=False).first()
-    
-    if not active_menu:
-        return HttpResponseBadRequest("No active menu available")
-    
-    # Get active categories from active menu
-    menu_categories = MenuCategory.objects.filter(
-        menu=active_menu,
-        active=True
-    ).order_by('order')
-    
+
+def _public_base_url(request):
+    return settings.PUBLIC_BASE_URL or request.build_absolute_uri('/')
+
+
+@login_required
+@require_GET
+async def table_qrcode(request, table_number):
+    """PNG QR code of one of the user's tables; also records its URL on the table."""
+    try:
+        check_table_number(table_number)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    user = await request.auser()
+    (number, url), = await sync_to_async(ensure_tables)(user.id, [table_number], _public_base_url(request))
+    png = await asyncio.wrap_future(get_qr_pool().submit(qr_png, number, url))
+    response = HttpResponse(png, content_type='image/png')
+    patch_cache_control(response, private=True, max_age=3600)
+    return response
+
+
+@login_required
+@require_GET
+async def table_qrcodes(request):
+    """
+    QR codes of tables ?start= to ?end= as a printable PDF sheet or a ZIP of PNGs (&format=pdf|zip).
+
+    Missing tables are created. Codes are drawn (or read from the disk
+    cache) on the QR pool, and so is the sheet, so under ASGI no request
+    thread is held while they render.
+    """
+    try:
+        table_numbers, export_format = parse_qr_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    user = await request.auser()
+    tables = await sync_to_async(ensure_tables)(user.id, table_numbers, _public_base_url(request))
+    pool = get_qr_pool()
+    pngs = await asyncio.gather(*(asyncio.wrap_future(pool.submit(qr_png, number, url)) for number, url in tables))
+    codes = list(zip(table_numbers, pngs))
+
+    if export_format == 'zip':
+        content = await asyncio.wrap_future(pool.submit(render_zip, codes))
+        content_type = 'application/zip'
+    else:
+        content = await asyncio.wrap_future(pool.submit(render_sheet, codes))
+        content_type = 'application/pdf'
+    response = HttpResponse(content, content_type=content_type)
+    filename = f"tables-{table_numbers[0]}-{table_numbers[-1]}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def _conditional(request, etag, last_modified, render_response):
+    """
+    Answer a conditional GET with 304 when the client's copy is current.
+
+    render_response() is only called when the full response is needed. Both
+    the 304 and the full response carry the ETag and Last-Modified headers.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = render_response()
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def _guest_menu_response(request, snapshot, table_number):
+    menu = snapshot['menu']
     context = {
         'table_number': table_number,
-        'menu': active_menu,
-        'menu_categories': menu_categories,
+        'menu': menu,
+        'menu_categories': snapshot['categories'],
+        'image_sizes': IMAGE_SIZES,
     }
+
+    # The page is the same for every guest (no session, no CSRF token), so
+    # proxies and CDNs may share it until the menu version changes
+    response = _conditional(
+        request,
+        etag=f'"menu-version-{menu["version_id"]}"',
+        last_modified=menu['updated_at'].timestamp(),
+        render_response=lambda: render(request, 'table_view.html', context),
+    )
+    patch_cache_control(response, public=True, max_age=settings.GUEST_MENU_MAX_AGE)
+    return response
+
+
+@require_GET
+async def restaurant_table_view(request, owner_id, table_number):
+    """Guest menu of one restaurant, opened from the QR code on its table."""
+    # Usually served from this process's copy of the snapshot, without any
+    # query, so under ASGI the view itself never waits for a worker thread
+    # (Django's MiddlewareMixin middleware still run their hooks on one)
+    snapshot = await aget_tenant_menu(owner_id)
+    if not snapshot['menu']:
+        return HttpResponseNotFound("No active menu available")
+    return _guest_menu_response(request, snapshot, table_number)
+
+
+@require_GET
+def menu_version(request, version_id):
+    """A published menu version as JSON; versions never change, so it may be cached forever."""
+    snapshot = get_menu_version(version_id)
+    if snapshot is None:
+        return JsonResponse({'error': 'Menu version not found'}, status=404)
+    response = JsonResponse(snapshot)
+    patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    return response
+
+
+@require_GET
+async def table_view(request, table_number):
+    # The published menu is pre-built, so this is a single cache read
+    snapshot = await aget_published_menu()
     
-    return render(request, 'table_view.html', context)
+    if not snapshot['menu']:
+        return HttpResponseBadRequest("No active menu available")
+
+    return _guest_menu_response(request, snapshot, table_number)
+
+
+@login_required
+@require_GET
+def menu_cache_stats(request):
+    """API endpoint exposing published menu cache hit/miss counters."""
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    return JsonResponse(cache_stats())
+
+
+@login_required
+@require_GET
+def request_metrics(request):
+    """API endpoint exposing per-view latency, query and N+1 aggregates of this process."""
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    return JsonResponse({
+        'sample_rate': settings.REQUEST_METRICS_SAMPLE_RATE,
+        'n_plus_one_threshold': settings.N_PLUS_ONE_THRESHOLD,
+        'views': metrics_summary(),
+    })
 
 
+@require_GET
+def prometheus_metrics(request):
+    """The same aggregates for Prometheus; superusers or a scraper holding METRICS_TOKEN."""
+    authorization = request.headers.get('Authorization', '')
+    has_token = bool(settings.METRICS_TOKEN) and hmac.compare_digest(
+        authorization.encode('utf-8'), f'Bearer {settings.METRICS_TOKEN}'.encode('utf-8')
+    )
+    if not has_token and not request.user.is_superuser:
+        return HttpResponse('Permission denied\n', status=403, content_type='text/plain')
+    return HttpResponse(prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 def register_view(request):
     if request.method == 'POST':
@@ -180,9 +433,21 @@ def register_view(request):
     return render(request, 'register.html')  
 
 
-@csrf_exempt
+def _completion_error(error):
+    return f'OpenAI API Call failed: {str(error) or type(error).__name__}'
+
+
+@login_required
 @require_http_methods(["POST"])
-def generate_menu(request):
+async def generate_menu(request):
+    """
+    Generate AI dish descriptions.
+
+    Send {"description": "..."} for one dish, or {"descriptions": [...]} to
+    generate a whole category in one request. Completions run on a shared
+    worker pool; this view only awaits them, so under ASGI a slow completion
+    does not hold a worker.
+    """
     try:
         if not request.body:
             return JsonResponse({'error': 'Request body is empty'}, status=400)
@@ -192,38 +457,43 @@ def generate_menu(request):
         except json.JSONDecodeError as e:
             return JsonResponse({'error': f'JSON Parsing error: {str(e)}'}, status=400)
 
-        description = data.get('description')
-        if not description:
+        descriptions = data.get('descriptions')
+        batch = descriptions is not None
+        if not batch:
+            descriptions = [data.get('description')]
+        if not isinstance(descriptions, list) or not descriptions:
+            return JsonResponse({'error': 'descriptions must be a non-empty list'}, status=400)
+        if len(descriptions) > settings.AI_MAX_BATCH_SIZE:
+            return JsonResponse({'error': f'At most {settings.AI_MAX_BATCH_SIZE} descriptions per request'}, status=400)
+        if not all(isinstance(d, str) and d.strip() for d in descriptions):
             return JsonResponse({'error': 'Lack of description fields'}, status=400)
 
-        try:
-            client = openai.OpenAI(
-                api_key=os.getenv("OPENAI_API_KEY")
-            )
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are an expert in dish description"},
-                    {"role": "user", "content": f"Please generate a concise description of the dish based on the following description:\n{description}"}
-                ],
-                temperature=0.7,
-                max_tokens=150
-            )
-            ai_output = response.choices[0].message.content.strip()
-            return JsonResponse({'menu': ai_output})
+        generator = get_description_generator()
+        # Identical descriptions share one future; shielded, a client that
+        # disconnects cannot cancel it for the others waiting on it
+        futures = [asyncio.shield(asyncio.wrap_future(generator.submit(d))) for d in descriptions]
+        results = await asyncio.gather(*futures, return_exceptions=True)
 
-        except Exception as e:
-            return JsonResponse({'error': f'OpenAI API Call failed: {str(e)}'}, status=500)
+        # A cancelled completion comes back as CancelledError, a BaseException
+        if not batch:
+            if isinstance(results[0], BaseException):
+                return JsonResponse({'error': _completion_error(results[0])}, status=500)
+            return JsonResponse({'menu': results[0]})
+
+        return JsonResponse({'menus': [
+            {'description': d, 'error': _completion_error(r)} if isinstance(r, BaseException)
+            else {'description': d, 'menu': r}
+            for d, r in zip(descriptions, results)
+        ]})
 
     except Exception as e:
         return JsonResponse({'error': f'Server error: {str(e)}'}, status=500)
 
 # A class-based view to manage and display a paginated list of subscribers
-class ManageSubscribersView(ListView):
+class ManageSubscribersView(UserPassesTestMixin, ListView):
     model = CustomUser
     template_name = "manage_subscribers.html"
     context_object_name = "users"
-    paginate_by = 5
 
     def test_func(self):
         return self.request.user.is_superuser  # only superuser
@@ -235,14 +505,34 @@ class ManageSubscribersView(ListView):
             return super().handle_no_permission()
 
     def get_queryset(self):
-        queryset = CustomUser.objects.all()
-        search_query = self.request.GET.get("search", "")
-        if search_query:
-            queryset = queryset.filter(
-                Q(username__icontains=search_query) |
-                Q(email__icontains=search_query)
-            )
-        return queryset
+        # One page keyed on id, with each user's stats, in a single query
+        self.search = self.request.GET.get("search", "")
+        try:
+            self.after = int(self.request.GET["after"]) if self.request.GET.get("after") else None
+        except ValueError:
+            self.after = None
+        users, self.next_after = get_subscriber_page(self.search, self.after)
+        return users
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        total, total_is_exact = estimate_subscribers(self.search)
+
+        # Query string for the "next" link keeps the search
+        next_params = None
+        if self.next_after is not None:
+            params = self.request.GET.copy()
+            params["after"] = self.next_after
+            next_params = params.urlencode()
+
+        context.update({
+            "search": self.search,
+            "total": total,
+            "total_is_exact": total_is_exact,
+            "is_first_page": self.after is None,
+            "next_params": next_params,
+        })
+        return context
 
 
 
@@ -278,111 +568,92 @@ class SubscriberArchiveView(View):
         messages.success(request, f"User '{user.username}' has been archived.")
         return redirect(reverse_lazy("manage"))
 
-def submit_order(request):
-    if request.method == 'POST':
-        table_number = request.POST.get('table')
-        total_price = request.POST.get('total_price')
-        special_instructions = request.POST.get('special_instructions', '')
-        user = request.user if request.user.is_authenticated else None
-        
-        if not table_number or not total_price:
-            return HttpResponseBadRequest("Missing table number or total price")
-        
-        # Find or create table
-        table, created = Table.objects.get_or_create(
-            table_number=table_number,
-            defaults={'user': user, 'active': True}
-        )
-        
-        # Create order
-        order = Order.objects.create(
-            table=table,
-            user=user,
-            total_amount=total_price,
-            special_instructions=special_instructions if hasattr(Order, 'special_instructions') else None
+# Guests order from a page that proxies cache and share, so it cannot carry a
+# per-visitor CSRF token. Orders are priced server-side and only ever add rows.
+@csrf_exempt
+@require_http_methods(["POST"])
+async def submit_order(request):
+    user = await request.auser()
+    user = user if user.is_authenticated else None
+    wants_json = (
+        request.content_type == 'application/json'
+        or request.get_preferred_type(['text/html', 'application/json']) == 'application/json'
+    )
+
+    try:
+        table_number, special_instructions, lines, menu_version_id, idempotency_key = parse_order_lines(request)
+        # Items priced from the menu version the guest saw, lines inserted in
+        # one batch; a retry with the same key gets the order placed first
+        order = await acreate_order(
+            table_number, lines, user=user, special_instructions=special_instructions,
+            menu_version_id=menu_version_id, idempotency_key=idempotency_key,
         )
-        
-        # Process order items
-        item_count = 0
-        while True:
-            item_id = request.POST.get(f'item_id_{item_count}')
-            item_name = request.POST.get(f'item_name_{item_count}')
-            item_quantity = request.POST.get(f'item_quantity_{item_count}')
-            item_price = request.POST.get(f'item_price_{item_count}')
-            
-            if not item_name or not item_quantity or not item_price:
-                break
-                
-            try:
-                # Try to find the menu item
-                menu_item = MenuItem.objects.get(id=item_id, active=True)
-                
-                # Create order item
-                OrderItem.objects.create(
-                    order=order,
-                    item=menu_item,
-                    quantity=item_quantity,
-                    price=item_price
-                )
-                
-                item_count += 1
-            except MenuItem.DoesNotExist:
-                # If the item doesn't exist, log error but continue with other items
-                print(f"Menu item '{item_name}' not found or not active")
-                item_count += 1
-                continue
-        
-        if request.accepts("application/json"):
-            return JsonResponse({
-                "success": True,
-                "order_id": order.id,
-                "message": "Order submitted successfully"
-            })
-        else:
-            # Redirect back to the table view with a success parameter
-            return redirect(f"{reverse('table_view', args=[table_number])}?order_success=true")
-            
-    return HttpResponseBadRequest("Invalid request method")
+    except ValueError as e:
+        if wants_json:
+            return JsonResponse({'error': str(e)}, status=400)
+        return HttpResponseBadRequest(str(e))
+
+    if wants_json:
+        return JsonResponse({
+            "success": True,
+            "order_id": order.id,
+            "total_amount": float(order.total_amount),
+            "message": "Order submitted successfully"
+        })
+    else:
+        # Redirect back to the restaurant's table page with a success parameter
+        page = reverse('restaurant_table_view', args=[order.table.user_id, table_number])
+        return redirect(f"{page}?order_success=true")
 
 def get_menus(request):
-    """API endpoint to get all menus for the current user."""
+    """
+    API endpoint to get all menus for the current user, or only ?menu_id=<id>.
+
+    Categories and items come from one prefetch query each, so the number
+    of queries does not grow with the menus. Supports conditional GET: the
+    ETag is derived from the ids and versions of the user's menus, so an
+    unchanged menu list costs one small query and a 304.
+    """
     if not request.user.is_authenticated:
         return JsonResponse({'error': 'Authentication required'}, status=401)
-    
+
     menus = Menu.objects.filter(user=request.user, archived=False).order_by('-updated_at')
-    menus_data = []
-    
-    for menu in menus:
-        # Get categories for this menu
-        categories = MenuCategory.objects.filter(menu=menu, active=True).order_by('order')
-        menu_data = {
+    if request.GET.get('menu_id'):
+        try:
+            menus = menus.filter(id=int(request.GET['menu_id']))
+        except ValueError:
+            return JsonResponse({'error': 'menu_id must be an integer'}, status=400)
+
+    versions = list(menus.values_list('id', 'version', 'updated_at'))
+    if request.GET.get('menu_id') and not versions:
+        return JsonResponse({'error': 'Menu not found'}, status=404)
+    etag = '"menus-%s"' % hashlib.md5(
+        ','.join(f'{menu_id}:{version}' for menu_id, version, _ in versions).encode('ascii')
+    ).hexdigest()
+    last_modified = max((updated_at for _, _, updated_at in versions), default=None)
+
+    response = _conditional(
+        request,
+        etag=etag,
+        last_modified=last_modified.timestamp() if last_modified else None,
+        render_response=lambda: _render_menus(menus),
+    )
+    # Private data: browsers keep it but must revalidate before each use
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _render_menus(menus):
+    return JsonResponse({'menus': [
+        {
             'id': menu.id,
             'name': menu.name,
             'description': menu.description or '',
-            'data': {},
-            "active": menu.active,
+            'data': editor_data(menu),
+            'active': menu.active,
         }
-        
-        # Add categories and items
-        for category in categories:
-            items = MenuItem.objects.filter(category=category, active=True)
-            category_items = []
-            
-            for item in items:
-                item_data = {
-                    'id': item.id,
-                    'name': item.name,
-                    'description': item.description or '',
-                    'price': float(item.price),
-                    'image': item.image.url if item.image else '',
-                }
-                category_items.append(item_data)
-            
-            menu_data['data'][category.name] = category_items
-        
-        menus_data.append(menu_data)
-    
-    return JsonResponse({'menus': menus_data})
+        for menu in with_editor_data(menus)
+    ]})
 
 @csrf_exempt
 def create_menu(request):
@@ -416,6 +687,7 @@ def create_menu(request):
             name=menu_name,
             description=menu_description
         )
+        publish_menu_on_commit(Menu.objects.filter(id=menu.id))
 
         return JsonResponse({
             'success': True,
@@ -456,6 +728,7 @@ def update_menu(request, menu_id):
                 menu.active = bool(menu_active)
             
             menu.save()
+            publish_menu_on_commit(Menu.objects.filter(id=menu.id))
             
             return JsonResponse({'success': True})
         
@@ -467,6 +740,7 @@ def update_menu(request, menu_id):
             # Soft delete by marking as archived
             menu.archived = True
             menu.save()
+            publish_menu_on_commit(Menu.objects.filter(id=menu.id))
             return JsonResponse({'success': True})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
@@ -486,96 +760,90 @@ def save_menu_data(request, menu_id):
     
     try:
         data = json.loads(request.body)
-        menu_data = data.get('data', {})
-        
-        # Deactivate all existing categories for this menu first
-        # This is a soft delete approach
-        MenuCategory.objects.filter(menu=menu).update(active=False)
-        
-        # Process each category
-        for order, (category_name, items) in enumerate(menu_data.items()):
-            # Get or create the category
-            category, created = MenuCategory.objects.get_or_create(
-                menu=menu,
-                name=category_name,
-                defaults={'order': order, 'active': True}
-            )
-            
-            if not created:
-                # If the category already existed but was deactivated, reactivate it
-                category.active = True
-                category.order = order
-                category.save()
-            
-            # Deactivate all existing items for this category
-            MenuItem.objects.filter(category=category).update(active=False)
-            
-            # Process items in this category
-            for item_data in items:
-                item_name = item_data.get('name', '').strip()
-                item_price = item_data.get('price', 0)
-                item_description = item_data.get('description', '').strip()
-                item_image = item_data.get('image', '')
-                item_id = item_data.get('id', None)
-                
-                if not item_name:
-                    continue
-                
-                if item_id:
-                    # Try to update existing item
-                    try:
-                        item = MenuItem.objects.get(id=item_id, category__menu=menu)
-                        item.name = item_name
-                        item.price = item_price
-                        item.description = item_description
-                        item.active = True
-                        
-                        # Handle image if it's a new data URL
-                        if item_image and item_image.startswith('data:image'):
-                            # Code to save the data URL as an image file
-                            # This is a simplified approach and may need refinement
-                            import base64, uuid
-                            from django.core.files.base import ContentFile
-                            
-                            format, imgstr = item_image.split(';base64,')
-                            ext = format.split('/')[-1]
-                            data = ContentFile(base64.b64decode(imgstr), name=f"{uuid.uuid4()}.{ext}")
-                            item.image = data
-                        
-                        item.save()
-                    except MenuItem.DoesNotExist:
-                        # If the item doesn't exist or belongs to another menu, create a new one
-                        item_id = None
-                
-                if not item_id:
-                    # Create new item
-                    item = MenuItem(
-                        category=category,
-                        name=item_name,
-                        price=item_price,
-                        description=item_description,
-                        active=True
-                    )
-                    
-                    # Handle image if provided
-                    if item_image and item_image.startswith('data:image'):
-                        import base64, uuid
-                        from django.core.files.base import ContentFile
-                        
-                        format, imgstr = item_image.split(';base64,')
-                        ext = format.split('/')[-1]
-                        data = ContentFile(base64.b64decode(imgstr), name=f"{uuid.uuid4()}.{ext}")
-                        item.image = data
-                    
-                    item.save()
-        
-        return JsonResponse({'success': True})
-    
+    except json.JSONDecodeError as e:
+        return JsonResponse({'error': f'JSON Parsing error: {str(e)}'}, status=400)
+
+    menu_data = data.get('data', {})
+    if not isinstance(menu_data, dict):
+        return JsonResponse({'error': 'data must map category names to item lists'}, status=400)
+
+    try:
+        # Diff against the stored menu and write only what changed, atomically
+        changes = apply_menu_data(menu, menu_data)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return JsonResponse({'error': str(e)}, status=500)
 
+    if any(changes.values()):
+        publish_menu_on_commit(Menu.objects.filter(id=menu.id))
+    return JsonResponse({
+        'success': True,
+        'inserted': changes['inserted'],
+        'updated': changes['updated'],
+        'deactivated': changes['deactivated'],
+        'data': serialize_menu_data(menu),
+    })
+
+def _image_too_large():
+    return JsonResponse({'error': f'Image is larger than {settings.MENU_IMAGE_MAX_BYTES} bytes'}, status=413)
+
+
+# CSRF is checked by _store_uploaded_image: the middleware would read the
+# body before the size limit below is in place
+@csrf_exempt
+def upload_menu_image(request):
+    """
+    API endpoint storing one menu photo, sent as multipart field "image".
+
+    Django spools large uploads to a temporary file and the photo is hashed
+    and copied to storage in chunks, so it is never held in memory whole.
+    Uploads over MENU_IMAGE_MAX_BYTES are refused from their Content-Length,
+    or as soon as that much has been read, before reaching the disk.
+    Returns the image id that menu items reference as image_id.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > settings.MENU_IMAGE_MAX_BYTES + MULTIPART_OVERHEAD:
+        return _image_too_large()
+
+    limit = UploadSizeLimitHandler(settings.MENU_IMAGE_MAX_BYTES, request)
+    request.upload_handlers.insert(0, limit)
+    return _store_uploaded_image(request, limit)
+
+
+@csrf_protect
+def _store_uploaded_image(request, limit):
+    upload = request.FILES.get('image')
+    if limit.exceeded:
+        return _image_too_large()
+    if upload is None:
+        return JsonResponse({'error': 'Missing "image" file'}, status=400)
+
+    try:
+        with transaction.atomic():
+            image = store_image(upload)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    src, _ = image_sources(image)
+    return JsonResponse({
+        'id': image.id,
+        'url': src,
+        'width': image.width,
+        'height': image.height,
+    }, status=201)
+
 @csrf_exempt
 def menu_list(request):
     if request.method == 'GET':
@@ -585,42 +853,127 @@ def menu_list(request):
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 @require_GET
-def get_order_details(request, order_id):
+async def get_order_details(request, order_id):
+    """
+    An order's status and items, as polled by the guest who placed it.
+
+    Order ids are sequential, so only the restaurant the order belongs to
+    (or a superuser) gets the full order with its table, times and notes.
+    """
     try:
-        # Get the order
-        order = Order.objects.get(id=order_id)
-        
-        # Get all items for this order
-        order_items = OrderItem.objects.filter(order=order).select_related('item')
-        
-        # Format date and time
-        date_str = order.updated_at.strftime('%Y-%m-%d')
-        time_str = order.updated_at.strftime('%I:%M %p')
-        
-        # Format items
-        items_data = []
-        for item in order_items:
-            items_data.append({
-                'item_name': item.item.name,
-                'quantity': item.quantity,
-                'price': float(item.price),
-                'subtotal': float(item.price * item.quantity)
-            })
-        
-        # Create response data
-        order_data = {
-            'id': order.id,
-            'table_number': order.table.id,
-            'status': order.status,
-            'date': date_str,
-            'time': time_str,
-            'total_amount': float(order.total_amount),
-            'items': items_data
-        }
-        
-        return JsonResponse(order_data)
+        # Order, table and items in two queries
+        order = await order_feed_queryset().aget(id=order_id)
+        user = await request.auser()
+        if user.is_authenticated and (user.is_superuser or order.table.user_id == user.id):
+            return JsonResponse(serialize_order_detail(order))
+        return JsonResponse(serialize_guest_order(order))
     
     except Order.DoesNotExist:
         return JsonResponse({'error': 'Order not found'}, status=404)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_GET
+def get_order_changes(request):
+    """
+    API endpoint returning orders created or modified since a cursor.
+
+    Pass the cursor from the previous response as ?since=..., or a raw
+    position as ?updated_at=<ISO 8601>&id=<order id>. Without either the feed
+    starts at the oldest order. Keep calling with the returned cursor while
+    has_more is true. Only the user's restaurant's orders are included
+    (every restaurant's for superusers).
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    try:
+        if request.GET.get('since'):
+            since = decode_cursor(request.GET['since'])
+        elif request.GET.get('updated_at'):
+            updated_at = parse_datetime(request.GET['updated_at'])
+            if updated_at is None:
+                raise ValueError("Invalid updated_at")
+            since = (updated_at, int(request.GET.get('id', 0)))
+        else:
+            since = None
+        limit = min(int(request.GET.get('limit', CHANGES_PAGE_SIZE)), CHANGES_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    orders, cursor, has_more = get_changed_orders(since, limit, owner=_order_owner(request))
+    return JsonResponse({
+        'orders': [serialize_order_detail(order) for order in orders],
+        'cursor': cursor,
+        'has_more': has_more,
+    })
+
+
+@require_GET
+def export_orders(request):
+    """
+    Stream the orders of a date range with their line items, then per-day totals.
+
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD (inclusive) and &format=csv (default)
+    or jsonl. Rows are written as they are read, so a year of orders is
+    exported in constant memory. Superusers export every restaurant.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    try:
+        start, end, export_format = parse_export_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    owner = _order_owner(request)
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    # Each server gets the iterator it can stream without buffering the export
+    export = aiter_export if isinstance(request, ASGIRequest) else iter_export
+    response = StreamingHttpResponse(export(start, end, export_format, owner), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="orders-{start}-{end}.{export_format}"'
+    return response
+
+
+@require_GET
+def sales_analytics(request):
+    """
+    Quantity and pre-tax revenue of the user's restaurant, from the sales rollup.
+
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD (inclusive, default the last 30 days)
+    and &group_by=day (default), table or item.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    try:
+        start, end, group_by = parse_sales_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse(sales_summary(request.user, start, end, group_by))
+
+
+@require_GET
+def search_menu_items(request):
+    """
+    Full-text search over the user's menu items, their descriptions and categories.
+
+    ?q=<words> (prefix matches, all words required), optionally &menu_id=,
+    &active=true (default), false or all, and &limit= (default 20).
+    Superusers search every restaurant.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    try:
+        terms, menu_id, active, limit = parse_search_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    owner = None if request.user.is_superuser else request.user
+    items = search_items(terms, owner=owner, menu_id=menu_id, active=active, limit=limit)
+    return JsonResponse({'results': [serialize_search_result(item) for item in items]})